@@ -0,0 +1,150 @@
+"""
+Dynamic micro-batching for inference requests.
+
+Compatible requests arriving within a short window are grouped and executed as a single
+batched call on the inference executor, then the results are handed back to each caller.
+"""
+
+import asyncio
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, field
+from typing import Any, Generic, TypeVar
+
+from executor import InferenceExecutor
+from timing import RequestTiming, current_timings, recording
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class _PendingBatch(Generic[T, R]):
+    """A batch that is still collecting items."""
+
+    items: list[T] = field(default_factory=list)
+    futures: list["asyncio.Future[R]"] = field(default_factory=list)
+    # Timings of the requests in the batch, which all share its stages
+    timings: list[RequestTiming] = field(default_factory=list)
+    timer: asyncio.TimerHandle | None = None
+
+
+class BatchScheduler(Generic[T, R]):
+    """Groups compatible requests into batches and runs them on an inference executor."""
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[T]], list[R | Exception]],
+        batch_key: Callable[[T], Hashable],
+        executor: InferenceExecutor,
+        max_batch_size: int = 4,
+        max_wait: float = 0.02,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            run_batch: Blocking function that processes a batch, returning one result per item;
+                an exception in place of a result is raised to that item's caller
+            batch_key: Function mapping an item to a key; only items with equal keys are batched
+            executor: Executor the batches run on
+            max_batch_size: Maximum number of items per batch
+            max_wait: Maximum time an item waits for more items to join its batch, in seconds
+        """
+        self.run_batch = run_batch
+        self.batch_key = batch_key
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+
+        self._open: dict[Hashable, _PendingBatch[T, R]] = {}
+        self._batches = 0
+        self._items = 0
+        self._size_counts: dict[int, int] = {}
+
+    async def submit(self, item: T) -> R:
+        """
+        Submit an item and wait for its result.
+
+        Args:
+            item: Item to process
+
+        Returns:
+            Result for this item
+
+        Raises:
+            QueueFullError: If a new batch is needed and the executor queue is full
+        """
+        key = self.batch_key(item)
+        batch = self._open.get(key)
+
+        if batch is None:
+            # A new batch will take an executor slot, so reject early if there is none
+            self.executor.check_capacity()
+            batch = _PendingBatch[T, R]()
+            self._open[key] = batch
+            if self.max_batch_size > 1:
+                loop = asyncio.get_running_loop()
+                batch.timer = loop.call_later(self.max_wait, self._flush, key)
+
+        future: asyncio.Future[R] = asyncio.get_running_loop().create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        batch.timings.extend(current_timings())
+
+        if len(batch.items) >= self.max_batch_size:
+            self._flush(key)
+
+        return await future
+
+    def _flush(self, key: Hashable) -> None:
+        """Close the batch for `key` and start running it."""
+        batch = self._open.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: _PendingBatch[T, R]) -> None:
+        """Run a closed batch and distribute its results."""
+        size = len(batch.items)
+        self._batches += 1
+        self._items += size
+        self._size_counts[size] = self._size_counts.get(size, 0) + 1
+
+        try:
+            with recording(*batch.timings):
+                results = await self.executor.run(self.run_batch, batch.items)
+            if len(results) != size:
+                raise ValueError(f"Batch returned {len(results)} results for {size} items")
+        except Exception as error:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for future, result in zip(batch.futures, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get batching statistics.
+
+        Returns:
+            Dictionary with batch counts, average batch size, fill ratio, and size histogram
+        """
+        average_size = self._items / self._batches if self._batches else 0.0
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+            "batches": self._batches,
+            "items": self._items,
+            "average_batch_size": average_size,
+            "average_fill": average_size / self.max_batch_size,
+            "size_histogram": dict(sorted(self._size_counts.items())),
+        }
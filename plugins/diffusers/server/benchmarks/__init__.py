@@ -0,0 +1,8 @@
+"""
+Benchmarks for the diffusers server.
+
+Every benchmark runs on CPU with tiny randomly initialized models that are built
+locally, so no weights are downloaded and no GPU is needed. The numbers measure the
+server's own overhead (request handling, image encoding, caching, batching, memory),
+not the speed of real models.
+"""
@@ -0,0 +1,506 @@
+"""
+Load test for the diffusers server.
+
+Simulates concurrent clients replaying a weighted mix of workloads over HTTP and reports
+how latency, throughput, rejections and the server's memory change with the number of
+clients. By default a local server with the tiny benchmark models is started for the run
+(see `benchmarks.serve`); `--url` targets an already running server instead.
+
+Run from `plugins/diffusers/server`:
+
+    python -m benchmarks.loadtest                            # 1, 8 and 64 clients
+    python -m benchmarks.loadtest --concurrency 4,16 --duration 60
+    python -m benchmarks.loadtest --workers 2                # inference in worker processes
+    python -m benchmarks.loadtest --mix my-mix.json --url http://gpu-host:8001
+
+A mix is a JSON list of scenarios. Each client repeatedly picks a scenario by weight and
+sends its requests one after another, the way a user runs a batch in the image
+generator:
+
+    [
+      {"name": "seed-sweep", "weight": 4, "path": "/text-to-image", "seeds": 4,
+       "body": {"prompt": "a lighthouse", "model_id": "$model", "num_inference_steps": 4}},
+      {"name": "upscale", "weight": 1, "path": "/upscale",
+       "body": {"image": "$image:64", "factor": 2}}
+    ]
+
+`seeds: N` sends N requests with consecutive seeds from a random start, `prompts: [...]`
+one request per prompt. In bodies, `$model` is replaced by `--model-id`, `$image:SIZE`
+by a fresh SIZE x SIZE image and `$mask:SIZE` by a mask covering its center.
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+from PIL import Image
+
+from benchmarks.run import percentile, sample_image
+
+# Mix used without `--mix`: seed sweeps and prompt variations like the image generator's
+# batch mode sends, with inpainting, ControlNet and upscaling
+DEFAULT_MIX: list[dict[str, Any]] = [
+    {
+        "name": "text-to-image-seed-sweep",
+        "weight": 4,
+        "path": "/text-to-image",
+        "seeds": 4,
+        "body": {
+            "prompt": "a lighthouse on a cliff at dusk",
+            "model_id": "$model",
+            "num_inference_steps": 4,
+            "width": 64,
+            "height": 64,
+        },
+    },
+    {
+        "name": "text-to-image-prompt-variations",
+        "weight": 2,
+        "path": "/text-to-image",
+        "prompts": ["a red fox", "a red fox in the snow", "a red fox, watercolor"],
+        "body": {"model_id": "$model", "num_inference_steps": 4, "width": 64, "height": 64},
+    },
+    {
+        "name": "inpaint",
+        "weight": 2,
+        "path": "/inpaint",
+        "body": {
+            "prompt": "a wooden door",
+            "model_id": "$model",
+            "image": "$image:64",
+            "mask": "$mask:64",
+            "num_inference_steps": 4,
+            "width": 64,
+            "height": 64,
+        },
+    },
+    {
+        "name": "controlnet",
+        "weight": 1,
+        "path": "/controlnet/generate",
+        "body": {
+            "prompt": "a castle",
+            "model_id": "$model",
+            "image": "$image:64",
+            "type": "canny",
+            "num_inference_steps": 4,
+            "width": 64,
+            "height": 64,
+        },
+    },
+    {
+        "name": "upscale",
+        "weight": 1,
+        "path": "/upscale",
+        "body": {"image": "$image:64", "factor": 2},
+    },
+]
+
+# Server metrics sampled during each run
+RSS_METRIC = "viwo_diffusers_process_resident_memory_bytes"
+QUEUED_METRIC = "viwo_diffusers_inference_queued"
+
+
+@dataclass
+class Scenario:
+    """A sequence of requests a client sends in one go."""
+
+    name: str
+    path: str
+    body: dict[str, Any]
+    weight: float = 1.0
+    seeds: int | None = None
+    prompts: list[str] | None = None
+
+    def bodies(self, rng: random.Random) -> list[dict[str, Any]]:
+        """Get the request bodies of one run of the scenario, before substitution."""
+        if self.seeds is not None:
+            start = rng.randrange(2**31)
+            return [{**self.body, "seed": start + index} for index in range(self.seeds)]
+        if self.prompts is not None:
+            return [{**self.body, "prompt": prompt} for prompt in self.prompts]
+        return [self.body]
+
+
+@dataclass
+class Sample:
+    """Outcome of one request."""
+
+    scenario: str
+    path: str
+    status: int  # 0 when the request failed without a response
+    seconds: float
+
+
+@dataclass
+class Level:
+    """Samples and server measurements of a run at one concurrency level."""
+
+    clients: int
+    samples: list[Sample] = field(default_factory=list)
+    elapsed: float = 0.0
+    rss: list[float] = field(default_factory=list)
+    queued: list[float] = field(default_factory=list)
+
+
+def _image(size: int, rng: random.Random) -> str:
+    """Encode a fresh test image, so results are never served from the server's cache."""
+    buffer = io.BytesIO()
+    sample_image(size, seed=rng.randrange(2**31)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _mask(size: int) -> str:
+    """Encode a mask whose center half is white."""
+    mask = Image.new("L", (size, size), 0)
+    mask.paste(255, (size // 4, size // 4, size * 3 // 4, size * 3 // 4))
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def substitute(value: Any, model_id: str, rng: random.Random) -> Any:
+    """Replace the `$model`, `$image:SIZE` and `$mask:SIZE` placeholders in a body."""
+    if isinstance(value, dict):
+        return {key: substitute(item, model_id, rng) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, model_id, rng) for item in value]
+    if value == "$model":
+        return model_id
+    if isinstance(value, str) and value.startswith("$image:"):
+        return _image(int(value.removeprefix("$image:")), rng)
+    if isinstance(value, str) and value.startswith("$mask:"):
+        return _mask(int(value.removeprefix("$mask:")))
+    return value
+
+
+def parse_metrics(text: str, names: tuple[str, ...]) -> dict[str, float]:
+    """Read metrics from a Prometheus text exposition, summing their labeled samples."""
+    values: dict[str, float] = {}
+    for line in text.splitlines():
+        series, _, value = line.rpartition(" ")
+        name = series.partition("{")[0]
+        if name in names:
+            values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+
+class LoadTest:
+    """Runs simulated clients against a server."""
+
+    def __init__(self, url: str, scenarios: list[Scenario], model_id: str, seed: int = 0):
+        """
+        Initialize the load test.
+
+        Args:
+            url: Base URL of the server
+            scenarios: Workload mix
+            model_id: Model substituted for `$model`
+            seed: Seed of the clients' scenario picks
+        """
+        self.url = url
+        self.scenarios = scenarios
+        self.weights = [scenario.weight for scenario in scenarios]
+        self.model_id = model_id
+        self.seed = seed
+
+    async def send(
+        self, client: httpx.AsyncClient, scenario: Scenario, body: dict[str, Any]
+    ) -> tuple[Sample, float]:
+        """
+        Send one request.
+
+        Args:
+            client: HTTP client
+            scenario: Scenario the request belongs to
+            body: Request body
+
+        Returns:
+            The sample, and the seconds the server asked to wait before retrying (0 if it
+            did not reject the request)
+        """
+        started = time.perf_counter()
+        try:
+            response = await client.post(scenario.path, json=body)
+        except httpx.HTTPError:
+            return Sample(scenario.name, scenario.path, 0, time.perf_counter() - started), 0.0
+        seconds = time.perf_counter() - started
+        retry_after = 0.0
+        if response.status_code in (429, 503):
+            retry_after = float(response.headers.get("retry-after", "1"))
+        return Sample(scenario.name, scenario.path, response.status_code, seconds), retry_after
+
+    async def client(
+        self, index: int, http: httpx.AsyncClient, deadline: float, level: Level
+    ) -> None:
+        """
+        Replay scenarios until the deadline.
+
+        Rejected requests (429/503) are retried after the server's `Retry-After`, like a
+        well-behaved client; every attempt is recorded.
+
+        Args:
+            index: Client number, which seeds its choices
+            http: HTTP client shared by all clients
+            deadline: Monotonic time after which no new requests are sent
+            level: Level the samples are recorded in
+        """
+        rng = random.Random(self.seed * 100_003 + index)
+        while time.monotonic() < deadline:
+            scenario = rng.choices(self.scenarios, self.weights)[0]
+            for template in scenario.bodies(rng):
+                body = substitute(template, self.model_id, rng)
+                while time.monotonic() < deadline:
+                    sample, retry_after = await self.send(http, scenario, body)
+                    level.samples.append(sample)
+                    if not retry_after:
+                        break
+                    await asyncio.sleep(min(retry_after, max(0.0, deadline - time.monotonic())))
+                if time.monotonic() >= deadline:
+                    return
+
+    async def monitor(self, http: httpx.AsyncClient, level: Level, stop: asyncio.Event) -> None:
+        """Sample the server's resident memory and queue depth every half second."""
+        while not stop.is_set():
+            try:
+                response = await http.get("/metrics")
+                values = parse_metrics(response.text, (RSS_METRIC, QUEUED_METRIC))
+                if RSS_METRIC in values:
+                    level.rss.append(values[RSS_METRIC])
+                if QUEUED_METRIC in values:
+                    level.queued.append(values[QUEUED_METRIC])
+            except httpx.HTTPError:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=0.5)
+            except TimeoutError:
+                pass
+
+    async def warm_up(self) -> None:
+        """Send every scenario once, so model loading is not measured."""
+        rng = random.Random(self.seed)
+        async with httpx.AsyncClient(base_url=self.url, timeout=600) as http:
+            for scenario in self.scenarios:
+                body = substitute(scenario.bodies(rng)[0], self.model_id, rng)
+                sample, _ = await self.send(http, scenario, body)
+                if sample.status != 200:
+                    raise RuntimeError(
+                        f"Warmup request for {scenario.name} returned {sample.status}"
+                    )
+
+    async def run(self, clients: int, duration: float) -> Level:
+        """
+        Run a number of concurrent clients for a while.
+
+        Requests still in flight at the deadline are waited for and counted.
+
+        Args:
+            clients: Number of concurrent clients
+            duration: Seconds to start new requests for
+
+        Returns:
+            The level's samples and server measurements
+        """
+        level = Level(clients)
+        limits = httpx.Limits(max_connections=clients + 1)
+        async with httpx.AsyncClient(base_url=self.url, timeout=600, limits=limits) as http:
+            stop = asyncio.Event()
+            monitor = asyncio.create_task(self.monitor(http, level, stop))
+            started = time.perf_counter()
+            deadline = time.monotonic() + duration
+            await asyncio.gather(
+                *(self.client(index, http, deadline, level) for index in range(clients))
+            )
+            level.elapsed = time.perf_counter() - started
+            stop.set()
+            await monitor
+        return level
+
+
+def latency_summary(samples: list[Sample]) -> dict[str, Any]:
+    """Summarize the latencies of successful requests in milliseconds."""
+    seconds = [sample.seconds for sample in samples if sample.status == 200]
+    if not seconds:
+        return {"requests": 0}
+    return {
+        "requests": len(seconds),
+        "mean_ms": round(statistics.fmean(seconds) * 1000, 1),
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 1),
+        "p90_ms": round(percentile(seconds, 0.90) * 1000, 1),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 1),
+        "max_ms": round(max(seconds) * 1000, 1),
+    }
+
+
+def level_report(level: Level) -> dict[str, Any]:
+    """Build the report of one concurrency level."""
+    succeeded = sum(sample.status == 200 for sample in level.samples)
+    rejected = sum(sample.status in (429, 503) for sample in level.samples)
+    by_path: dict[str, list[Sample]] = {}
+    by_scenario: dict[str, list[Sample]] = {}
+    for sample in level.samples:
+        by_path.setdefault(sample.path, []).append(sample)
+        by_scenario.setdefault(sample.scenario, []).append(sample)
+    return {
+        "clients": level.clients,
+        "elapsed_s": round(level.elapsed, 2),
+        "requests": len(level.samples),
+        "succeeded": succeeded,
+        "rejected": rejected,
+        "failed": len(level.samples) - succeeded - rejected,
+        "throughput_rps": round(succeeded / level.elapsed, 2) if level.elapsed else 0.0,
+        "latency": latency_summary(level.samples),
+        "endpoints": {path: latency_summary(samples) for path, samples in by_path.items()},
+        "scenarios": {name: latency_summary(samples) for name, samples in by_scenario.items()},
+        "server": {
+            "peak_rss_mb": round(max(level.rss) / 1024**2, 1) if level.rss else None,
+            "mean_queued": round(statistics.fmean(level.queued), 2) if level.queued else None,
+            "max_queued": max(level.queued) if level.queued else None,
+        },
+    }
+
+
+def print_report(levels: list[dict[str, Any]]) -> None:
+    """Print a table of the levels and a per-endpoint breakdown."""
+    print(
+        f"\n{'clients':>7} {'ok':>7} {'rejected':>8} {'failed':>6} {'req/s':>8}"
+        f" {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>8} {'queued':>6}"
+    )
+    for level in levels:
+        latency, server = level["latency"], level["server"]
+        print(
+            f"{level['clients']:>7} {level['succeeded']:>7} {level['rejected']:>8}"
+            f" {level['failed']:>6} {level['throughput_rps']:>8.2f}"
+            f" {latency.get('p50_ms', 0):>9.1f} {latency.get('p99_ms', 0):>9.1f}"
+            f" {server['peak_rss_mb'] or 0:>8.1f} {server['max_queued'] or 0:>6.0f}"
+        )
+    for level in levels:
+        print(f"\n{level['clients']} clients")
+        for path, latency in sorted(level["endpoints"].items()):
+            if latency["requests"]:
+                print(
+                    f"  {path:<24} {latency['requests']:>6} ok"
+                    f"   p50 {latency['p50_ms']:>9.1f} ms   p99 {latency['p99_ms']:>9.1f} ms"
+                )
+
+
+def free_port() -> int:
+    """Get a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(url: str, server: subprocess.Popen[bytes], within: float) -> None:
+    """Wait up to `within` seconds for a started server to report itself ready."""
+    deadline = time.monotonic() + within
+    async with httpx.AsyncClient(base_url=url, timeout=1) as http:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with status {server.returncode}")
+            try:
+                if (await http.get("/ready")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server did not start within {within:.0f}s")
+
+
+async def run_levels(
+    args: argparse.Namespace, url: str, mix: list[dict[str, Any]]
+) -> list[dict[str, Any]]:
+    """Warm the server up and run every concurrency level."""
+    test = LoadTest(url, [Scenario(**scenario) for scenario in mix], args.model_id, args.seed)
+
+    await test.warm_up()
+    levels: list[dict[str, Any]] = []
+    for clients in args.concurrency:
+        print(f"Running {clients} client(s) for {args.duration:g}s", flush=True)
+        levels.append(level_report(await test.run(clients, args.duration)))
+    return levels
+
+
+def main() -> int:
+    """Run the load test from the command line."""
+    parser = argparse.ArgumentParser(description="Load test the diffusers server")
+    parser.add_argument("--url", help="server to test (default: start one with tiny models)")
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(part) for part in value.split(",")],
+        default=[1, 8, 64],
+        help="comma-separated numbers of concurrent clients",
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    parser.add_argument("--mix", help="JSON file with the workload mix")
+    parser.add_argument("--model-id", default="tiny-sd", help="model substituted for $model")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the clients' choices")
+    parser.add_argument("--output", default="loadtest-report.json", help="report file")
+    parser.add_argument(
+        "--workers", type=int, default=0, help="worker processes of the started server"
+    )
+    args = parser.parse_args()
+
+    # Files are read and written outside the event loop, which must not stall while timing
+    if args.mix:
+        with open(args.mix) as file:
+            mix = json.load(file)
+    else:
+        mix = DEFAULT_MIX
+
+    server: subprocess.Popen[bytes] | None = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.serve",
+                "--port",
+                str(port),
+                "--workers",
+                str(args.workers),
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+    try:
+        if server is not None:
+            asyncio.run(wait_until_up(url, server, within=300))
+        levels = asyncio.run(run_levels(args, url, mix))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "url": url,
+        "duration_s": args.duration,
+        "mix": args.mix or "default",
+        "model_id": args.model_id,
+        "workers": args.workers if args.url is None else None,
+        "levels": levels,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+        file.write("\n")
+    print_report(levels)
+    print(f"\nWrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
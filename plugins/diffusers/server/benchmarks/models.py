@@ -0,0 +1,212 @@
+"""
+Tiny randomly initialized models shaped like the real ones.
+
+The pipelines have the same components as Stable Diffusion 1.5 and SDXL (UNet, VAE, CLIP
+text encoders and tokenizer), the ControlNet matches the tiny SD UNet, and the upscalers
+are RRDBNets like RealESRGAN's. Everything is a few hundred kilobytes of weights and
+runs in milliseconds on CPU. The outputs are noise.
+"""
+
+import json
+import os
+import tempfile
+from types import ModuleType
+
+import torch
+from basicsr.archs.rrdbnet_arch import RRDBNet
+from controlnet_aux import CannyDetector
+from diffusers import (
+    AutoencoderKL,
+    ControlNetModel,
+    DDIMScheduler,
+    EulerDiscreteScheduler,
+    StableDiffusionPipeline,
+    StableDiffusionXLPipeline,
+    UNet2DConditionModel,
+)
+from realesrgan import RealESRGANer
+from transformers import (
+    CLIPTextConfig,
+    CLIPTextModel,
+    CLIPTextModelWithProjection,
+    CLIPTokenizer,
+)
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+# Model IDs the tiny pipelines are registered under ("xl" makes the server treat it as SDXL)
+SD_MODEL = "tiny-sd"
+SDXL_MODEL = "tiny-sdxl"
+
+# Latent size of the tiny UNets; with a two-block VAE images are twice as large
+SAMPLE_SIZE = 32
+
+
+def tiny_tokenizer() -> CLIPTokenizer:
+    """Build a byte-level CLIP tokenizer without merges, so no vocabulary is downloaded."""
+    directory = tempfile.mkdtemp(prefix="viwo-bench-tokenizer-")
+    characters = list(bytes_to_unicode().values())
+    vocab = {character: index for index, character in enumerate(characters)}
+    for character in characters:
+        vocab[f"{character}</w>"] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+
+    vocab_path = os.path.join(directory, "vocab.json")
+    merges_path = os.path.join(directory, "merges.txt")
+    with open(vocab_path, "w") as file:
+        json.dump(vocab, file)
+    with open(merges_path, "w") as file:
+        file.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_path, merges_path, model_max_length=77)
+
+
+def _text_config() -> CLIPTextConfig:
+    """Configuration of the tiny CLIP text encoders."""
+    return CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=2,
+        pad_token_id=1,
+        hidden_size=32,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=2,
+        projection_dim=32,
+        vocab_size=1000,
+    )
+
+
+def _tiny_vae() -> AutoencoderKL:
+    """Build a two-block VAE (scale factor 2)."""
+    return AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        norm_num_groups=8,
+        sample_size=SAMPLE_SIZE * 2,
+    )
+
+
+def tiny_sd_pipeline() -> StableDiffusionPipeline:
+    """Build a Stable Diffusion 1.5 shaped pipeline."""
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=SAMPLE_SIZE,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+        norm_num_groups=8,
+        attention_head_dim=4,
+    )
+    return StableDiffusionPipeline(
+        unet=unet,
+        vae=_tiny_vae(),
+        text_encoder=CLIPTextModel(_text_config()),
+        tokenizer=tiny_tokenizer(),
+        scheduler=DDIMScheduler(steps_offset=1, clip_sample=False),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+def tiny_sdxl_pipeline() -> StableDiffusionXLPipeline:
+    """Build an SDXL shaped pipeline with two text encoders and size conditioning."""
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=SAMPLE_SIZE,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        # Six size/crop values of 8 dimensions each, plus the pooled text embedding
+        projection_class_embeddings_input_dim=6 * 8 + 32,
+        # Hidden states of both text encoders, concatenated
+        cross_attention_dim=64,
+        norm_num_groups=8,
+    )
+    tokenizer = tiny_tokenizer()
+    return StableDiffusionXLPipeline(
+        unet=unet,
+        vae=_tiny_vae(),
+        text_encoder=CLIPTextModel(_text_config()),
+        text_encoder_2=CLIPTextModelWithProjection(_text_config()),
+        tokenizer=tokenizer,
+        tokenizer_2=tokenizer,
+        scheduler=EulerDiscreteScheduler(steps_offset=1, timestep_spacing="leading"),
+    )
+
+
+def tiny_controlnet() -> ControlNetModel:
+    """Build a ControlNet matching the tiny SD UNet."""
+    torch.manual_seed(0)
+    return ControlNetModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        in_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        cross_attention_dim=32,
+        conditioning_embedding_out_channels=(16, 32),
+        norm_num_groups=8,
+        attention_head_dim=4,
+    )
+
+
+def tiny_upscaler(scale: int) -> RealESRGANer:
+    """
+    Build a RealESRGANer around a tiny RRDBNet.
+
+    RealESRGANer only loads weights from a file, so the random weights are written to a
+    temporary checkpoint first.
+
+    Args:
+        scale: Upscale factor (2 or 4)
+
+    Returns:
+        Upscaler with random weights
+    """
+    torch.manual_seed(0)
+    network = RRDBNet(
+        num_in_ch=3, num_out_ch=3, num_feat=8, num_block=1, num_grow_ch=4, scale=scale
+    )
+    with tempfile.NamedTemporaryFile(prefix="viwo-bench-rrdbnet-", suffix=".pth") as file:
+        torch.save({"params_ema": network.state_dict()}, file.name)
+        return RealESRGANer(
+            scale=scale, model_path=file.name, model=network, tile=0, pre_pad=0, half=False
+        )
+
+
+def install(server: ModuleType) -> None:
+    """
+    Register the tiny models with a server, under the keys its loaders look up.
+
+    The models are converted and placed by the server's device policy, like the models
+    its loaders download.
+
+    Args:
+        server: The server's `inference` module, or `main`, which imports its models
+    """
+    registry = server.model_registry
+    policy = server.device_policy
+    dtype = policy.torch_dtype
+    registry.put(f"pipeline:{SD_MODEL}", policy.place(tiny_sd_pipeline().to(dtype=dtype)))
+    registry.put(f"pipeline:{SDXL_MODEL}", policy.place(tiny_sdxl_pipeline().to(dtype=dtype)))
+    registry.put("controlnet:canny", policy.place(tiny_controlnet().to(dtype=dtype)))
+    registry.put("preprocessor:canny", CannyDetector())
+    for model in ("realesrgan", "esrgan"):
+        for scale in (2, 4):
+            upscaler = tiny_upscaler(scale)
+            upscaler.model = policy.place(upscaler.model)
+            registry.put(f"upscaler:{model}_{scale}x", upscaler)
@@ -0,0 +1,686 @@
+"""
+Benchmark suite for the diffusers server.
+
+Drives every endpoint in-process through the ASGI app, with the tiny models from
+`benchmarks.models`, and measures request overhead, image encoding and decoding, cache
+hits and misses, micro-batching throughput, and the process's memory high-water mark.
+Cold starts (importing the server and a first request) are timed in fresh interpreters.
+Results are written to a JSON file and compared against a stored baseline.
+
+Run from `plugins/diffusers/server`:
+
+    python -m benchmarks.run                      # compare with benchmarks/baseline.json
+    python -m benchmarks.run --filter 'codec/'    # only some benchmarks
+    python -m benchmarks.run --save-baseline      # record a new baseline
+
+The exit status is 1 when a benchmark regressed against the baseline.
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import platform
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import Any
+
+import httpx
+import torch
+from PIL import Image
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Parameters shared by every diffusion request: as cheap as the tiny models allow
+DIFFUSION = {"num_inference_steps": 4, "width": 64, "height": 64}
+
+
+def configure_environment(directory: str) -> None:
+    """
+    Point the server's caches at a scratch directory and quiet its logs.
+
+    Must run before the server is imported, which reads its configuration once.
+    Variables already set in the environment are kept.
+
+    Args:
+        directory: Scratch directory for the on-disk caches
+    """
+    os.environ.setdefault("VIWO_DIFFUSERS_RESULT_CACHE_DIR", os.path.join(directory, "results"))
+    os.environ.setdefault("VIWO_DIFFUSERS_IMAGE_STORE_DIR", os.path.join(directory, "images"))
+    os.environ.setdefault("VIWO_DIFFUSERS_LOG_LEVEL", "WARNING")
+    # The tiny models cannot be loaded again once they are unloaded
+    os.environ.setdefault("VIWO_DIFFUSERS_MODEL_IDLE_TTL_S", "0")
+    # Concurrency benchmarks must not be turned away by the queue bound
+    os.environ.setdefault("VIWO_DIFFUSERS_MAX_QUEUE", "256")
+
+
+def peak_rss() -> int:
+    """Get the process's peak resident memory in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak * (1 if platform.system() == "Darwin" else 1024)
+
+
+def sample_image(size: int, seed: int = 0) -> Image.Image:
+    """
+    Build a test image: smooth gradients with a noisy channel.
+
+    Args:
+        size: Width and height
+        seed: Seed of the noise; images with the same size and seed are identical
+
+    Returns:
+        RGB image
+    """
+    gradient = Image.linear_gradient("L").resize((size, size))
+    generator = torch.Generator().manual_seed(seed)
+    noise = (torch.randn(size, size, generator=generator) * 48 + 128).clamp(0, 255)
+    noise_channel = Image.frombytes("L", (size, size), noise.to(torch.uint8).numpy().tobytes())
+    return Image.merge("RGB", (gradient, gradient.rotate(90), noise_channel))
+
+
+def to_base64(image: Image.Image, image_format: str = "PNG") -> str:
+    """Encode an image as a base64 string, as clients send it."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """Get a percentile of a list of samples (nearest rank)."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+@dataclass
+class Result:
+    """Timings of one benchmark."""
+
+    samples: list[float]  # seconds per iteration
+    rss_before: int
+    rss_after: int
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    def summary(self) -> dict[str, Any]:
+        """Summarize the samples in milliseconds, with the memory high-water mark."""
+        return {
+            "iterations": len(self.samples),
+            "mean_ms": round(statistics.fmean(self.samples) * 1000, 3),
+            "p50_ms": round(statistics.median(self.samples) * 1000, 3),
+            "p95_ms": round(percentile(self.samples, 0.95) * 1000, 3),
+            "min_ms": round(min(self.samples) * 1000, 3),
+            "rss_high_water_mb": round(self.rss_after / 1024**2, 1),
+            "rss_growth_mb": round((self.rss_after - self.rss_before) / 1024**2, 1),
+            **self.extra,
+        }
+
+
+class Suite:
+    """Runs benchmarks against an in-process server and collects their results."""
+
+    def __init__(
+        self,
+        server: ModuleType,
+        client: httpx.AsyncClient,
+        pattern: str | None = None,
+        iterations: int | None = None,
+    ):
+        """
+        Initialize the suite.
+
+        Args:
+            server: The server's `main` module
+            client: Client bound to the server's ASGI app
+            pattern: Only run benchmarks whose name matches this regular expression
+            iterations: Iterations of every benchmark (None = each benchmark's default)
+        """
+        self.server = server
+        self.client = client
+        self.pattern = re.compile(pattern) if pattern else None
+        self.iterations = iterations
+        self.results: dict[str, Result] = {}
+        self.skipped: dict[str, str] = {}
+
+    def selected(self, name: str) -> bool:
+        """Whether a benchmark is selected by the filter."""
+        return self.pattern is None or self.pattern.search(name) is not None
+
+    async def measure(
+        self,
+        name: str,
+        run: Callable[[], Awaitable[Any]],
+        iterations: int = 20,
+        setup: Callable[[], Any] | None = None,
+        warmup: int = 1,
+    ) -> Result | None:
+        """
+        Time a benchmark.
+
+        Args:
+            name: Benchmark name, "<group>/<case>"
+            run: One iteration
+            iterations: Default number of timed iterations
+            setup: Untimed preparation before every iteration (e.g. clearing a cache)
+            warmup: Untimed iterations before timing
+
+        Returns:
+            The result, or None if the benchmark is not selected
+        """
+        if not self.selected(name):
+            return None
+        for _ in range(warmup):
+            if setup is not None:
+                setup()
+            await run()
+
+        samples: list[float] = []
+        rss_before = peak_rss()
+        for _ in range(self.iterations or iterations):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            await run()
+            samples.append(time.perf_counter() - started)
+
+        result = Result(samples, rss_before, peak_rss())
+        self.results[name] = result
+        summary = result.summary()
+        print(
+            f"{name:<44} p50 {summary['p50_ms']:>10.3f} ms   p95 {summary['p95_ms']:>10.3f} ms"
+            f"   rss {summary['rss_high_water_mb']:>8.1f} MB",
+            flush=True,
+        )
+        return result
+
+    def skip(self, name: str, reason: str) -> None:
+        """Record a benchmark that cannot run here."""
+        if self.selected(name):
+            self.skipped[name] = reason
+            print(f"{name:<44} skipped: {reason}", flush=True)
+
+    async def request(
+        self, method: str, url: str, expected: int = 200, **kwargs: Any
+    ) -> httpx.Response:
+        """Send a request, failing the benchmark on an unexpected status."""
+        response = await self.client.request(method, url, **kwargs)
+        if response.status_code != expected:
+            raise RuntimeError(
+                f"{method} {url} returned {response.status_code}: {response.text[:500]}"
+            )
+        return response
+
+    def post(self, url: str, body: dict[str, Any], **kwargs: Any) -> Callable[[], Awaitable[Any]]:
+        """Make an iteration that posts a JSON body."""
+        return lambda: self.request("POST", url, json=body, **kwargs)
+
+    def clear_results(self) -> None:
+        """Drop cached results, so operations run instead of being served from the cache."""
+        self.server.result_cache.clear()
+
+
+def cold_start(case: str, reports: list[dict[str, Any]]) -> Callable[[], Awaitable[None]]:
+    """
+    Make an iteration that runs one `benchmarks.startup` case in a fresh interpreter.
+
+    Args:
+        case: Startup case to run
+        reports: Receives the timings and imported modules each run reports
+
+    Returns:
+        The iteration
+    """
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    async def run() -> None:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "benchmarks.startup",
+            case,
+            cwd=server_dir,
+            env={**os.environ, "PYTHONPATH": server_dir},
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"startup {case} failed: {stderr.decode()[-500:]}")
+        reports.append(json.loads(stdout.decode().splitlines()[-1]))
+
+    return run
+
+
+async def startup(suite: Suite) -> None:
+    """Cold starts: a fresh interpreter importing the server and answering a first request."""
+    from benchmarks.startup import CASES
+
+    for case in CASES:
+        reports: list[dict[str, Any]] = []
+        result = await suite.measure(f"startup/{case}", cold_start(case, reports), iterations=5)
+        if result is None:
+            continue
+        result.extra["import_ms"] = statistics.median(report["import_ms"] for report in reports)
+        heavy = sorted({name for report in reports for name in report["heavy_modules"]})
+        result.extra["heavy_modules"] = heavy
+        if heavy:
+            # Only features that run models may import their dependencies
+            print(f"{'':<44} imported {', '.join(heavy)}", flush=True)
+
+
+async def overhead(suite: Suite) -> None:
+    """Requests that do no inference: the cost of the HTTP stack and middleware."""
+    for url in ("/health", "/stats", "/metrics", "/controlnet/types"):
+        name = "overhead/get" + url.replace("/", "-")
+        await suite.measure(name, lambda url=url: suite.request("GET", url), iterations=200)
+    await suite.measure(
+        "overhead/not-found",
+        lambda: suite.request("GET", "/jobs/missing", expected=404),
+        iterations=200,
+    )
+
+    # A cached result skips inference, leaving request parsing, lookup and the response
+    body = {"prompt": "overhead", "model_id": "tiny-sd", "seed": 1, **DIFFUSION}
+    await suite.measure(
+        "overhead/text-to-image-cached-json", suite.post("/text-to-image", body), iterations=200
+    )
+    await suite.measure(
+        "overhead/text-to-image-cached-binary",
+        suite.post("/text-to-image", body, headers={"Accept": "image/png"}),
+        iterations=200,
+    )
+
+
+async def codec(suite: Suite) -> None:
+    """Encoding results and decoding inputs, outside the HTTP stack."""
+    from encoding import encode_image
+    from uploads import decode_image, image_digest
+
+    for size in (512, 1024):
+        image = sample_image(size)
+        for image_format in ("png", "webp", "jpeg"):
+            await suite.measure(
+                f"codec/encode-{image_format}-{size}",
+                lambda image=image, image_format=image_format: asyncio.to_thread(
+                    encode_image, image, image_format
+                ),
+                iterations=10,
+            )
+
+    image = sample_image(1024)
+    for image_format in ("PNG", "JPEG"):
+        data = to_base64(image, image_format)
+        await suite.measure(
+            f"codec/decode-{image_format.lower()}-1024",
+            lambda data=data: asyncio.to_thread(decode_image, data),
+            iterations=10,
+        )
+        # JPEGs are decoded at a reduced scale when the target is much smaller
+        await suite.measure(
+            f"codec/decode-{image_format.lower()}-1024-to-256",
+            lambda data=data: asyncio.to_thread(decode_image, data, (256, 256)),
+            iterations=10,
+        )
+    data = to_base64(image)
+    await suite.measure(
+        "codec/digest-1024", lambda: asyncio.to_thread(image_digest, data), iterations=20
+    )
+
+
+async def endpoints(suite: Suite) -> None:
+    """Every operation endpoint with the tiny models, with the result cache cleared."""
+    image = to_base64(sample_image(64))
+    large = to_base64(sample_image(256))
+    mask = to_base64(Image.new("L", (64, 64), 255))
+    # A small mask in a larger image, for crop-to-mask inpainting
+    spot = Image.new("L", (256, 256), 0)
+    spot.paste(255, (96, 96, 160, 160))
+    spot_mask = to_base64(spot)
+
+    cases: list[tuple[str, str, dict[str, Any]]] = [
+        ("text-to-image-sd", "/text-to-image", {"model_id": "tiny-sd"}),
+        ("text-to-image-sdxl", "/text-to-image", {"model_id": "tiny-sdxl"}),
+        (
+            "controlnet-generate",
+            "/controlnet/generate",
+            {"model_id": "tiny-sd", "image": image, "type": "canny"},
+        ),
+        ("inpaint-sd", "/inpaint", {"model_id": "tiny-sd", "image": image, "mask": mask}),
+        ("inpaint-sdxl", "/inpaint", {"model_id": "tiny-sdxl", "image": image, "mask": mask}),
+        (
+            "inpaint-crop",
+            "/inpaint",
+            {
+                "model_id": "tiny-sd",
+                "image": large,
+                "mask": spot_mask,
+                "mode": "crop",
+                "width": None,
+                "height": None,
+            },
+        ),
+        (
+            "outpaint",
+            "/outpaint",
+            {"model_id": "tiny-sd", "image": image, "sides": {"right": 32, "bottom": 32}},
+        ),
+        (
+            "upscale-img2img",
+            "/upscale/img2img",
+            {"model_id": "tiny-sd", "image": image, "factor": 2, "num_inference_steps": 10},
+        ),
+    ]
+    for case, url, params in cases:
+        body = {"prompt": "benchmark", "seed": 1, **DIFFUSION, **params}
+        if url in ("/outpaint", "/upscale/img2img"):
+            # These size their output from the input image
+            body.pop("width")
+            body.pop("height")
+        body = {key: value for key, value in body.items() if value is not None}
+        await suite.measure(
+            f"endpoint/{case}", suite.post(url, body), iterations=5, setup=suite.clear_results
+        )
+
+    non_diffusion: list[tuple[str, str, dict[str, Any]]] = [
+        ("controlnet-preprocess", "/controlnet/preprocess", {"image": large, "type": "canny"}),
+        ("upscale-2x", "/upscale", {"image": image, "factor": 2}),
+        ("upscale-4x", "/upscale", {"image": image, "factor": 4}),
+        ("upscale-traditional", "/upscale/traditional", {"image": large, "factor": 4}),
+    ]
+    for case, url, body in non_diffusion:
+        await suite.measure(
+            f"endpoint/{case}", suite.post(url, body), iterations=10, setup=suite.clear_results
+        )
+    suite.skip("endpoint/face-restore", "GFPGAN has no locally buildable model")
+
+    # Image store round trip
+    stored: list[str] = []
+
+    async def store() -> None:
+        response = await suite.request("POST", "/images", expected=201, json={"image": large})
+        stored.append(response.json()["handle"])
+
+    await suite.measure("endpoint/images-store", store, iterations=20)
+    if stored:
+        handle = stored[-1]
+        await suite.measure(
+            "endpoint/images-fetch",
+            lambda: suite.request("GET", f"/images/{handle}", headers={"Accept": "image/png"}),
+            iterations=20,
+        )
+
+    # A background job from submission to its result
+    async def job() -> None:
+        body = {
+            "operation": "text-to-image",
+            "params": {"prompt": "job", "model_id": "tiny-sd", **DIFFUSION},
+        }
+        response = await suite.request("POST", "/jobs", expected=202, json=body)
+        job_id = response.json()["id"]
+        while True:
+            status = (await suite.request("GET", f"/jobs/{job_id}")).json()["status"]
+            if status in ("succeeded", "failed", "cancelled"):
+                break
+            await asyncio.sleep(0.002)
+        if status != "succeeded":
+            raise RuntimeError(f"Job {job_id} {status}")
+
+    await suite.measure("endpoint/job-text-to-image", job, iterations=5)
+
+
+async def caches(suite: Suite) -> None:
+    """The same requests with each cache cold and warm."""
+    server = suite.server
+    body = {"prompt": "cache", "model_id": "tiny-sd", "seed": 2, **DIFFUSION}
+    await suite.measure(
+        "cache/result-miss",
+        suite.post("/text-to-image", body),
+        iterations=5,
+        setup=suite.clear_results,
+    )
+    await suite.measure("cache/result-hit", suite.post("/text-to-image", body), iterations=50)
+
+    def clear_prompts() -> None:
+        suite.clear_results()
+        server.prompt_embeddings.clear()
+
+    await suite.measure(
+        "cache/prompt-embedding-miss",
+        suite.post("/text-to-image", body),
+        iterations=5,
+        setup=clear_prompts,
+    )
+    await suite.measure(
+        "cache/prompt-embedding-hit",
+        suite.post("/text-to-image", body),
+        iterations=5,
+        setup=suite.clear_results,
+    )
+
+    image = to_base64(sample_image(512))
+    control = {"prompt": "cache", "model_id": "tiny-sd", "image": image, "type": "canny"}
+    control |= {"seed": 2, **DIFFUSION}
+
+    def clear_control_maps() -> None:
+        suite.clear_results()
+        server.control_maps.clear()
+
+    await suite.measure(
+        "cache/control-map-miss",
+        suite.post("/controlnet/generate", control),
+        iterations=5,
+        setup=clear_control_maps,
+    )
+    await suite.measure(
+        "cache/control-map-hit",
+        suite.post("/controlnet/generate", control),
+        iterations=5,
+        setup=suite.clear_results,
+    )
+
+    # Sending a stored image's handle instead of its bytes skips the upload and decode
+    large = to_base64(sample_image(1024))
+    response = await suite.request("POST", "/images", expected=201, json={"image": large})
+    handle = response.json()["handle"]
+    for case, source in (("base64", large), ("handle", handle)):
+        await suite.measure(
+            f"cache/input-{case}",
+            # JPEG output keeps the result's encoding from dwarfing the input's decoding
+            suite.post(
+                "/upscale/traditional", {"image": source, "factor": 2, "output_format": "jpeg"}
+            ),
+            iterations=10,
+            setup=suite.clear_results,
+        )
+
+
+async def batching(suite: Suite, requests: int = 8) -> None:
+    """Throughput of concurrent text-to-image requests with and without micro-batching."""
+    batcher = suite.server.text_to_image_batcher
+    body = {"prompt": "batch", "model_id": "tiny-sd", **DIFFUSION}
+
+    async def sequential() -> None:
+        for _ in range(requests):
+            await suite.request("POST", "/text-to-image", json=body)
+
+    async def concurrent() -> None:
+        await asyncio.gather(
+            *(suite.request("POST", "/text-to-image", json=body) for _ in range(requests))
+        )
+
+    result = await suite.measure(f"batching/sequential-{requests}", sequential, iterations=3)
+    if result is not None:
+        result.extra["images_per_second"] = round(requests / statistics.median(result.samples), 2)
+
+    configured = batcher.max_batch_size
+    try:
+        for size in (1, 4):
+            batcher.max_batch_size = size
+            before = batcher.stats()
+            result = await suite.measure(
+                f"batching/concurrent-{requests}-batch-{size}", concurrent, iterations=3
+            )
+            if result is None:
+                continue
+            after = batcher.stats()
+            batches = after["batches"] - before["batches"]
+            items = after["items"] - before["items"]
+            result.extra["images_per_second"] = round(
+                requests / statistics.median(result.samples), 2
+            )
+            result.extra["average_batch_size"] = round(items / batches, 2) if batches else 0.0
+    finally:
+        batcher.max_batch_size = configured
+
+
+def environment(server: ModuleType) -> dict[str, Any]:
+    """Describe the machine, device policy, and library versions the benchmarks ran with."""
+    import diffusers
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "device": server.device_policy.device,
+        "dtype": server.device_policy.dtype_name,
+        "channels_last": server.device_policy.uses_channels_last,
+        "diffusers": diffusers.__version__,
+    }
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    threshold: float,
+    min_delta_ms: float,
+    complete: bool = True,
+) -> list[str]:
+    """
+    Compare results with a baseline and print the differences.
+
+    A benchmark regressed when its median is more than `threshold` slower than the
+    baseline's and by at least `min_delta_ms`, which keeps sub-millisecond noise from
+    counting. The process's final memory high-water mark is compared the same way.
+
+    Args:
+        results: Current results file contents
+        baseline: Baseline results file contents
+        threshold: Allowed relative slowdown, e.g. 0.25 for 25%
+        min_delta_ms: Smallest absolute slowdown that counts
+        complete: Whether every benchmark ran; otherwise benchmarks missing from the
+            results and the memory high-water mark are not compared
+
+    Returns:
+        Names of the regressed benchmarks
+    """
+    regressions: list[str] = []
+    current, previous = results["results"], baseline.get("results", {})
+    print(f"\n{'benchmark':<44} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, summary in current.items():
+        if name not in previous:
+            print(f"{name:<44} {'-':>12} {summary['p50_ms']:>10.3f}ms {'new':>8}")
+            continue
+        old, new = previous[name]["p50_ms"], summary["p50_ms"]
+        change = (new - old) / old if old else 0.0
+        regressed = change > threshold and new - old >= min_delta_ms
+        if regressed:
+            regressions.append(name)
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{name:<44} {old:>10.3f}ms {new:>10.3f}ms {change:>+8.1%}{marker}")
+    if not complete:
+        return regressions
+    for name in sorted(previous.keys() - current.keys()):
+        print(f"{name:<44} {previous[name]['p50_ms']:>10.3f}ms {'-':>12} {'missing':>8}")
+
+    old_peak = baseline.get("peak_rss_mb")
+    new_peak = results["peak_rss_mb"]
+    if old_peak:
+        change = (new_peak - old_peak) / old_peak
+        marker = "  REGRESSION" if change > threshold else ""
+        if marker:
+            regressions.append("peak_rss_mb")
+        print(f"{'peak rss':<44} {old_peak:>10.1f}MB {new_peak:>10.1f}MB {change:>+8.1%}{marker}")
+    return regressions
+
+
+async def run_suite(server: ModuleType, pattern: str | None, iterations: int | None) -> Suite:
+    """Run every benchmark group against the server."""
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark", timeout=600
+    ) as client:
+        suite = Suite(server, client, pattern, iterations)
+        for group in (startup, overhead, codec, endpoints, caches, batching):
+            await group(suite)
+    return suite
+
+
+def main() -> int:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--output", default="benchmark-results.json", help="results file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results file")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="write the results as the new baseline"
+    )
+    parser.add_argument("--filter", help="only run benchmarks matching this regular expression")
+    parser.add_argument("--iterations", type=int, help="iterations of every benchmark")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed relative slowdown (0.25 = 25%%)"
+    )
+    parser.add_argument(
+        "--min-delta-ms", type=float, default=0.5, help="smallest slowdown that counts"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="viwo-bench-") as directory:
+        configure_environment(directory)
+        import main as server
+        from benchmarks import models
+
+        models.install(server)
+        try:
+            suite = asyncio.run(run_suite(server, args.filter, args.iterations))
+        finally:
+            server.inference_executor.shutdown()
+
+    results = {
+        "environment": environment(server),
+        "peak_rss_mb": round(peak_rss() / 1024**2, 1),
+        "results": {name: result.summary() for name, result in suite.results.items()},
+        "skipped": suite.skipped,
+    }
+    output = args.baseline if args.save_baseline else args.output
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+    print(f"\nWrote {output}")
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(
+        results, baseline, args.threshold, args.min_delta_ms, complete=args.filter is None
+    )
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Serve the diffusers server with the tiny benchmark models.
+
+The models from `benchmarks.models` are registered before the server starts (in every
+worker process with `--workers`), so any request for `tiny-sd` or `tiny-sdxl` runs on
+CPU in milliseconds without downloads. Used by `benchmarks.loadtest`; run from
+`plugins/diffusers/server`:
+
+    python -m benchmarks.serve --port 8001 --workers 2
+"""
+
+import argparse
+import os
+import tempfile
+
+import uvicorn
+
+from benchmarks.run import configure_environment
+
+
+def main() -> None:
+    """Start the server from the command line."""
+    parser = argparse.ArgumentParser(description="Serve the diffusers server with tiny models")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=8001, help="port to listen on")
+    parser.add_argument(
+        "--workers", type=int, default=0, help="worker processes (0 = run in the server)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="viwo-bench-") as directory:
+        configure_environment(directory)
+        if args.workers:
+            os.environ["VIWO_DIFFUSERS_WORKERS"] = str(args.workers)
+            os.environ["VIWO_DIFFUSERS_WORKER_INITIALIZER"] = "benchmarks.models:install"
+        import main as server
+        from benchmarks import models
+
+        if not args.workers:
+            models.install(server)
+        uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Cold start of the server: importing it and answering a first request.
+
+Runs in a fresh interpreter, imports the server, sends one request through the ASGI
+app, and prints the timings and which heavy dependencies ended up imported as JSON.
+Features that don't need torch and diffusers must not import them, so `health` and
+`upscale-traditional` are expected to report none. `benchmarks.run` spawns this for its
+`startup/` benchmarks; run from `plugins/diffusers/server`:
+
+    python -m benchmarks.startup upscale-traditional
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import sys
+import time
+from types import ModuleType
+
+# Dependencies that take seconds to import and are only needed by some features
+HEAVY_MODULES = (
+    "torch",
+    "diffusers",
+    "transformers",
+    "controlnet_aux",
+    "basicsr",
+    "realesrgan",
+    "gfpgan",
+)
+
+# What a cold start does after importing the server
+CASES = ("import", "health", "upscale-traditional")
+
+
+def _request_body() -> dict[str, object]:
+    """A small image to upscale, built with PIL only."""
+    from PIL import Image
+
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 64), (120, 80, 40)).save(buffered, format="PNG")
+    return {"image": base64.b64encode(buffered.getvalue()).decode(), "factor": 2}
+
+
+async def first_request(server: ModuleType, case: str) -> None:
+    """Send the case's first request, failing on anything but a 200."""
+    import httpx
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+        if case == "health":
+            response = await client.get("/health")
+        else:
+            response = await client.post("/upscale/traditional", json=_request_body())
+    if response.status_code != 200:
+        raise RuntimeError(f"{case} returned {response.status_code}: {response.text[:500]}")
+
+
+def main() -> None:
+    """Measure one cold start from the command line."""
+    parser = argparse.ArgumentParser(description="Measure the server's cold start")
+    parser.add_argument("case", choices=CASES, help="what to do after importing the server")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    import main as server
+
+    imported = time.perf_counter()
+    if args.case != "import":
+        asyncio.run(first_request(server, args.case))
+    finished = time.perf_counter()
+
+    json.dump(
+        {
+            "import_ms": round((imported - started) * 1000, 1),
+            "first_request_ms": round((finished - imported) * 1000, 1),
+            "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+        },
+        sys.stdout,
+    )
+    print()
+
+
+if __name__ == "__main__":
+    main()
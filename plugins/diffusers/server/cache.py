@@ -0,0 +1,400 @@
+"""
+Caches for deterministic results.
+
+`LRUCache` is a thread-safe in-memory cache bounded by entry count and/or total size.
+`ResultCache` stores encoded result images under a content-addressed key, with an
+in-memory tier in front of a size-capped on-disk tier.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from pathlib import Path
+from typing import Any, Generic, TypeVar, cast
+
+from encoding import IMAGE_FORMATS, EncodedImage, ImageFormat
+from logs import log_event
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# Names of the result cache's files: `<key>-<width>x<height>.<format>`
+RESULT_FILE_NAME = re.compile(
+    r"(?P<key>[0-9a-f]{64})-(?P<width>\d+)x(?P<height>\d+)"
+    rf"\.(?P<format>{'|'.join(IMAGE_FORMATS)})"
+)
+
+
+class HandleNotFoundError(LookupError):
+    """Raised when a request refers to a handle that does not exist or has expired."""
+
+
+def content_key(*parts: Any) -> str:
+    """
+    Hash JSON-serializable parts into a stable key.
+
+    Dictionaries are serialized with sorted keys, so the key does not depend on field order.
+
+    Args:
+        parts: Values identifying the content
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    """Get the hex SHA-256 digest of some bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class LRUCache(Generic[K, V]):
+    """Thread-safe least recently used cache bounded by entry count and total size."""
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        size_of: Callable[[V], int] | None = None,
+    ):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_entries: Maximum number of entries (None = unlimited)
+            max_bytes: Maximum total size of entries (None = unlimited)
+            size_of: Function giving an entry's size in bytes (required for `max_bytes`)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+
+        self._entries: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache can hold anything."""
+        return self.max_entries != 0 and self.max_bytes != 0
+
+    def __len__(self) -> int:
+        """Number of cached entries."""
+        return len(self._entries)
+
+    def get(self, key: K) -> V | None:
+        """
+        Get a cached value and mark it as recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: K, value: V) -> list[tuple[K, V]]:
+        """
+        Cache a value, evicting least recently used entries to stay within bounds.
+
+        Values larger than `max_bytes` on their own are not cached.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+
+        Returns:
+            Evicted entries, so callers can move them to a slower tier
+        """
+        if not self.enabled:
+            return []
+        size = self.size_of(value) if self.size_of is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return []
+
+        evicted: list[tuple[K, V]] = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._over_limit():
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self._evictions += 1
+                evicted.append((old_key, old_value))
+        return evicted
+
+    def pop(self, key: K) -> V | None:
+        """
+        Remove a value from the cache.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The removed value, or None if it was not cached
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _over_limit(self) -> bool:
+        """Whether the cache exceeds its bounds (caller holds the lock)."""
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with size, bounds, and hit/miss/eviction counters
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+class ResultCache:
+    """Two-tier cache of encoded result images keyed by a content hash."""
+
+    def __init__(
+        self,
+        memory_bytes: int = 0,
+        disk_dir: str | None = None,
+        disk_bytes: int = 0,
+    ):
+        """
+        Initialize the cache, indexing any results already on disk.
+
+        Args:
+            memory_bytes: Size of the in-memory tier (0 = disabled)
+            disk_dir: Directory of the on-disk tier (None = disabled)
+            disk_bytes: Size of the on-disk tier (0 = disabled)
+        """
+        self.memory: LRUCache[str, EncodedImage] = LRUCache(
+            max_bytes=memory_bytes, size_of=lambda encoded: len(encoded.data)
+        )
+        self.disk_dir = Path(disk_dir) if disk_dir and disk_bytes > 0 else None
+        self.disk_bytes = disk_bytes
+
+        # On-disk results by key, in least recently used order
+        self._disk: OrderedDict[str, tuple[Path, int]] = OrderedDict()
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        if self.disk_dir is not None:
+            try:
+                self._index_disk(self.disk_dir)
+            except OSError as error:
+                log_event("result_cache_disk_disabled", logging.WARNING, error=str(error))
+                self.disk_dir = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether either tier is enabled."""
+        return self.memory.enabled or self.disk_dir is not None
+
+    def get(self, key: str) -> EncodedImage | None:
+        """
+        Look up a result, promoting disk hits to memory.
+
+        Args:
+            key: Content key of the request
+
+        Returns:
+            The cached result, or None on a miss
+        """
+        encoded = self.memory.get(key)
+        if encoded is not None:
+            with self._lock:
+                self._hits += 1
+            return encoded
+
+        encoded = self._read_disk(key)
+        with self._lock:
+            if encoded is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._disk_hits += 1
+
+        self.memory.put(key, encoded)
+        return encoded
+
+    def put(self, key: str, encoded: EncodedImage) -> None:
+        """
+        Store a result in both tiers.
+
+        Args:
+            key: Content key of the request
+            encoded: Encoded result
+        """
+        self.memory.put(key, encoded)
+        self._write_disk(key, encoded)
+
+    def clear(self) -> None:
+        """Remove every cached result, including the files on disk."""
+        self.memory.clear()
+        with self._lock:
+            paths = [path for path, _ in self._disk.values()]
+            self._disk.clear()
+            self._disk_used = 0
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    def _file_name(self, key: str, encoded: EncodedImage) -> str:
+        """Name of a result's file, which also records its format and size."""
+        return f"{key}-{encoded.width}x{encoded.height}.{encoded.format}"
+
+    def _index_disk(self, directory: Path) -> None:
+        """
+        Index results stored by a previous run, oldest first.
+
+        Only files named like the cache's own are adopted; the directory may be shared, and
+        other files are neither counted against the budget nor deleted.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        files: list[tuple[float, str, Path, int]] = []
+        for path in directory.iterdir():
+            name = RESULT_FILE_NAME.fullmatch(path.name)
+            if name is not None and path.is_file():
+                stat = path.stat()
+                files.append((stat.st_mtime, name["key"], path, stat.st_size))
+        for _, key, path, size in sorted(files):
+            self._disk[key] = (path, size)
+            self._disk_used += size
+        self._enforce_disk_budget()
+
+    def _read_disk(self, key: str) -> EncodedImage | None:
+        """Read a result from the disk tier."""
+        with self._lock:
+            entry = self._disk.get(key)
+            if entry is None:
+                return None
+            self._disk.move_to_end(key)
+        path = entry[0]
+
+        name = RESULT_FILE_NAME.fullmatch(path.name)
+        assert name is not None
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return EncodedImage(
+                data=data,
+                format=cast(ImageFormat, name["format"]),
+                width=int(name["width"]),
+                height=int(name["height"]),
+            )
+        except OSError:
+            with self._lock:
+                if self._disk.pop(key, None) is not None:
+                    self._disk_used -= entry[1]
+            path.unlink(missing_ok=True)
+            return None
+
+    def _write_disk(self, key: str, encoded: EncodedImage) -> None:
+        """Write a result to the disk tier."""
+        if self.disk_dir is None or len(encoded.data) > self.disk_bytes:
+            return
+        # Files under other names would not be recognized as results after a restart
+        name = self._file_name(key, encoded)
+        if not RESULT_FILE_NAME.fullmatch(name):
+            return
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                return
+
+        path = self.disk_dir / name
+        temporary = path.with_name(f".{path.name}.tmp")
+        try:
+            temporary.write_bytes(encoded.data)
+            temporary.replace(path)
+        except OSError as error:
+            log_event("result_cache_write_failed", logging.WARNING, error=str(error))
+            temporary.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._disk[key] = (path, len(encoded.data))
+            self._disk_used += len(encoded.data)
+        self._enforce_disk_budget()
+
+    def _enforce_disk_budget(self) -> None:
+        """Delete least recently used results until the disk tier fits its budget."""
+        while True:
+            with self._lock:
+                if self._disk_used <= self.disk_bytes or not self._disk:
+                    return
+                _, (path, size) = self._disk.popitem(last=False)
+                self._disk_used -= size
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with hit/miss counters and the state of both tiers
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "memory": {
+                    key: value
+                    for key, value in self.memory.stats().items()
+                    if key not in ("hits", "misses")
+                },
+                "disk": {
+                    "enabled": self.disk_dir is not None,
+                    "entries": len(self._disk),
+                    "bytes": self._disk_used,
+                    "max_bytes": self.disk_bytes,
+                    "hits": self._disk_hits,
+                },
+            }
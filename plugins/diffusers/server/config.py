@@ -0,0 +1,192 @@
+"""
+Server configuration for the viwo diffusers server.
+
+All settings are read from `VIWO_DIFFUSERS_*` environment variables at import time.
+"""
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_str(name: str, default: str) -> str:
+    """Read a string setting from the environment."""
+    return os.environ.get(name) or default
+
+
+def _env_list(name: str) -> list[str]:
+    """Read a comma-separated list setting from the environment."""
+    value = os.environ.get(name) or ""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _env_per_device(name: str, default: int) -> dict[str, int]:
+    """
+    Read a per-device integer setting.
+
+    Accepts either a single number applied to every device (`"2"`) or a comma-separated
+    list of `device=value` pairs (`"cuda=1,cpu=4"`). The `"*"` key holds the fallback.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return {"*": default}
+
+    if "=" not in value:
+        return {"*": int(value)}
+
+    limits = {"*": default}
+    for pair in value.split(","):
+        device, _, limit = pair.partition("=")
+        limits[device.strip()] = int(limit)
+    return limits
+
+
+# Device inference runs on: "auto" (CUDA if available, else CPU), "cuda", "cuda:1", "mps", "cpu"
+DEVICE = _env_str("VIWO_DIFFUSERS_DEVICE", "auto")
+
+# Model weight dtype: "auto" (float16 on accelerators, bfloat16 on CPUs with native bf16
+# support, float32 on other CPUs), "float16", "bfloat16", or "float32"
+DTYPE = _env_str("VIWO_DIFFUSERS_DTYPE", "auto")
+
+# Convolution weights in channels-last memory layout: "auto" (on CPU only), "on", or "off"
+CHANNELS_LAST = _env_str("VIWO_DIFFUSERS_CHANNELS_LAST", "auto")
+
+# PyTorch intra-op threads for CPU inference (0 = available CPUs / CPU concurrency limit)
+CPU_THREADS = _env_int("VIWO_DIFFUSERS_CPU_THREADS", 0)
+
+# Worker processes that run inference (0 = run it in the server process)
+WORKERS = _env_int("VIWO_DIFFUSERS_WORKERS", 0)
+
+# Devices assigned to workers round-robin, e.g. "cuda:0,cuda:1" (empty = every GPU, else DEVICE)
+WORKER_DEVICES = _env_list("VIWO_DIFFUSERS_WORKER_DEVICES")
+
+# Tasks a worker may hold before requests for its models are routed to another worker
+WORKER_MAX_PENDING = _env_int("VIWO_DIFFUSERS_WORKER_MAX_PENDING", 2)
+
+# Function called with the `inference` module in each worker once it starts, as "module:function"
+WORKER_INITIALIZER = _env_str("VIWO_DIFFUSERS_WORKER_INITIALIZER", "")
+
+# Maximum number of inference jobs running at once, per device
+MAX_CONCURRENCY = _env_per_device("VIWO_DIFFUSERS_MAX_CONCURRENCY", 1)
+
+# Maximum number of jobs waiting for a free slot before requests are rejected
+MAX_QUEUE = _env_int("VIWO_DIFFUSERS_MAX_QUEUE", 16)
+
+# Lower bound for the `Retry-After` hint sent with rejected requests, in seconds
+MIN_RETRY_AFTER = _env_float("VIWO_DIFFUSERS_MIN_RETRY_AFTER", 1.0)
+
+# Maximum number of compatible text-to-image requests run as one pipeline call
+BATCH_MAX_SIZE = _env_int("VIWO_DIFFUSERS_BATCH_MAX_SIZE", 4)
+
+# How long a request waits for compatible requests to join its batch, in milliseconds
+BATCH_MAX_WAIT_MS = _env_float("VIWO_DIFFUSERS_BATCH_MAX_WAIT_MS", 20.0)
+
+# Memory budget for all loaded models, in megabytes (0 = derive from device memory)
+MODEL_MEMORY_BUDGET_MB = _env_float("VIWO_DIFFUSERS_MODEL_MEMORY_BUDGET_MB", 0.0)
+
+# Seconds after which an unused model is unloaded (0 = never)
+MODEL_IDLE_TTL_S = _env_float("VIWO_DIFFUSERS_MODEL_IDLE_TTL_S", 1800.0)
+
+# Seconds a finished background job is kept for clients to fetch its result
+JOB_TTL_S = _env_float("VIWO_DIFFUSERS_JOB_TTL_S", 600.0)
+
+# Maximum number of background jobs kept in memory
+MAX_JOBS = _env_int("VIWO_DIFFUSERS_MAX_JOBS", 1024)
+
+# Maximum size of an uploaded input image, in megabytes (encoded)
+MAX_INPUT_MB = _env_float("VIWO_DIFFUSERS_MAX_INPUT_MB", 32.0)
+
+# Maximum size of a decoded input image, in megapixels
+MAX_INPUT_MEGAPIXELS = _env_float("VIWO_DIFFUSERS_MAX_INPUT_MEGAPIXELS", 64.0)
+
+# Size of the prompt embedding cache, in megabytes, held on the inference device (0 = disabled)
+PROMPT_CACHE_MB = _env_float("VIWO_DIFFUSERS_PROMPT_CACHE_MB", 128.0)
+
+# Size of the cache of preprocessed ControlNet control images, in megabytes (0 = disabled)
+CONTROL_MAP_CACHE_MB = _env_float("VIWO_DIFFUSERS_CONTROL_MAP_CACHE_MB", 256.0)
+
+# Size of the in-memory tier of the result cache, in megabytes (0 = disabled)
+RESULT_CACHE_MEMORY_MB = _env_float("VIWO_DIFFUSERS_RESULT_CACHE_MEMORY_MB", 256.0)
+
+# Directory of the on-disk tier of the result cache
+RESULT_CACHE_DIR = _env_str(
+    "VIWO_DIFFUSERS_RESULT_CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "viwo-diffusers",
+        "results",
+    ),
+)
+
+# Size of the on-disk tier of the result cache, in megabytes (0 = disabled)
+RESULT_CACHE_DISK_MB = _env_float("VIWO_DIFFUSERS_RESULT_CACHE_DISK_MB", 1024.0)
+
+# Memory budget of the image handle store, in megabytes of decoded pixels
+IMAGE_STORE_MEMORY_MB = _env_float("VIWO_DIFFUSERS_IMAGE_STORE_MEMORY_MB", 512.0)
+
+# Directory stored images are spilled to once the memory budget is exceeded
+IMAGE_STORE_DIR = _env_str(
+    "VIWO_DIFFUSERS_IMAGE_STORE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "viwo-diffusers",
+        "images",
+    ),
+)
+
+# Size of spilled images, in megabytes (0 = no spilling; images over budget are dropped)
+IMAGE_STORE_DISK_MB = _env_float("VIWO_DIFFUSERS_IMAGE_STORE_DISK_MB", 2048.0)
+
+# Seconds a stored image is kept after it was last used
+IMAGE_STORE_TTL_S = _env_float("VIWO_DIFFUSERS_IMAGE_STORE_TTL_S", 3600.0)
+
+# Fraction of available device memory one RealESRGAN upscale may use when picking a tile size
+UPSCALE_MEMORY_FRACTION = _env_float("VIWO_DIFFUSERS_UPSCALE_MEMORY_FRACTION", 0.5)
+
+# Default RealESRGAN precision: fp32, fp16 (CUDA only), bf16, or auto (follow the device's dtype)
+UPSCALE_PRECISION = _env_str("VIWO_DIFFUSERS_UPSCALE_PRECISION", "fp32")
+
+# Maximum estimated cost of a single request, in compute units (0 = unlimited)
+MAX_REQUEST_COMPUTE = _env_float("VIWO_DIFFUSERS_MAX_REQUEST_COMPUTE", 0.0)
+
+# Compute units each caller regains per second (0 = no per-caller quotas)
+CALLER_COMPUTE_RATE = _env_float("VIWO_DIFFUSERS_CALLER_COMPUTE_RATE", 0.0)
+
+# Compute units a caller can spend at once with per-caller quotas
+CALLER_COMPUTE_BURST = _env_float("VIWO_DIFFUSERS_CALLER_COMPUTE_BURST", 2000.0)
+
+# Default zlib compression level for PNG responses (0-9, lower is faster and larger)
+PNG_COMPRESS_LEVEL = _env_int("VIWO_DIFFUSERS_PNG_COMPRESS_LEVEL", 6)
+
+# Default quality for WebP and JPEG responses (1-100)
+IMAGE_QUALITY = _env_int("VIWO_DIFFUSERS_IMAGE_QUALITY", 90)
+
+# Models whose pipelines are loaded and warmed up at startup, e.g. "runwayml/stable-diffusion-v1-5"
+PRELOAD_MODELS = _env_list("VIWO_DIFFUSERS_PRELOAD_MODELS")
+
+# ControlNet types loaded at startup, with their preprocessors, e.g. "canny,depth"
+PRELOAD_CONTROLNETS = _env_list("VIWO_DIFFUSERS_PRELOAD_CONTROLNETS")
+
+# Upscalers loaded at startup: "realesrgan_4x", "realesrgan_2x", "esrgan_4x", "gfpgan", ...
+PRELOAD_UPSCALERS = _env_list("VIWO_DIFFUSERS_PRELOAD_UPSCALERS")
+
+# Denoising steps of the warmup inference run for each preloaded pipeline (0 = load only)
+WARMUP_STEPS = _env_int("VIWO_DIFFUSERS_WARMUP_STEPS", 2)
+
+# Minimum level of the server's JSON log lines (DEBUG also logs health checks and polling)
+LOG_LEVEL = _env_str("VIWO_DIFFUSERS_LOG_LEVEL", "INFO")
+
+
+def max_concurrency_for(device: str) -> int:
+    """Get the configured concurrency limit for a device."""
+    return MAX_CONCURRENCY.get(device, MAX_CONCURRENCY["*"])
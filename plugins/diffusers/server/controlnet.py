@@ -4,26 +4,42 @@ ControlNet manager for guided image generation.
 Provides ControlNet model loading, preprocessing, and generation capabilities.
 """
 
-from typing import Any, Literal
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Literal
 
-import cv2
 import numpy as np
-import torch
-from controlnet_aux import CannyDetector, HEDdetector, MidasDetector, OpenposeDetector
-from diffusers import ControlNetModel, StableDiffusionControlNetPipeline
 from PIL import Image
 
+from devices import inference_policy
+from logs import log_event
+from pipelines import load_controlnet_pipeline
+from progress import ProgressCallback, step_callback_kwargs
+from prompts import PromptEmbeddingCache
+from registry import ModelRegistry
+from timing import run_pipeline
+
+if TYPE_CHECKING:
+    from diffusers import ControlNetModel
+
 ControlType = Literal["canny", "depth", "hed", "openpose", "scribble"]
 
 
 class ControlNetManager:
     """Manages ControlNet models and preprocessors."""
 
-    def __init__(self):
-        """Initialize the ControlNet manager with empty caches."""
-        self.models: dict[str, ControlNetModel] = {}
-        self.pipelines: dict[str, StableDiffusionControlNetPipeline] = {}
-        self.preprocessors: dict[str, Any] = {}
+    def __init__(
+        self, registry: ModelRegistry, prompt_embeddings: PromptEmbeddingCache | None = None
+    ):
+        """
+        Initialize the ControlNet manager.
+
+        Args:
+            registry: Registry that holds loaded models, pipelines, and preprocessors
+            prompt_embeddings: Cache of encoded prompts (optional)
+        """
+        self.registry = registry
+        self.prompt_embeddings = prompt_embeddings or PromptEmbeddingCache(max_bytes=0)
 
     def get_available_types(self) -> list[dict[str, str]]:
         """
@@ -70,25 +86,29 @@ class ControlNetManager:
         Returns:
             Preprocessor instance
         """
-        if control_type in self.preprocessors:
-            return self.preprocessors[control_type]
+        if control_type not in ("canny", "depth", "hed", "openpose", "scribble"):
+            raise ValueError(f"Unknown control type: {control_type}")
 
-        if control_type == "canny":
-            preprocessor = CannyDetector()
-        elif control_type == "depth":
-            preprocessor = MidasDetector.from_pretrained("lllyasviel/Annotators")
-        elif control_type == "hed":
-            preprocessor = HEDdetector.from_pretrained("lllyasviel/Annotators")
-        elif control_type == "openpose":
-            preprocessor = OpenposeDetector.from_pretrained("lllyasviel/Annotators")
-        elif control_type == "scribble":
+        def load() -> Any:
+            from controlnet_aux import (
+                CannyDetector,
+                HEDdetector,
+                MidasDetector,
+                OpenposeDetector,
+            )
+
+            if control_type == "canny":
+                return CannyDetector()
+            if control_type == "depth":
+                return MidasDetector.from_pretrained("lllyasviel/Annotators")
+            if control_type == "hed":
+                return HEDdetector.from_pretrained("lllyasviel/Annotators")
+            if control_type == "openpose":
+                return OpenposeDetector.from_pretrained("lllyasviel/Annotators")
             # Scribble doesn't need preprocessing - user draws directly
-            preprocessor = None
-        else:
-            raise ValueError(f"Unknown control type: {control_type}")
+            return None
 
-        self.preprocessors[control_type] = preprocessor
-        return preprocessor
+        return self.registry.get_or_load(f"preprocessor:{control_type}", load)
 
     def preprocess(self, image: Image.Image, control_type: ControlType) -> Image.Image:
         """
@@ -128,11 +148,6 @@ class ControlNetManager:
         Returns:
             Loaded ControlNet model
         """
-        if control_type in self.models:
-            return self.models[control_type]
-
-        print(f"Loading ControlNet model: {control_type}")
-
         # Map control types to model IDs
         model_map = {
             "canny": "lllyasviel/sd-controlnet-canny",
@@ -146,13 +161,15 @@ class ControlNetManager:
         if not model_id:
             raise ValueError(f"Unknown control type: {control_type}")
 
-        model = ControlNetModel.from_pretrained(model_id, torch_dtype=torch.float16)
+        def load() -> ControlNetModel:
+            from diffusers import ControlNetModel
 
-        if torch.cuda.is_available():
-            model = model.to("cuda")
+            policy = inference_policy()
+            log_event("model_loading", kind="controlnet", control_type=control_type)
+            model = ControlNetModel.from_pretrained(model_id, torch_dtype=policy.torch_dtype)
+            return policy.place(model)
 
-        self.models[control_type] = model
-        return model
+        return self.registry.get_or_load(f"controlnet:{control_type}", load)
 
     def generate(
         self,
@@ -167,6 +184,7 @@ class ControlNetManager:
         guidance_scale: float = 7.5,
         negative_prompt: str | None = None,
         seed: int | None = None,
+        progress: ProgressCallback | None = None,
     ) -> Image.Image:
         """
         Generate image with ControlNet guidance.
@@ -183,6 +201,7 @@ class ControlNetManager:
             guidance_scale: Classifier-free guidance scale
             negative_prompt: Negative prompt (optional)
             seed: Random seed (optional)
+            progress: Callback receiving (step, total) after each denoising step (optional)
 
         Returns:
             Generated PIL Image
@@ -190,45 +209,32 @@ class ControlNetManager:
         # Load ControlNet model
         controlnet = self.load_controlnet(control_type)
 
-        # Create or retrieve pipeline
-        pipeline_key = f"{base_model}:{control_type}"
-        if pipeline_key not in self.pipelines:
-            print(f"Creating ControlNet pipeline: {pipeline_key}")
-            pipeline = StableDiffusionControlNetPipeline.from_pretrained(
-                base_model, controlnet=controlnet, torch_dtype=torch.float16
-            )
-            if torch.cuda.is_available():
-                pipeline = pipeline.to("cuda")
-            self.pipelines[pipeline_key] = pipeline
-        else:
-            pipeline = self.pipelines[pipeline_key]
+        # Create or retrieve pipeline, sharing the base model's loaded weights
+        pipeline = load_controlnet_pipeline(
+            self.registry, base_model, f"controlnet:{control_type}", controlnet
+        )
 
         # Set random seed
-        generator = None
-        if seed is not None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            generator = torch.Generator(device=device)
-            generator.manual_seed(seed)
+        generator = inference_policy().generator(seed) if seed is not None else None
 
         # Build generation kwargs
         kwargs: dict[str, Any] = {
-            "prompt": prompt,
+            **self.prompt_embeddings.pipeline_kwargs(pipeline, base_model, prompt, negative_prompt),
             "image": control_image,
             "num_inference_steps": num_inference_steps,
             "guidance_scale": guidance_scale,
             "controlnet_conditioning_scale": strength,
             "generator": generator,
+            **step_callback_kwargs(progress, num_inference_steps),
         }
 
         if width is not None:
             kwargs["width"] = width
         if height is not None:
             kwargs["height"] = height
-        if negative_prompt is not None:
-            kwargs["negative_prompt"] = negative_prompt
 
         # Generate
-        result = pipeline(**kwargs)
+        result = run_pipeline(pipeline, **kwargs)
 
         # Extract image
         if hasattr(result, "images"):
@@ -0,0 +1,247 @@
+"""
+Compute cost estimates and per-caller quotas.
+
+Every operation's cost is estimated before it runs, in compute units: one unit is one
+megapixel denoised for one step by a Stable Diffusion 1.x UNet. Other models and
+networks are expressed relative to that. Requests whose cost exceeds the per-request
+limit are rejected outright, and every caller draws from a token bucket, so no single
+client can fill the device's queue with hours of work.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from pipelines import ModelFamily, model_family
+
+# Rough cost of one denoising step per megapixel, relative to Stable Diffusion 1.x
+FAMILY_WEIGHTS: dict[ModelFamily, float] = {"sd": 1.0, "sdxl": 2.0, "sd3": 3.0, "flux": 6.0}
+
+# Resolution models are assumed to run at before they are loaded
+FAMILY_RESOLUTIONS: dict[ModelFamily, int] = {"sd": 512, "sdxl": 1024, "sd3": 1024, "flux": 1024}
+
+# A ControlNet runs alongside the UNet at every step
+CONTROLNET_WEIGHT = 1.5
+
+# Cost per input megapixel of the 4x RealESRGAN/ESRGAN networks (2x runs at 1/4 the pixels)
+UPSCALE_UNITS_PER_MEGAPIXEL = 10.0
+
+# Cost per input megapixel of GFPGAN face restoration
+FACE_RESTORE_UNITS_PER_MEGAPIXEL = 2.0
+
+# Cost per input megapixel of ControlNet preprocessors
+PREPROCESS_UNITS_PER_MEGAPIXEL = 0.5
+
+
+def family_resolution(model_id: str) -> int:
+    """Get the resolution a model is assumed to run at when no size is requested."""
+    return FAMILY_RESOLUTIONS[model_family(model_id)]
+
+
+def diffusion_cost(
+    width: int, height: int, steps: int, model_id: str, strength: float = 1.0
+) -> float:
+    """
+    Estimate the cost of one diffusion pipeline call.
+
+    Args:
+        width: Width the pipeline runs at
+        height: Height the pipeline runs at
+        steps: Requested denoising steps
+        model_id: Model identifier, which determines the model family
+        strength: Img2img/inpainting strength; only this fraction of the steps runs
+
+    Returns:
+        Cost in compute units
+    """
+    executed = max(1, int(steps * min(max(strength, 0.0), 1.0)))
+    return width * height * executed / 1_000_000 * FAMILY_WEIGHTS[model_family(model_id)]
+
+
+def max_compute_cost(width: int, height: int, steps: int) -> float:
+    """
+    Get the cost of an inpaint or outpaint call in the unit of its `max_compute` field.
+
+    That field predates compute units and keeps its original meaning: output megapixels
+    times requested steps, whatever the model family, strength, or mode.
+
+    Args:
+        width: Output width
+        height: Output height
+        steps: Requested denoising steps
+
+    Returns:
+        Cost in megapixel-steps
+    """
+    return width * height * steps / 1_000_000
+
+
+def upscale_cost(width: int, height: int, factor: int) -> float:
+    """
+    Estimate the cost of a RealESRGAN/ESRGAN upscale.
+
+    Args:
+        width: Input width
+        height: Input height
+        factor: Upscale factor (2 or 4)
+
+    Returns:
+        Cost in compute units
+    """
+    return width * height / 1_000_000 * UPSCALE_UNITS_PER_MEGAPIXEL * (factor / 4) ** 2
+
+
+def face_restore_cost(width: int, height: int) -> float:
+    """Estimate the cost of GFPGAN face restoration, in compute units."""
+    return width * height / 1_000_000 * FACE_RESTORE_UNITS_PER_MEGAPIXEL
+
+
+def preprocess_cost(width: int, height: int) -> float:
+    """Estimate the cost of preprocessing a ControlNet control image, in compute units."""
+    return width * height / 1_000_000 * PREPROCESS_UNITS_PER_MEGAPIXEL
+
+
+class ComputeLimitError(ValueError):
+    """Raised when a single request costs more than the per-request limit."""
+
+
+class QuotaExceededError(Exception):
+    """Raised when a caller's compute quota cannot cover a request yet."""
+
+    def __init__(self, caller: str, cost: float, retry_after: int):
+        """
+        Initialize the error.
+
+        Args:
+            caller: Caller whose quota is exhausted
+            cost: Cost of the rejected request
+            retry_after: Seconds until the quota covers the request
+        """
+        super().__init__(
+            f"Compute quota of '{caller}' exceeded by a request costing {cost:.2f}, "
+            f"retry after {retry_after}s"
+        )
+        self.caller = caller
+        self.cost = cost
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Bucket:
+    """A caller's token bucket."""
+
+    tokens: float
+    updated_at: float
+
+
+class ComputeQuotas:
+    """Enforces a per-request cost limit and per-caller token buckets."""
+
+    def __init__(self, max_request: float | None = None, rate: float = 0.0, burst: float = 0.0):
+        """
+        Initialize the quotas.
+
+        Args:
+            max_request: Maximum cost of a single request (None = unlimited)
+            rate: Compute units each caller regains per second (0 = no per-caller quotas)
+            burst: Compute units a caller can spend at once; a full bucket holds this much
+        """
+        self.max_request = max_request
+        self.rate = rate
+        self.burst = burst
+
+        self._buckets: dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._rejected = 0
+        self._refunded = 0
+        self._spent = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """Whether callers are held to token buckets."""
+        return self.rate > 0 and self.burst > 0
+
+    def charge(self, caller: str, cost: float) -> None:
+        """
+        Admit a request, taking its cost from the caller's bucket.
+
+        Args:
+            caller: Caller ID
+            cost: Estimated cost of the request
+
+        Raises:
+            ComputeLimitError: If the request costs more than any caller may spend at once
+            QuotaExceededError: If the caller's bucket does not hold enough yet
+        """
+        limit = self.max_request
+        if self.enabled:
+            limit = self.burst if limit is None else min(limit, self.burst)
+        if limit is not None and cost > limit:
+            with self._lock:
+                self._rejected += 1
+            raise ComputeLimitError(f"Compute cost {cost:.2f} exceeds limit {limit:.2f}")
+
+        with self._lock:
+            if self.enabled:
+                now = time.monotonic()
+                self._prune(now)
+                bucket = self._buckets.setdefault(caller, _Bucket(self.burst, now))
+                bucket.tokens = min(
+                    self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate
+                )
+                bucket.updated_at = now
+                if bucket.tokens < cost:
+                    self._rejected += 1
+                    retry_after = max(1, int(-(-(cost - bucket.tokens) // self.rate)))
+                    raise QuotaExceededError(caller, cost, retry_after)
+                bucket.tokens -= cost
+
+            self._admitted += 1
+            self._spent += cost
+
+    def refund(self, caller: str, cost: float) -> None:
+        """
+        Give back what a request was charged when it did no compute after all.
+
+        Used for requests that failed, and for jobs whose result came from the cache.
+
+        Args:
+            caller: Caller the request was charged to
+            cost: Cost the request was charged
+        """
+        with self._lock:
+            bucket = self._buckets.get(caller)
+            if bucket is not None:
+                bucket.tokens = min(self.burst, bucket.tokens + cost)
+            self._refunded += 1
+            self._spent -= cost
+
+    def _prune(self, now: float) -> None:
+        """Forget callers whose buckets have refilled; a new bucket starts full anyway."""
+        refill = self.burst / self.rate
+        stale = [
+            caller for caller, bucket in self._buckets.items() if now - bucket.updated_at >= refill
+        ]
+        for caller in stale:
+            del self._buckets[caller]
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get quota statistics.
+
+        Returns:
+            Dictionary with limits, tracked callers, and counters
+        """
+        with self._lock:
+            return {
+                "max_request": self.max_request,
+                "rate": self.rate,
+                "burst": self.burst,
+                "callers": len(self._buckets),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "refunded": self._refunded,
+                "spent": self._spent,
+            }
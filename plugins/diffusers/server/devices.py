@@ -0,0 +1,286 @@
+"""
+Inference device detection and the device and dtype policy.
+
+`torch.cuda.is_available()` needs torch, and importing torch takes seconds. The server
+picks its device and memory budget at import time, so it asks the installed torch build
+and the CUDA driver directly instead, and leaves importing torch to the first feature
+that needs it.
+
+The policy decides how every model is loaded: on which device, in which dtype, and in
+which memory layout. Accelerators get float16. CPUs get bfloat16 where they compute it
+natively and float32 otherwise, since float16 on CPU is slow or unsupported. On CPU,
+convolution weights are stored channels-last, which oneDNN runs fastest, and PyTorch's
+thread pool is split between the jobs allowed to run at once.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import functools
+import importlib.util
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Literal, TypeVar, get_args
+
+import config
+from logs import log_event
+
+if TYPE_CHECKING:
+    import torch
+
+DtypeName = Literal["float16", "bfloat16", "float32"]
+
+T = TypeVar("T")
+
+
+def _torch_libraries() -> list[str]:
+    """List the shared libraries shipped with the installed torch, without importing it."""
+    spec = importlib.util.find_spec("torch")
+    if spec is None or not spec.submodule_search_locations:
+        return []
+    library_dir = Path(next(iter(spec.submodule_search_locations))) / "lib"
+    if not library_dir.is_dir():
+        return []
+    return [path.name for path in library_dir.iterdir()]
+
+
+@functools.cache
+def _cuda_driver() -> ctypes.CDLL | None:
+    """Load and initialize the CUDA driver library, or None without a usable driver."""
+    try:
+        driver = ctypes.CDLL("nvcuda.dll" if sys.platform == "win32" else "libcuda.so.1")
+    except OSError:
+        return None
+    return driver if driver.cuInit(0) == 0 else None
+
+
+def cuda_device_count() -> int:
+    """Count the CUDA devices visible to this process, honoring `CUDA_VISIBLE_DEVICES`."""
+    driver = _cuda_driver()
+    count = ctypes.c_int(0)
+    if driver is None or driver.cuDeviceGetCount(ctypes.byref(count)) != 0:
+        return 0
+    return count.value
+
+
+def cuda_total_memory(index: int = 0) -> int:
+    """
+    Get the total memory of a CUDA device.
+
+    Args:
+        index: Device index among the visible devices
+
+    Returns:
+        Memory in bytes (0 if the device does not exist)
+    """
+    driver = _cuda_driver()
+    device = ctypes.c_int(0)
+    total = ctypes.c_size_t(0)
+    if (
+        driver is None
+        or driver.cuDeviceGet(ctypes.byref(device), index) != 0
+        or driver.cuDeviceTotalMem_v2(ctypes.byref(total), device) != 0
+    ):
+        return 0
+    return total.value
+
+
+def detect_device() -> str:
+    """
+    Detect the device inference runs on.
+
+    Matches `torch.cuda.is_available()`: "cuda" when torch was built with CUDA and the
+    driver reports a device, otherwise "cpu". ROCm builds, which torch also reports as
+    "cuda", cannot be probed this way and fall back to importing torch.
+
+    Returns:
+        "cuda" or "cpu"
+    """
+    libraries = [] if "torch" in sys.modules else _torch_libraries()
+    if libraries and not any("torch_hip" in name for name in libraries):
+        if any("torch_cuda" in name for name in libraries):
+            return "cuda" if cuda_device_count() > 0 else "cpu"
+        return "cpu"
+
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def available_cpus() -> int:
+    """
+    Count the CPUs this process may use.
+
+    Honors CPU affinity and cgroup v2 CPU quotas (container CPU limits), which
+    `os.cpu_count()` and PyTorch's default thread count ignore.
+
+    Returns:
+        Number of CPUs, at least 1
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether the CPU computes bfloat16 natively (AVX512-BF16 or AMX), rather than emulating it."""
+    import torch
+
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+
+@functools.cache
+def _configure_cpu_threads(threads: int) -> None:
+    """Set PyTorch's intra-op thread count, once per process."""
+    import torch
+
+    torch.set_num_threads(threads)
+    log_event("torch_threads", threads=threads)
+
+
+@dataclass(frozen=True)
+class DevicePolicy:
+    """Where models run, and in which dtype and memory layout."""
+
+    device: str  # "cuda", "cuda:1", "mps", or "cpu"
+    dtype: DtypeName | Literal["auto"] = "auto"
+    channels_last: bool | None = None  # None = on CPU only
+    cpu_threads: int = 0  # intra-op threads on CPU (0 = available CPUs / concurrency)
+
+    @classmethod
+    def from_config(cls) -> DevicePolicy:
+        """
+        Build the policy from the `VIWO_DIFFUSERS_*` settings.
+
+        Returns:
+            The configured policy
+
+        Raises:
+            ValueError: If a setting has an unknown value
+        """
+        device = detect_device() if config.DEVICE == "auto" else config.DEVICE
+        if config.DTYPE not in ("auto", *get_args(DtypeName)):
+            raise ValueError(f"Unknown dtype '{config.DTYPE}', expected float16/bfloat16/float32")
+        layouts = {"auto": None, "on": True, "off": False}
+        if config.CHANNELS_LAST not in layouts:
+            raise ValueError(f"Unknown channels-last setting '{config.CHANNELS_LAST}'")
+        threads = config.CPU_THREADS or max(
+            1, available_cpus() // config.max_concurrency_for(device.partition(":")[0])
+        )
+        return cls(
+            device=device,
+            dtype=config.DTYPE,  # type: ignore[arg-type]
+            channels_last=layouts[config.CHANNELS_LAST],
+            cpu_threads=threads,
+        )
+
+    @property
+    def device_type(self) -> str:
+        """Device without its index, e.g. "cuda"."""
+        return self.device.partition(":")[0]
+
+    @functools.cached_property
+    def dtype_name(self) -> DtypeName:
+        """Dtype models are loaded in (imports torch to probe the CPU when "auto")."""
+        if self.dtype != "auto":
+            return self.dtype
+        if self.device_type != "cpu":
+            return "float16"
+        return "bfloat16" if cpu_supports_bf16() else "float32"
+
+    @property
+    def torch_dtype(self) -> torch.dtype:
+        """Dtype models are loaded in, for `from_pretrained(torch_dtype=...)`."""
+        import torch
+
+        return getattr(torch, self.dtype_name)
+
+    @property
+    def uses_channels_last(self) -> bool:
+        """Whether convolution weights are stored channels-last."""
+        return self.device_type == "cpu" if self.channels_last is None else self.channels_last
+
+    @property
+    def upscale_precision(self) -> Literal["fp32", "fp16", "bf16"]:
+        """Precision of RealESRGAN upscales set to `auto`; their weights stay float32."""
+        if self.dtype_name == "float16" and self.device_type == "cuda":
+            return "fp16"
+        if self.dtype_name == "bfloat16":
+            return "bf16"
+        return "fp32"
+
+    def place(self, model: T) -> T:
+        """
+        Move a loaded pipeline or module to the device, in the policy's memory layout.
+
+        Also tunes PyTorch's CPU threads the first time a model is placed on CPU.
+
+        Args:
+            model: Diffusers pipeline or `torch.nn.Module`
+
+        Returns:
+            The model on the device
+        """
+        import torch
+
+        if self.device_type == "cpu":
+            _configure_cpu_threads(self.cpu_threads)
+
+        placed: Any = model.to(self.device)  # type: ignore[attr-defined]
+        if self.uses_channels_last:
+            components = getattr(placed, "components", None)
+            modules = components.values() if isinstance(components, dict) else [placed]
+            for module in modules:
+                if isinstance(module, torch.nn.Module):
+                    module.to(memory_format=torch.channels_last)
+        return placed
+
+    def generator(self, seed: int | None = None) -> torch.Generator:
+        """
+        Create a random generator for a pipeline call.
+
+        Args:
+            seed: Seed (None = a random seed)
+
+        Returns:
+            Generator on the device (on CPU for MPS, which diffusers recommends)
+        """
+        import torch
+
+        generator = torch.Generator(device="cpu" if self.device_type == "mps" else self.device)
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        return generator
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Describe the policy, without importing torch.
+
+        Returns:
+            Dictionary with the device, dtype ("auto" until resolved), layout, and CPU threads
+        """
+        return {
+            "device": self.device,
+            "dtype": self.__dict__.get("dtype_name", self.dtype),
+            "channels_last": self.uses_channels_last,
+            "cpu_threads": self.cpu_threads if self.device_type == "cpu" else None,
+        }
+
+
+@functools.cache
+def inference_policy() -> DevicePolicy:
+    """Get the server's device policy, built from its configuration on first use."""
+    return DevicePolicy.from_config()
@@ -0,0 +1,134 @@
+"""
+Image encoding for responses.
+
+Results are encoded once, as PNG, WebP, or JPEG, and then either sent as raw bytes or
+wrapped in base64 for JSON responses. Clients pick raw bytes through the `Accept` header.
+"""
+
+import base64
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Literal, get_args
+
+from PIL import Image
+
+import config
+
+ImageFormat = Literal["png", "webp", "jpeg"]
+
+IMAGE_FORMATS: tuple[ImageFormat, ...] = get_args(ImageFormat)
+
+MEDIA_TYPES: dict[ImageFormat, str] = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+}
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """An encoded result image."""
+
+    data: bytes
+    format: ImageFormat
+    width: int
+    height: int
+
+    @property
+    def media_type(self) -> str:
+        """MIME type of the encoded data."""
+        return MEDIA_TYPES[self.format]
+
+    def to_base64(self) -> str:
+        """Get the encoded data as a base64 string."""
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+def encode_image(
+    image: Image.Image,
+    image_format: ImageFormat = "png",
+    quality: int | None = None,
+    compress_level: int | None = None,
+) -> EncodedImage:
+    """
+    Encode an image.
+
+    Args:
+        image: Image to encode
+        image_format: Output format
+        quality: WebP/JPEG quality, 1-100 (defaults to the configured quality)
+        compress_level: PNG compression level, 0-9 (defaults to the configured level)
+
+    Returns:
+        EncodedImage with the encoded bytes
+
+    Raises:
+        ValueError: If the format or an option is out of range
+    """
+    if image_format not in MEDIA_TYPES:
+        raise ValueError(f"Format must be one of {IMAGE_FORMATS}")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+    if compress_level is not None and not 0 <= compress_level <= 9:
+        raise ValueError("Compression level must be between 0 and 9")
+
+    buffered = BytesIO()
+    if image_format == "png":
+        level = config.PNG_COMPRESS_LEVEL if compress_level is None else compress_level
+        image.save(buffered, format="PNG", compress_level=level)
+    elif image_format == "webp":
+        image.save(buffered, format="WEBP", quality=quality or config.IMAGE_QUALITY)
+    else:
+        # JPEG has no alpha channel or palette
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffered, format="JPEG", quality=quality or config.IMAGE_QUALITY)
+
+    return EncodedImage(
+        data=buffered.getvalue(),
+        format=image_format,
+        width=image.width,
+        height=image.height,
+    )
+
+
+def negotiate_format(
+    accept: str | None, preferred: ImageFormat | None = None
+) -> ImageFormat | None:
+    """
+    Pick a binary image format from an `Accept` header.
+
+    Args:
+        accept: Value of the request's `Accept` header
+        preferred: Format to use when the client accepts any image type
+
+    Returns:
+        Format to send as raw bytes, or None if the client wants the JSON response
+    """
+    if not accept:
+        return None
+
+    # Rank media ranges by their q-value, keeping header order for ties
+    ranges: list[tuple[float, int, str]] = []
+    for index, part in enumerate(accept.split(",")):
+        media_range, *params = (piece.strip() for piece in part.split(";"))
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if weight > 0:
+            ranges.append((-weight, index, media_range.lower()))
+
+    for _, _, media_range in sorted(ranges):
+        if media_range in ("application/json", "*/*"):
+            return None
+        if media_range == "image/*":
+            return preferred or "png"
+        for image_format, media_type in MEDIA_TYPES.items():
+            if media_range == media_type:
+                return image_format
+    return None
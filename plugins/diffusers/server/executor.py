@@ -0,0 +1,178 @@
+"""
+Inference executor that keeps blocking pipeline work off the event loop.
+
+Jobs run on a dedicated thread pool sized to the device's concurrency limit. Jobs beyond
+that limit wait in a bounded queue; once the queue is full new jobs are rejected
+immediately so the server stays responsive under saturation.
+"""
+
+import asyncio
+import contextvars
+import functools
+import math
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from timing import record
+
+T = TypeVar("T")
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot accept more work."""
+
+    def __init__(self, retry_after: int):
+        """
+        Initialize the error.
+
+        Args:
+            retry_after: Suggested number of seconds before the client retries
+        """
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Runs blocking inference calls on a bounded, per-device thread pool."""
+
+    def __init__(
+        self,
+        device: str,
+        max_concurrency: int = 1,
+        max_queue: int = 16,
+        min_retry_after: float = 1.0,
+    ):
+        """
+        Initialize the executor.
+
+        Args:
+            device: Device the jobs run on (used for thread names and stats)
+            max_concurrency: Number of jobs allowed to run at once
+            max_queue: Number of jobs allowed to wait for a free slot
+            min_retry_after: Lower bound for the `Retry-After` hint, in seconds
+        """
+        self.device = device
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.min_retry_after = min_retry_after
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix=f"inference-{device}"
+        )
+        self._lock = threading.Lock()
+        self._pending = 0  # queued + running
+        self._running = 0
+        self._rejected = 0
+        self._completed = 0
+        # Exponentially weighted average job duration, used for `Retry-After`
+        self._average_duration = 0.0
+
+    @property
+    def running(self) -> int:
+        """Number of jobs currently running."""
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        """Number of jobs waiting for a free slot."""
+        return max(0, self._pending - self._running)
+
+    def retry_after(self) -> int:
+        """Estimate how many seconds until a queue slot frees up."""
+        waves = (self.queued + 1) / self.max_concurrency
+        return max(math.ceil(self.min_retry_after), math.ceil(self._average_duration * waves))
+
+    def check_capacity(self) -> None:
+        """
+        Ensure another job can be queued.
+
+        Raises:
+            QueueFullError: If the wait queue is full
+        """
+        if self._pending >= self.max_concurrency + self.max_queue:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError(self.retry_after())
+
+    async def run(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        """
+        Run a blocking function on the inference pool.
+
+        The calling context is copied into the worker thread so context variables remain
+        visible to the job.
+
+        Args:
+            fn: Blocking function to run
+            *args: Positional arguments for `fn`
+            **kwargs: Keyword arguments for `fn`
+
+        Returns:
+            Return value of `fn`
+
+        Raises:
+            QueueFullError: If the wait queue is full
+        """
+        self.check_capacity()
+
+        context = contextvars.copy_context()
+        submitted = time.perf_counter()
+        call = functools.partial(context.run, self._run_timed, submitted, fn, *args, **kwargs)
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._pool.submit(call)
+        except BaseException:
+            self._release()
+            raise
+        # The job keeps its slot until it finishes, even if the caller stops waiting for it
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future: Future[Any] | None = None) -> None:
+        """Free a job's slot once it finished or was cancelled before starting."""
+        with self._lock:
+            self._pending -= 1
+
+    def _run_timed(self, submitted: float, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        """Run a job on the current worker thread, tracking running count and duration."""
+        with self._lock:
+            self._running += 1
+        start = time.perf_counter()
+        record("queue", start - submitted)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            record("inference", duration)
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                if self._average_duration == 0.0:
+                    self._average_duration = duration
+                else:
+                    self._average_duration = 0.8 * self._average_duration + 0.2 * duration
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get executor statistics.
+
+        Returns:
+            Dictionary with device, limits, queue depth, and job counters
+        """
+        return {
+            "device": self.device,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "average_duration": self._average_duration,
+        }
+
+    def shutdown(self) -> None:
+        """Stop accepting work and cancel jobs that have not started."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
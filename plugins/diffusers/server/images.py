@@ -0,0 +1,305 @@
+"""
+Server-side image store for iterative editing.
+
+Clients upload an image once, or ask an operation to keep its output, and then refer to
+it by handle in later requests. Stored images are kept decoded in memory up to a budget,
+spilled to disk beyond it, and expire after a period without use.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+
+from cache import HandleNotFoundError, content_key, hash_bytes
+from logs import log_event
+
+HANDLE_PREFIX = "img_"
+
+
+def is_image_handle(value: object) -> bool:
+    """Whether a request value is an image handle rather than image data."""
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+@dataclass
+class _StoredImage:
+    """A stored image, in memory and/or spilled to disk."""
+
+    image: Image.Image | None
+    path: Path | None
+    width: int
+    height: int
+    memory_bytes: int
+    disk_bytes: int
+    last_used: float
+
+
+class ImageStore:
+    """Keeps images referenced by handle, with a memory budget, disk spill, and TTL."""
+
+    def __init__(
+        self,
+        memory_bytes: int = 512 * 1024**2,
+        disk_dir: str | None = None,
+        disk_bytes: int = 0,
+        ttl: float = 3600.0,
+    ):
+        """
+        Initialize an empty store.
+
+        Images a previous run spilled to disk are deleted, since their handles are gone.
+        Other files in the directory are left alone.
+
+        Args:
+            memory_bytes: Maximum size of decoded images kept in memory
+            disk_dir: Directory images are spilled to (None = no spilling)
+            disk_bytes: Maximum size of spilled images (0 = no spilling)
+            ttl: Seconds an image is kept after it was last used
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir and disk_bytes > 0 else None
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+
+        self._entries: OrderedDict[str, _StoredImage] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._spills = 0
+        self._expired = 0
+
+        if self.disk_dir is not None:
+            try:
+                self._remove_spilled(self.disk_dir)
+            except OSError as error:
+                log_event("image_store_spill_disabled", logging.WARNING, error=str(error))
+                self.disk_dir = None
+
+    @staticmethod
+    def _remove_spilled(directory: Path) -> None:
+        """Create the spill directory, deleting the images a previous run spilled to it."""
+        directory.mkdir(parents=True, exist_ok=True)
+        for path in directory.glob(f"{HANDLE_PREFIX}*.png"):
+            if path.is_file():
+                path.unlink(missing_ok=True)
+
+    def put(self, image: Image.Image) -> str:
+        """
+        Store an image.
+
+        Handles are derived from the image contents, so storing the same image twice
+        returns the same handle.
+
+        Args:
+            image: Image to store
+
+        Returns:
+            Handle of the stored image
+        """
+        digest = content_key(image.mode, image.size, hash_bytes(image.tobytes()))
+        handle = HANDLE_PREFIX + digest[:32]
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                entry.last_used = now
+                self._entries.move_to_end(handle)
+                return handle
+
+            self._entries[handle] = _StoredImage(
+                image=image,
+                path=None,
+                width=image.width,
+                height=image.height,
+                memory_bytes=image.width * image.height * len(image.getbands()),
+                disk_bytes=0,
+                last_used=now,
+            )
+
+        self.prune()
+        return handle
+
+    def get(self, handle: str) -> Image.Image:
+        """
+        Get a stored image, loading it back into memory if it was spilled.
+
+        Args:
+            handle: Image handle
+
+        Returns:
+            The stored image
+
+        Raises:
+            HandleNotFoundError: If the handle does not exist or has expired
+        """
+        self.prune()
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                self._misses += 1
+                raise HandleNotFoundError(f"Image handle '{handle}' not found or expired")
+            self._hits += 1
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(handle)
+            image, path = entry.image, entry.path
+
+        if image is None:
+            assert path is not None
+            try:
+                with Image.open(path) as spilled:
+                    image = spilled.copy()
+            except OSError as error:
+                self.delete(handle)
+                raise HandleNotFoundError(f"Image handle '{handle}' is unreadable") from error
+            with self._lock:
+                entry.image = image
+            self.prune()
+        return image
+
+    def info(self, handle: str) -> dict[str, Any]:
+        """
+        Get a stored image's size and remaining lifetime without loading it.
+
+        Args:
+            handle: Image handle
+
+        Returns:
+            Dictionary with handle, width, height, and expires_in (seconds)
+
+        Raises:
+            HandleNotFoundError: If the handle does not exist or has expired
+        """
+        self.prune()
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                raise HandleNotFoundError(f"Image handle '{handle}' not found or expired")
+            return {
+                "handle": handle,
+                "width": entry.width,
+                "height": entry.height,
+                "expires_in": max(0.0, entry.last_used + self.ttl - time.monotonic()),
+            }
+
+    def delete(self, handle: str) -> bool:
+        """
+        Remove a stored image.
+
+        Args:
+            handle: Image handle
+
+        Returns:
+            True if the image existed
+        """
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+        if entry is None:
+            return False
+        if entry.path is not None:
+            entry.path.unlink(missing_ok=True)
+        return True
+
+    def clear(self) -> None:
+        """Remove every stored image, including spilled files."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            if entry.path is not None:
+                entry.path.unlink(missing_ok=True)
+
+    def prune(self) -> None:
+        """Expire unused images, then spill or drop images to stay within budget."""
+        # Step 1: Expire images not used within the TTL
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry.last_used < cutoff]
+        for handle in expired:
+            if self.delete(handle):
+                self._expired += 1
+
+        # Step 2: Spill least recently used images until memory fits the budget
+        while True:
+            with self._lock:
+                in_memory = [
+                    (handle, entry)
+                    for handle, entry in self._entries.items()
+                    if entry.image is not None
+                ]
+                used = sum(entry.memory_bytes for _, entry in in_memory)
+                if used <= self.memory_bytes or not in_memory:
+                    break
+                handle, entry = in_memory[0]
+            self._spill(handle, entry)
+
+        # Step 3: Drop the oldest spilled images until the disk fits its budget
+        while True:
+            with self._lock:
+                on_disk = [
+                    handle for handle, entry in self._entries.items() if entry.path is not None
+                ]
+                used = sum(self._entries[handle].disk_bytes for handle in on_disk)
+                if used <= self.disk_bytes or not on_disk:
+                    break
+            self.delete(on_disk[0])
+
+    def _spill(self, handle: str, entry: _StoredImage) -> None:
+        """Move an image out of memory, writing it to disk if spilling is enabled."""
+        image = entry.image
+        if image is None:
+            return
+
+        if entry.path is None and self.disk_dir is not None:
+            path = self.disk_dir / f"{handle}.png"
+            try:
+                # Fast compression; spilled images are read back by this process only
+                image.save(path, format="PNG", compress_level=1)
+            except OSError as error:
+                log_event(
+                    "image_store_spill_failed", logging.WARNING, handle=handle, error=str(error)
+                )
+                path.unlink(missing_ok=True)
+            else:
+                entry.path = path
+                entry.disk_bytes = path.stat().st_size
+
+        if entry.path is None:
+            # Nowhere to keep it
+            self.delete(handle)
+            return
+
+        with self._lock:
+            entry.image = None
+            self._spills += 1
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get store statistics.
+
+        Returns:
+            Dictionary with image counts, memory and disk use, and hit/miss/spill counters
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                "images": len(entries),
+                "in_memory": sum(1 for entry in entries if entry.image is not None),
+                "memory_bytes": sum(
+                    entry.memory_bytes for entry in entries if entry.image is not None
+                ),
+                "max_memory_bytes": self.memory_bytes,
+                "disk_bytes": sum(entry.disk_bytes for entry in entries),
+                "max_disk_bytes": self.disk_bytes,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "spills": self._spills,
+                "expired": self._expired,
+            }
@@ -0,0 +1,295 @@
+"""
+Models and inference tasks of the diffusers server.
+
+This module holds everything that runs a model: the device policy, the model registry,
+the feature managers, preloading, and the table of inference tasks. It has no HTTP
+state (caches, image store, quotas, or jobs), so worker processes import it instead of
+the server module and never touch the server process's stores.
+"""
+
+import functools
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from PIL import Image
+
+import config
+from controlnet import ControlNetManager
+from devices import inference_policy
+from inpaint import InpaintManager
+from pipelines import (
+    is_inpainting_checkpoint,
+    load_pipeline,
+    load_task_pipeline,
+    model_family,
+    native_resolution,
+)
+from preload import PreloadStep
+from progress import ProgressCallback, report_start, step_callback_kwargs
+from prompts import PromptEmbeddingCache
+from registry import ModelRegistry, default_memory_budget
+from timing import run_pipeline
+from upscale import UpscaleManager
+from upscale_traditional import Img2ImgUpscaler
+
+# Device, dtype, and memory layout models are loaded with
+device_policy = inference_policy()
+device = device_policy.device
+
+# Shared registry for every loaded model, bounded by a memory budget
+model_registry = ModelRegistry(
+    budget_bytes=int(config.MODEL_MEMORY_BUDGET_MB * 1024**2) or default_memory_budget(device),
+    idle_ttl=config.MODEL_IDLE_TTL_S or None,
+)
+
+# Feature managers
+# Text encoder outputs shared by every pipeline call
+prompt_embeddings = PromptEmbeddingCache(max_bytes=int(config.PROMPT_CACHE_MB * 1024**2))
+
+controlnet_manager = ControlNetManager(model_registry, prompt_embeddings)
+inpaint_manager = InpaintManager(model_registry, prompt_embeddings)
+upscale_manager = UpscaleManager(model_registry)
+img2img_upscaler = Img2ImgUpscaler(model_registry, prompt_embeddings)
+
+
+def warm_up_pipeline(model_id: str) -> None:
+    """
+    Load a model's pipeline and run a short generation at its native resolution.
+
+    Inpainting checkpoints are warmed up through their inpainting pipeline.
+
+    Args:
+        model_id: Huggingface model identifier
+    """
+    pipeline = load_pipeline(model_registry, model_id)
+    if config.WARMUP_STEPS <= 0:
+        return
+
+    size = native_resolution(pipeline)
+    kwargs: dict[str, Any] = {
+        "prompt": "",
+        "num_inference_steps": config.WARMUP_STEPS,
+        "width": size,
+        "height": size,
+    }
+    if is_inpainting_checkpoint(pipeline):
+        pipeline = load_task_pipeline(model_registry, model_id, "inpaint")
+        kwargs["image"] = Image.new("RGB", (size, size))
+        kwargs["mask_image"] = Image.new("L", (size, size), 255)
+    pipeline(**kwargs)
+
+
+def warm_up_controlnet(control_type: str) -> None:
+    """
+    Load a ControlNet and its preprocessor, and warm up its pipeline.
+
+    The pipeline is warmed up with each preloaded Stable Diffusion 1.5 model, the family
+    the ControlNets are trained for.
+
+    Args:
+        control_type: Control type, e.g. "canny"
+    """
+    blank = Image.new("RGB", (64, 64))
+    controlnet_manager.preprocess(blank, control_type)  # type: ignore
+    controlnet_manager.load_controlnet(control_type)  # type: ignore
+    if config.WARMUP_STEPS <= 0:
+        return
+
+    for model_id in config.PRELOAD_MODELS:
+        pipeline = load_pipeline(model_registry, model_id)
+        if model_family(model_id) != "sd" or is_inpainting_checkpoint(pipeline):
+            continue
+        size = native_resolution(pipeline)
+        controlnet_manager.generate(
+            "",
+            Image.new("RGB", (size, size)),
+            control_type,  # type: ignore
+            base_model=model_id,
+            width=size,
+            height=size,
+            num_inference_steps=config.WARMUP_STEPS,
+        )
+
+
+def warm_up_upscaler(name: str) -> None:
+    """
+    Load an upscaler or the face restorer and run it on a small image.
+
+    Args:
+        name: "<model>_<factor>x" (e.g. "realesrgan_4x") or "gfpgan"
+
+    Raises:
+        ValueError: If the name is not a known upscaler
+    """
+    blank = Image.new("RGB", (64, 64))
+    if name == "gfpgan":
+        upscale_manager.face_restore(blank)
+        return
+
+    model, _, factor = name.partition("_")
+    if model not in ("realesrgan", "esrgan") or factor not in ("2x", "4x"):
+        raise ValueError(f"Unknown upscaler '{name}', expected e.g. 'realesrgan_4x' or 'gfpgan'")
+    upscale_manager.upscale(blank, model=model, factor=int(factor[0]))  # type: ignore
+
+
+def preload_steps() -> list[PreloadStep]:
+    """Build the preload steps for the configured models, ControlNets and upscalers."""
+    steps: list[PreloadStep] = []
+    for model_id in config.PRELOAD_MODELS:
+        run = functools.partial(warm_up_pipeline, model_id)
+        steps.append(PreloadStep(f"pipeline:{model_id}", run))
+    for control_type in config.PRELOAD_CONTROLNETS:
+        run = functools.partial(warm_up_controlnet, control_type)
+        steps.append(PreloadStep(f"controlnet:{control_type}", run))
+    for name in config.PRELOAD_UPSCALERS:
+        run = functools.partial(warm_up_upscaler, name)
+        steps.append(PreloadStep(f"upscaler:{name}", run))
+    return steps
+
+
+def run_preload_step(step: str) -> None:
+    """
+    Run one of the preload steps, e.g. in a worker process.
+
+    Args:
+        step: Step name, e.g. "pipeline:runwayml/stable-diffusion-v1-5"
+
+    Raises:
+        ValueError: If there is no such step
+    """
+    for candidate in preload_steps():
+        if candidate.name == step:
+            candidate.run()
+            return
+    raise ValueError(f"Unknown preload step '{step}'")
+
+
+def generate_text_to_image_batch(
+    model_id: str,
+    prompts: list[str],
+    negative_prompts: list[str | None],
+    seeds: list[int | None],
+    width: int | None = None,
+    height: int | None = None,
+    num_inference_steps: int = 50,
+    guidance_scale: float = 7.5,
+    progress: ProgressCallback | None = None,
+) -> list[Image.Image]:
+    """
+    Run a batch of compatible text-to-image requests as one pipeline call.
+
+    Each request gets its own generator, so seeded requests produce the same image as
+    when run alone.
+
+    Args:
+        model_id: Huggingface model identifier
+        prompts: Prompt of each request
+        negative_prompts: Negative prompt of each request (None entries for none)
+        seeds: Seed of each request (None entries for a random seed)
+        width: Image width (optional)
+        height: Image height (optional)
+        num_inference_steps: Number of denoising steps
+        guidance_scale: Classifier-free guidance scale
+        progress: Callback receiving (step, total) after each denoising step (optional)
+
+    Returns:
+        Generated PIL Images, in request order
+    """
+    pipeline = load_pipeline(model_registry, model_id)
+
+    # One generator per item keeps seeds exact; unseeded items get a random seed
+    generators = [device_policy.generator(seed) for seed in seeds]
+
+    # Build kwargs based on what the pipeline supports
+    kwargs: dict[str, Any] = {
+        **prompt_embeddings.pipeline_kwargs(pipeline, model_id, prompts, negative_prompts),
+        "num_inference_steps": num_inference_steps,
+        "guidance_scale": guidance_scale,
+        "generator": generators,
+        **step_callback_kwargs(progress, num_inference_steps),
+    }
+
+    # Add optional parameters
+    if width is not None:
+        kwargs["width"] = width
+    if height is not None:
+        kwargs["height"] = height
+
+    # Generate images
+    result = run_pipeline(pipeline, **kwargs)
+
+    # Extract images from result
+    if hasattr(result, "images"):
+        images = list(result.images)
+    else:
+        images = list(result[0])
+
+    if not all(isinstance(image, Image.Image) for image in images):
+        raise ValueError("Expected PIL Images from pipeline")
+
+    return images
+
+
+@dataclass(frozen=True)
+class InferenceTask:
+    """A blocking inference call, which worker processes run by name."""
+
+    run: Callable[..., Any]
+    # Registry key of the model the call needs, so it goes to a worker that has it loaded
+    affinity: Callable[[dict[str, Any]], str | None] = lambda kwargs: None
+    reports_progress: bool = True  # whether `run` takes a `progress` callback
+
+
+# Inference tasks by name; their arguments and results must be picklable
+INFERENCE_TASKS: dict[str, InferenceTask] = {
+    "text-to-image": InferenceTask(
+        generate_text_to_image_batch, lambda kwargs: f"pipeline:{kwargs['model_id']}"
+    ),
+    "controlnet/preprocess": InferenceTask(
+        controlnet_manager.preprocess,
+        lambda kwargs: f"preprocessor:{kwargs['control_type']}",
+        reports_progress=False,
+    ),
+    "controlnet/generate": InferenceTask(
+        controlnet_manager.generate, lambda kwargs: f"pipeline:{kwargs['base_model']}"
+    ),
+    "inpaint": InferenceTask(
+        inpaint_manager.inpaint, lambda kwargs: f"pipeline:{kwargs['model_id']}"
+    ),
+    "outpaint": InferenceTask(
+        inpaint_manager.outpaint, lambda kwargs: f"pipeline:{kwargs['model_id']}"
+    ),
+    "upscale": InferenceTask(
+        upscale_manager.upscale,
+        lambda kwargs: f"upscaler:{kwargs['model']}_{kwargs['factor']}x",
+    ),
+    "face-restore": InferenceTask(
+        upscale_manager.face_restore,
+        lambda kwargs: "face-restorer:gfpgan",
+        reports_progress=False,
+    ),
+    "upscale/img2img": InferenceTask(
+        img2img_upscaler.upscale, lambda kwargs: f"pipeline:{kwargs['model_id']}"
+    ),
+    "preload": InferenceTask(run_preload_step, reports_progress=False),
+}
+
+
+def run_task_locally(name: str, progress: ProgressCallback | None, kwargs: dict[str, Any]) -> Any:
+    """
+    Run an inference task on the calling thread.
+
+    Args:
+        name: Task name in `INFERENCE_TASKS`
+        progress: Callback receiving (0, 0) when the task starts and, for tasks that
+            report progress, (step, total) after each denoising step (optional)
+        kwargs: Task arguments
+
+    Returns:
+        The task's result
+    """
+    task = INFERENCE_TASKS[name]
+    if task.reports_progress:
+        kwargs = {**kwargs, "progress": progress}
+    return report_start(task.run, progress)(**kwargs)
@@ -4,46 +4,230 @@ Inpainting and outpainting manager for guided image regeneration.
 Provides inpainting for selective regeneration and outpainting for canvas extension.
 """
 
-from typing import Any, Literal
+from __future__ import annotations
 
+import math
+from typing import TYPE_CHECKING, Any, Literal
+
+import cv2
 import numpy as np
-import torch
-from diffusers import StableDiffusionInpaintPipeline
 from PIL import Image
 
+from costs import diffusion_cost, max_compute_cost
+from devices import inference_policy
+from pipelines import load_task_pipeline, native_resolution
+from progress import ProgressCallback, step_callback_kwargs
+from prompts import PromptEmbeddingCache
+from registry import ModelRegistry
+from tiling import tile_spans
+from timing import run_pipeline
+
+if TYPE_CHECKING:
+    from diffusers import DiffusionPipeline
+
 Direction = Literal["left", "right", "top", "bottom"]
+InpaintMode = Literal["full", "crop"]
+
+# (left, top, right, bottom) of a region, as used by PIL
+Box = tuple[int, int, int, int]
+
+
+def processing_size(width: int, height: int, native: int) -> tuple[int, int]:
+    """
+    Scale a region to the model's native pixel count, keeping its aspect ratio.
+
+    Args:
+        width: Region width
+        height: Region height
+        native: Native resolution of the model
+
+    Returns:
+        Width and height to run the pipeline at, multiples of 8 of at least 64
+    """
+    scale = native / math.sqrt(width * height)
+    return (
+        max(64, round(width * scale / 8) * 8),
+        max(64, round(height * scale / 8) * 8),
+    )
+
+
+def expand_box(box: Box, margin: int, size: tuple[int, int]) -> Box:
+    """
+    Grow a box by a margin, and its short side to at least half its long side.
+
+    Args:
+        box: Box to grow
+        margin: Pixels added on every side
+        size: Image size the box is clamped to
+
+    Returns:
+        Grown box, within the image
+    """
+    left, top, right, bottom = box
+    left, top = left - margin, top - margin
+    right, bottom = right + margin, bottom + margin
+
+    # Very thin regions give the model too little context
+    minimum = max(right - left, bottom - top) // 2
+    if right - left < minimum:
+        extra = minimum - (right - left)
+        left, right = left - extra // 2, right + extra - extra // 2
+    if bottom - top < minimum:
+        extra = minimum - (bottom - top)
+        top, bottom = top - extra // 2, bottom + extra - extra // 2
+
+    width, height = size
+    return (max(0, left), max(0, top), min(width, right), min(height, bottom))
+
+
+def feathered_alpha(mask: Image.Image, radius: int) -> Image.Image:
+    """
+    Build a compositing alpha that covers a mask and fades out around it.
+
+    Args:
+        mask: Binary mask (white = generated)
+        radius: Width of the fade in pixels
+
+    Returns:
+        Alpha mask, fully opaque wherever the mask is white
+    """
+    binary = (np.asarray(mask.convert("L")) > 127).astype(np.uint8) * 255
+    if radius <= 0:
+        return Image.fromarray(binary)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    grown = cv2.dilate(binary, kernel)
+    blurred = cv2.GaussianBlur(grown, (0, 0), sigmaX=radius / 2)
+    return Image.fromarray(np.maximum(blurred, binary))
+
+
+def outpaint_windows(
+    side: Direction,
+    pixels: int,
+    size: tuple[int, int],
+    context: int,
+    native: int,
+) -> list[Box]:
+    """
+    Plan the windows that fill one new outpainting strip.
+
+    Args:
+        side: Side being extended
+        pixels: Width of the new strip
+        size: Canvas size before extending
+        context: Pixels of existing image to include next to the new edge
+        native: Native resolution of the model
+
+    Returns:
+        Windows in the extended canvas's coordinates, in order along the edge
+    """
+    width, height = size
+    horizontal = side in ("left", "right")
+    existing = min(context, width if horizontal else height)
+    depth = pixels + existing
+
+    # Across the edge: the new strip plus the context next to it
+    if side == "left":
+        across = (0, depth)
+    elif side == "right":
+        across = (width - existing, width + pixels)
+    elif side == "top":
+        across = (0, depth)
+    else:
+        across = (height - existing, height + pixels)
+
+    # Along the edge: roughly square, overlapping windows of at least native size
+    length = height if horizontal else width
+    window = max(depth, native)
+    spans = tile_spans(length, window, window // 4)
+
+    if horizontal:
+        return [(across[0], start, across[1], end) for start, end in spans]
+    return [(start, across[0], end, across[1]) for start, end in spans]
+
+
+def plan_outpaint(
+    size: tuple[int, int], sides: dict[Direction, int], context: int, native: int
+) -> list[tuple[Direction, int, list[Box]]]:
+    """
+    Plan the windows of every side of an outpainting call, on the growing canvas.
+
+    Args:
+        size: Size of the image being extended
+        sides: Pixels to add per side, in order
+        context: Pixels of existing image to include next to each new edge
+        native: Native resolution of the model
+
+    Returns:
+        Each side with its pixels and its windows, in order
+    """
+    plan: list[tuple[Direction, int, list[Box]]] = []
+    for side, pixels in sides.items():
+        plan.append((side, pixels, outpaint_windows(side, pixels, size, context, native)))
+        if side in ("left", "right"):
+            size = (size[0] + pixels, size[1])
+        else:
+            size = (size[0], size[1] + pixels)
+    return plan
+
+
+def outpaint_cost(
+    plan: list[tuple[Direction, int, list[Box]]],
+    native: int,
+    steps: int,
+    model_id: str,
+    strength: float,
+) -> float:
+    """
+    Estimate the cost of an outpainting plan.
+
+    Args:
+        plan: Plan from `plan_outpaint`
+        native: Native resolution of the model
+        steps: Denoising steps per window
+        model_id: Model identifier
+        strength: Generation strength
+
+    Returns:
+        Cost in compute units
+    """
+    return sum(
+        diffusion_cost(
+            *processing_size(right - left, bottom - top, native), steps, model_id, strength
+        )
+        for _, _, windows in plan
+        for left, top, right, bottom in windows
+    )
 
 
 class InpaintManager:
     """Manages inpainting and outpainting pipelines."""
 
-    def __init__(self):
-        """Initialize the inpaint manager with empty cache."""
-        self.pipelines: dict[str, StableDiffusionInpaintPipeline] = {}
+    def __init__(
+        self, registry: ModelRegistry, prompt_embeddings: PromptEmbeddingCache | None = None
+    ):
+        """
+        Initialize the inpaint manager.
 
-    def _load_pipeline(self, model_id: str) -> StableDiffusionInpaintPipeline:
+        Args:
+            registry: Registry that holds loaded pipelines
+            prompt_embeddings: Cache of encoded prompts (optional)
+        """
+        self.registry = registry
+        self.prompt_embeddings = prompt_embeddings or PromptEmbeddingCache(max_bytes=0)
+
+    def _load_pipeline(self, model_id: str) -> DiffusionPipeline:
         """
         Load or retrieve cached inpainting pipeline.
 
+        The pipeline shares its weights with the model's other task pipelines.
+
         Args:
             model_id: Model identifier (e.g., runwayml/stable-diffusion-inpainting)
 
         Returns:
             Loaded pipeline instance
         """
-        if model_id in self.pipelines:
-            return self.pipelines[model_id]
-
-        print(f"Loading inpaint pipeline: {model_id}")
-        pipeline = StableDiffusionInpaintPipeline.from_pretrained(
-            model_id, torch_dtype=torch.float16
-        )
-
-        if torch.cuda.is_available():
-            pipeline = pipeline.to("cuda")
-
-        self.pipelines[model_id] = pipeline
-        return pipeline
+        return load_task_pipeline(self.registry, model_id, "inpaint")
 
     def inpaint(
         self,
@@ -61,10 +245,18 @@ class InpaintManager:
         negative_prompt_2: str | None = None,
         seed: int | None = None,
         max_compute: float | None = None,
+        mode: InpaintMode = "full",
+        context_margin: int = 64,
+        progress: ProgressCallback | None = None,
     ) -> Image.Image:
         """
         Inpaint masked region of an image.
 
+        In `full` mode the whole image is diffused at its (requested) size. In `crop`
+        mode only the mask's bounding box plus `context_margin` is diffused, at the
+        model's native resolution, and the result is blended back into the image with a
+        feathered mask, so pixels away from the mask are left untouched.
+
         Args:
             image: Input image to inpaint
             mask: Mask image (white = inpaint, black = keep)
@@ -79,7 +271,10 @@ class InpaintManager:
             prompt_2: Second prompt for SDXL (optional)
             negative_prompt_2: Second negative prompt for SDXL (optional)
             seed: Random seed (optional)
-            max_compute: Maximum compute budget (optional)
+            max_compute: Maximum output megapixels times steps (optional)
+            mode: "full" or "crop"
+            context_margin: Pixels of context around the mask in crop mode
+            progress: Callback receiving (step, total) after each denoising step (optional)
 
         Returns:
             Inpainted PIL Image
@@ -92,11 +287,9 @@ class InpaintManager:
 
         # Validate compute budget
         if max_compute is not None:
-            cost = (width * height * num_inference_steps) / 1_000_000
+            cost = max_compute_cost(width, height, num_inference_steps)
             if cost > max_compute:
-                raise ValueError(
-                    f"Compute cost {cost:.2f} exceeds limit {max_compute:.2f}"
-                )
+                raise ValueError(f"Compute cost {cost:.2f} exceeds limit {max_compute:.2f}")
 
         # Resize image and mask to match requested dimensions
         if image.width != width or image.height != height:
@@ -104,42 +297,131 @@ class InpaintManager:
         if mask.width != width or mask.height != height:
             mask = mask.resize((width, height), Image.LANCZOS)
 
+        generation: dict[str, Any] = {
+            "prompt": prompt,
+            "model_id": model_id,
+            "strength": strength,
+            "num_inference_steps": num_inference_steps,
+            "guidance_scale": guidance_scale,
+            "negative_prompt": negative_prompt,
+            "prompt_2": prompt_2,
+            "negative_prompt_2": negative_prompt_2,
+            "seed": seed,
+            "progress": progress,
+        }
+
+        if mode == "crop":
+            if context_margin < 0:
+                raise ValueError("Context margin must not be negative")
+            bbox = mask.convert("L").point(lambda value: 255 if value > 127 else 0).getbbox()
+            if bbox is None:
+                # Nothing to inpaint
+                return image.convert("RGB")
+            region = expand_box(bbox, context_margin, image.size)
+            return self._inpaint_region(image, mask, region, context_margin, **generation)
+        if mode != "full":
+            raise ValueError(f"Unknown inpaint mode: {mode}")
+
+        # Pipelines need sizes divisible by 8
+        output = self._generate(image, mask, width // 8 * 8, height // 8 * 8, **generation)
+        if output.size != (width, height):
+            output = output.resize((width, height), Image.LANCZOS)
+        return output
+
+    def _inpaint_region(
+        self,
+        image: Image.Image,
+        mask: Image.Image,
+        region: Box,
+        context_margin: int,
+        **generation: Any,
+    ) -> Image.Image:
+        """
+        Inpaint one region of an image at native resolution and blend it back in.
+
+        Args:
+            image: Full image
+            mask: Full mask (white = inpaint)
+            region: Region to diffuse, including context around the masked pixels
+            context_margin: Context around the mask, which bounds the feathering
+            generation: Generation arguments for `_generate`
+
+        Returns:
+            Copy of the image with the region inpainted
+        """
+        image = image.convert("RGB")
+        crop = image.crop(region)
+        crop_mask = mask.convert("L").crop(region)
+
+        # Step 1: Diffuse the region at the model's native pixel count
+        pipeline = self._load_pipeline(generation["model_id"])
+        size = processing_size(crop.width, crop.height, native_resolution(pipeline))
+        output = self._generate(
+            crop.resize(size, Image.LANCZOS),
+            crop_mask.resize(size, Image.LANCZOS),
+            size[0],
+            size[1],
+            **generation,
+        )
+        if output.size != crop.size:
+            output = output.resize(crop.size, Image.LANCZOS)
+
+        # Step 2: Blend the result in, fading out within the context margin
+        alpha = feathered_alpha(crop_mask, min(32, context_margin // 4))
+        result = image.copy()
+        result.paste(Image.composite(output.convert("RGB"), crop, alpha), region[:2])
+        return result
+
+    def _generate(
+        self,
+        image: Image.Image,
+        mask: Image.Image,
+        width: int,
+        height: int,
+        prompt: str,
+        model_id: str,
+        strength: float,
+        num_inference_steps: int,
+        guidance_scale: float,
+        negative_prompt: str | None,
+        prompt_2: str | None,
+        negative_prompt_2: str | None,
+        seed: int | None,
+        progress: ProgressCallback | None,
+    ) -> Image.Image:
+        """Run the inpainting pipeline on an image already at the working size."""
         # Load pipeline
         pipeline = self._load_pipeline(model_id)
 
         # Set random seed
-        generator = None
-        if seed is not None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            generator = torch.Generator(device=device)
-            generator.manual_seed(seed)
+        generator = inference_policy().generator(seed) if seed is not None else None
 
         # Detect if model is SDXL
         is_sdxl = "xl" in model_id.lower()
 
-        # Build generation kwargs
+        # Build generation kwargs; SDXL also takes prompts for its second text encoder
         kwargs: dict[str, Any] = {
-            "prompt": prompt,
+            **self.prompt_embeddings.pipeline_kwargs(
+                pipeline,
+                model_id,
+                prompt,
+                negative_prompt,
+                prompt_2=prompt_2 if is_sdxl else None,
+                negative_prompt_2=negative_prompt_2 if is_sdxl else None,
+            ),
             "image": image,
             "mask_image": mask,
+            "width": width,
+            "height": height,
             "num_inference_steps": num_inference_steps,
             "guidance_scale": guidance_scale,
             "strength": strength,
             "generator": generator,
+            **step_callback_kwargs(progress, num_inference_steps),
         }
 
-        if negative_prompt is not None:
-            kwargs["negative_prompt"] = negative_prompt
-
-        # Add SDXL-specific prompts
-        if is_sdxl:
-            if prompt_2 is not None:
-                kwargs["prompt_2"] = prompt_2
-            if negative_prompt_2 is not None:
-                kwargs["negative_prompt_2"] = negative_prompt_2
-
         # Generate
-        result = pipeline(**kwargs)
+        result = run_pipeline(pipeline, **kwargs)
 
         # Extract image
         if hasattr(result, "images"):
@@ -155,8 +437,7 @@ class InpaintManager:
     def outpaint(
         self,
         image: Image.Image,
-        direction: Direction,
-        pixels: int,
+        sides: dict[Direction, int],
         prompt: str,
         model_id: str = "runwayml/stable-diffusion-inpainting",
         strength: float = 0.8,
@@ -167,14 +448,21 @@ class InpaintManager:
         negative_prompt_2: str | None = None,
         seed: int | None = None,
         max_compute: float | None = None,
+        context: int = 256,
+        progress: ProgressCallback | None = None,
     ) -> Image.Image:
         """
-        Extend canvas in the specified direction with generated content.
+        Extend canvas on one or more sides with generated content.
+
+        Each new strip is generated in windows that hold the strip plus at most `context`
+        pixels of the existing image next to it, so cost grows with the size of the new
+        strip rather than the canvas. Long edges are covered by several overlapping
+        windows in turn, and sides are extended in order, so every window sees what was
+        generated before it (including corners).
 
         Args:
             image: Input image to extend
-            direction: Direction to extend (left, right, top, bottom)
-            pixels: Number of pixels to extend
+            sides: Pixels to add per side (left, right, top, bottom), in order
             prompt: Text prompt for generation
             model_id: Model to use for inpainting
             strength: Generation strength (0.0-1.0)
@@ -183,19 +471,95 @@ class InpaintManager:
             negative_prompt: Negative prompt (optional)
             prompt_2: Second prompt for SDXL (optional)
             negative_prompt_2: Second negative prompt for SDXL (optional)
-            seed: Random seed (optional)
-            max_compute: Maximum compute budget (optional)
+            seed: Random seed (optional; window N uses `seed + N`)
+            max_compute: Maximum extended canvas megapixels times steps (optional)
+            context: Pixels of existing image each window includes next to the new edge
+            progress: Callback receiving (step, total) after each denoising step (optional)
 
         Returns:
             Extended PIL Image
+
+        Raises:
+            ValueError: If the sides are invalid or the compute budget is exceeded
+        """
+        if not sides:
+            raise ValueError("Provide at least one side to extend")
+        for side, pixels in sides.items():
+            if side not in ("left", "right", "top", "bottom"):
+                raise ValueError(f"Unknown side '{side}'")
+            if pixels <= 0:
+                raise ValueError(f"Pixels to add on the {side} must be positive")
+        if context < 0:
+            raise ValueError("Context must not be negative")
+        if max_compute is not None:
+            width = image.width + sides.get("left", 0) + sides.get("right", 0)
+            height = image.height + sides.get("top", 0) + sides.get("bottom", 0)
+            cost = max_compute_cost(width, height, num_inference_steps)
+            if cost > max_compute:
+                raise ValueError(f"Compute cost {cost:.2f} exceeds limit {max_compute:.2f}")
+
+        # Step 1: Plan the windows of every side on the growing canvas
+        pipeline = self._load_pipeline(model_id)
+        native = native_resolution(pipeline)
+        plan = plan_outpaint(image.size, sides, context, native)
+        windows = [window for _, _, side_windows in plan for window in side_windows]
+
+        # Step 2: Extend the canvas one side at a time and fill its windows
+        def window_progress(number: int) -> ProgressCallback | None:
+            """Report a window's denoising steps as progress across all windows."""
+            if progress is None:
+                return None
+            report = progress
+            return lambda step, total: report(number * total + step, len(windows) * total)
+
+        canvas = image.convert("RGB")
+        number = 0
+        for side, pixels, side_windows in plan:
+            canvas, mask = self._extend_canvas(canvas, side, pixels)
+            for window in side_windows:
+                canvas = self._inpaint_region(
+                    canvas,
+                    mask,
+                    window,
+                    context,
+                    prompt=prompt,
+                    model_id=model_id,
+                    strength=strength,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    negative_prompt=negative_prompt,
+                    prompt_2=prompt_2,
+                    negative_prompt_2=negative_prompt_2,
+                    seed=seed + number if seed is not None else None,
+                    progress=window_progress(number),
+                )
+                # The window is filled now, so later windows keep it as context
+                mask.paste(0, window)
+                number += 1
+
+        return canvas
+
+    def _extend_canvas(
+        self, canvas: Image.Image, side: Direction, pixels: int
+    ) -> tuple[Image.Image, Image.Image]:
+        """
+        Add an empty strip to one side of a canvas.
+
+        Args:
+            canvas: Canvas to extend
+            side: Side to extend
+            pixels: Width of the new strip
+
+        Returns:
+            Extended canvas and its mask (white = new strip)
         """
         # Calculate new canvas dimensions
-        if direction in ("left", "right"):
-            new_width = image.width + pixels
-            new_height = image.height
+        if side in ("left", "right"):
+            new_width = canvas.width + pixels
+            new_height = canvas.height
         else:  # top or bottom
-            new_width = image.width
-            new_height = image.height + pixels
+            new_width = canvas.width
+            new_height = canvas.height + pixels
 
         # Create extended canvas
         extended = Image.new("RGB", (new_width, new_height), (128, 128, 128))
@@ -204,33 +568,7 @@ class InpaintManager:
         mask = Image.new("L", (new_width, new_height), 255)  # Start with all white
 
         # Paste original image and update mask
-        if direction == "right":
-            extended.paste(image, (0, 0))
-            mask.paste(0, (0, 0, image.width, image.height))  # Black where image exists
-        elif direction == "left":
-            extended.paste(image, (pixels, 0))
-            mask.paste(0, (pixels, 0, new_width, new_height))
-        elif direction == "bottom":
-            extended.paste(image, (0, 0))
-            mask.paste(0, (0, 0, image.width, image.height))
-        else:  # top
-            extended.paste(image, (0, pixels))
-            mask.paste(0, (0, pixels, new_width, new_height))
-
-        # Use inpaint to generate the extended region
-        return self.inpaint(
-            image=extended,
-            mask=mask,
-            prompt=prompt,
-            model_id=model_id,
-            strength=strength,
-            width=new_width,
-            height=new_height,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            negative_prompt=negative_prompt,
-            prompt_2=prompt_2,
-            negative_prompt_2=negative_prompt_2,
-            seed=seed,
-            max_compute=max_compute,
-        )
+        offset = (pixels, 0) if side == "left" else (0, pixels) if side == "top" else (0, 0)
+        extended.paste(canvas, offset)
+        mask.paste(0, (*offset, offset[0] + canvas.width, offset[1] + canvas.height))
+        return extended, mask
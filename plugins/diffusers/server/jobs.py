@@ -0,0 +1,277 @@
+"""
+Asynchronous job tracking for long-running operations.
+
+Jobs run an operation in the background and record its status, per-step progress, and
+result. Clients poll a job or subscribe to its event stream instead of holding a request
+open for the whole run.
+"""
+
+import asyncio
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, Literal
+
+from PIL import Image
+
+from previews import LatentPreviewer, preview_to_base64
+from progress import ProgressCallback
+
+JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+TERMINAL_STATUSES: frozenset[JobStatus] = frozenset({"succeeded", "failed", "cancelled"})
+
+
+class JobCancelledError(Exception):
+    """Raised from a job's progress callback to abort a cancelled job."""
+
+
+@dataclass
+class Job:
+    """A background operation and its progress."""
+
+    id: str
+    operation: str
+    status: JobStatus = "queued"
+    step: int = 0
+    total: int = 0
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    cancel_requested: bool = False
+    preview_every: int | None = None
+    preview: dict[str, Any] | None = None
+    subscribers: list["asyncio.Queue[dict[str, Any]]"] = field(default_factory=list)
+    task: "asyncio.Task[None] | None" = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the job has finished, successfully or not."""
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self, include_result: bool = True) -> dict[str, Any]:
+        """
+        Get a JSON-serializable view of the job.
+
+        Args:
+            include_result: Whether to include the (potentially large) result
+
+        Returns:
+            Dictionary with id, operation, status, progress, and result or error
+        """
+        data: dict[str, Any] = {
+            "id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "step": self.step,
+            "total": self.total,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+JobRunner = Callable[[ProgressCallback], Awaitable[dict[str, Any]]]
+
+
+class JobManager:
+    """Runs operations as background jobs and streams their progress."""
+
+    def __init__(self, ttl: float = 600.0, max_jobs: int = 1024):
+        """
+        Initialize the job manager.
+
+        Args:
+            ttl: Seconds a finished job is kept before it is discarded
+            max_jobs: Maximum number of jobs kept (oldest finished jobs are discarded first)
+        """
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: dict[str, Job] = {}
+
+    def submit(self, operation: str, run: JobRunner, preview_every: int | None = None) -> Job:
+        """
+        Start an operation as a background job.
+
+        Args:
+            operation: Operation name, for reporting
+            run: Coroutine function running the operation; it receives a progress callback
+                and returns the job result
+            preview_every: Publish a latent preview every this many denoising steps
+                (None = no previews)
+
+        Returns:
+            The new job
+        """
+        self.prune()
+
+        job = Job(id=uuid.uuid4().hex, operation=operation, preview_every=preview_every)
+        self._jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, run))
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Look up a job.
+
+        Args:
+            job_id: Job ID
+
+        Returns:
+            The job, or None if it does not exist or has expired
+        """
+        self.prune()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        """
+        Cancel a job.
+
+        Queued jobs are dropped immediately; running jobs stop at their next step.
+
+        Args:
+            job_id: Job ID
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.done:
+            return job
+
+        job.cancel_requested = True
+        if job.status == "queued" and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def events(self, job_id: str) -> AsyncIterator[dict[str, Any]]:
+        """
+        Stream events for a job until it finishes.
+
+        The first event is the job's current state, followed by the latest preview if
+        there is one. Results are not included in events; fetch the job once it has
+        finished.
+
+        Args:
+            job_id: Job ID
+
+        Yields:
+            Events with `event` (status, progress, or preview) and `data` keys
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+
+        queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        job.subscribers.append(queue)
+        try:
+            yield {"event": "status", "data": job.snapshot(include_result=False)}
+            if job.preview is not None and not job.done:
+                yield {"event": "preview", "data": job.preview}
+            while not job.done:
+                event = await queue.get()
+                yield event
+        finally:
+            job.subscribers.remove(queue)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get job statistics.
+
+        Returns:
+            Dictionary with the number of jobs in each status
+        """
+        counts: dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"jobs": len(self._jobs), "by_status": counts}
+
+    def prune(self) -> None:
+        """Discard expired finished jobs and enforce the job limit."""
+        cutoff = time.time() - self.ttl
+        finished = sorted(
+            (job for job in self._jobs.values() if job.done), key=lambda job: job.updated_at
+        )
+        excess = len(self._jobs) - self.max_jobs
+        for job in finished:
+            if job.updated_at < cutoff or excess > 0:
+                del self._jobs[job.id]
+                excess -= 1
+
+    async def _run(self, job: Job, run: JobRunner) -> None:
+        """Run a job and record its outcome."""
+        loop = asyncio.get_running_loop()
+
+        def progress(step: int, total: int) -> None:
+            # Runs on the inference thread
+            if job.cancel_requested:
+                raise JobCancelledError(f"Job {job.id} was cancelled")
+            loop.call_soon_threadsafe(self._update, job, step, total)
+
+        def on_preview(step: int, total: int, image: Image.Image) -> None:
+            # Runs on the inference thread, so encode here rather than on the event loop
+            preview = {
+                "step": step,
+                "total": total,
+                "width": image.width,
+                "height": image.height,
+                "image": preview_to_base64(image),
+            }
+            loop.call_soon_threadsafe(self._preview, job, preview)
+
+        callback: ProgressCallback = progress
+        if job.preview_every:
+            callback = LatentPreviewer(progress, on_preview, every=job.preview_every)
+
+        try:
+            result = await run(callback)
+        except (JobCancelledError, asyncio.CancelledError):
+            self._finish(job, "cancelled", error="Job was cancelled")
+        except Exception as error:
+            self._finish(job, "failed", error=str(error))
+        else:
+            self._finish(job, "succeeded", result=result)
+
+    def _update(self, job: Job, step: int, total: int) -> None:
+        """Record progress and notify subscribers."""
+        if job.done:
+            return
+        job.status = "running"
+        job.step = step
+        job.total = total
+        job.updated_at = time.time()
+        self._publish(job, {"event": "progress", "data": {"step": step, "total": total}})
+
+    def _preview(self, job: Job, preview: dict[str, Any]) -> None:
+        """Record the latest preview and notify subscribers."""
+        if job.done:
+            return
+        job.preview = preview
+        self._publish(job, {"event": "preview", "data": preview})
+
+    def _finish(
+        self,
+        job: Job,
+        status: JobStatus,
+        result: dict[str, Any] | None = None,
+        error: str | None = None,
+    ) -> None:
+        """Record a job's final state and notify subscribers."""
+        job.status = status
+        job.preview = None
+        job.result = result
+        job.error = error
+        if status == "succeeded":
+            job.step = job.total = max(job.total, 1)
+        job.updated_at = time.time()
+        self._publish(job, {"event": "status", "data": job.snapshot(include_result=False)})
+
+    def _publish(self, job: Job, event: dict[str, Any]) -> None:
+        """Send an event to every subscriber of a job."""
+        for queue in job.subscribers:
+            queue.put_nowait(event)
@@ -0,0 +1,62 @@
+"""
+Structured logging for the diffusers server.
+
+Every log line is a single JSON object with a timestamp, level, event name, and the
+event's fields, so logs can be filtered and aggregated without parsing free text.
+"""
+
+import json
+import logging
+import sys
+import time
+from typing import Any
+
+logger = logging.getLogger("viwo.diffusers")
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Render a record with its structured fields."""
+        entry: dict[str, Any] = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO") -> None:
+    """
+    Send the server's logs to stderr as JSON lines.
+
+    Args:
+        level: Minimum level to log (e.g. "DEBUG", "INFO", "WARNING")
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level.upper())
+
+
+def log_event(
+    event: str, level: int = logging.INFO, exc_info: BaseException | None = None, **fields: Any
+) -> None:
+    """
+    Log an event with structured fields.
+
+    Args:
+        event: Event name, e.g. "model_loaded"
+        level: Logging level
+        exc_info: Exception whose traceback to include (optional)
+        **fields: Fields of the event
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
@@ -4,47 +4,181 @@ Stable Diffusion image generation server for viwo.
 FastAPI server that provides text-to-image generation endpoints using Huggingface Diffusers.
 """
 
+import asyncio
+import functools
+import json
+import logging
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
 from contextlib import asynccontextmanager
-from typing import Any
-
-import torch
-from diffusers import (
-    DiffusionPipeline,
-    FluxPipeline,
-    StableDiffusion3Pipeline,
-    StableDiffusionPipeline,
-    StableDiffusionXLPipeline,
-)
-from fastapi import FastAPI, HTTPException
-from PIL import Image
-from pydantic import BaseModel
-import base64
+from dataclasses import dataclass
 from io import BytesIO
+from typing import Any, ClassVar, Literal
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from PIL import Image
+from pydantic import BaseModel, ValidationError
+
+import config
+from batching import BatchScheduler
+from cache import HandleNotFoundError, LRUCache, ResultCache, content_key
+from costs import (
+    CONTROLNET_WEIGHT,
+    ComputeLimitError,
+    ComputeQuotas,
+    QuotaExceededError,
+    diffusion_cost,
+    face_restore_cost,
+    family_resolution,
+    preprocess_cost,
+    upscale_cost,
+)
+from encoding import MEDIA_TYPES, EncodedImage, ImageFormat, encode_image, negotiate_format
+from executor import InferenceExecutor, QueueFullError
+from images import ImageStore, is_image_handle
+from inference import (
+    INFERENCE_TASKS,
+    controlnet_manager,
+    device,
+    device_policy,
+    model_registry,
+    preload_steps,
+    prompt_embeddings,
+    run_task_locally,
+)
+from inpaint import InpaintMode, outpaint_cost, plan_outpaint
+from jobs import JobCancelledError, JobManager
+from logs import configure_logging, log_event
+from metrics import (
+    CONTENT_TYPE,
+    RequestMetrics,
+    RequestMetricsMiddleware,
+    accelerator_metrics,
+    process_metrics,
+    stats_metrics,
+)
+from preload import Preloader, PreloadStep
+from previews import LatentPreviewer
+from progress import FanOut, ProgressCallback, fan_out, report_start
+from timing import RequestTiming, TimingMiddleware, annotate, recording, stage
+from uploads import (
+    ImageInput,
+    InputTooLargeError,
+    decode_image,
+    image_digest,
+    image_request,
+    image_request_body,
+    image_size,
+)
+from upscale import UpscalePrecisionSetting
+from upscale_traditional import traditional_upscale
+from workers import WorkerPool, plan_workers
+
+configure_logging(config.LOG_LEVEL)
+
+# Worker processes that run inference instead of this process; started by the lifespan.
+# Restarted workers run every preload step again before they take requests.
+worker_pool = (
+    WorkerPool(
+        plan_workers(config.WORKERS),
+        max_pending=config.WORKER_MAX_PENDING,
+        warmup=[("preload", {"step": step.name}) for step in preload_steps()],
+    )
+    if config.WORKERS > 0
+    else None
+)
+
+# Bounded executor that keeps blocking inference off the event loop; with worker processes,
+# each running job waits for its task on a worker
+inference_executor = InferenceExecutor(
+    device,
+    max_concurrency=(
+        worker_pool.size * worker_pool.max_pending
+        if worker_pool is not None
+        else config.max_concurrency_for(device_policy.device_type)
+    ),
+    max_queue=config.MAX_QUEUE,
+    min_retry_after=config.MIN_RETRY_AFTER,
+)
+
+# Preprocessed ControlNet control images, keyed by handle
+control_maps: LRUCache[str, Image.Image] = LRUCache(
+    max_bytes=int(config.CONTROL_MAP_CACHE_MB * 1024**2),
+    size_of=lambda image: image.width * image.height * len(image.getbands()),
+)
+
+# Encoded results of deterministic requests, keyed by a hash of the request
+result_cache = ResultCache(
+    memory_bytes=int(config.RESULT_CACHE_MEMORY_MB * 1024**2),
+    disk_dir=config.RESULT_CACHE_DIR,
+    disk_bytes=int(config.RESULT_CACHE_DISK_MB * 1024**2),
+)
+
+# Images referenced by handle across requests
+image_store = ImageStore(
+    memory_bytes=int(config.IMAGE_STORE_MEMORY_MB * 1024**2),
+    disk_dir=config.IMAGE_STORE_DIR,
+    disk_bytes=int(config.IMAGE_STORE_DISK_MB * 1024**2),
+    ttl=config.IMAGE_STORE_TTL_S,
+)
+
+# Per-request compute limit and per-caller token buckets
+compute_quotas = ComputeQuotas(
+    max_request=config.MAX_REQUEST_COMPUTE or None,
+    rate=config.CALLER_COMPUTE_RATE,
+    burst=config.CALLER_COMPUTE_BURST,
+)
+
+# Header carrying the ID that a request's compute cost is charged to
+CALLER_HEADER = "X-Caller-Id"
+
+# Background jobs started through /jobs
+job_manager = JobManager(ttl=config.JOB_TTL_S, max_jobs=config.MAX_JOBS)
 
-from controlnet import ControlNetManager
-from inpaint import InpaintManager
-from upscale import UpscaleManager
-from upscale_traditional import Img2ImgUpscaler, traditional_upscale
 
+def preload_broadcast_steps() -> list[PreloadStep]:
+    """Build preload steps that each run one of the inference preload steps on every worker."""
+    assert worker_pool is not None
+    broadcast = worker_pool.broadcast
+    return [
+        PreloadStep(step.name, functools.partial(broadcast, "preload", {"step": step.name}))
+        for step in preload_steps()
+    ]
 
-# Pipeline cache to avoid reloading models
-pipeline_cache: dict[str, DiffusionPipeline] = {}
 
-# Feature managers
-controlnet_manager = ControlNetManager()
-inpaint_manager = InpaintManager()
-upscale_manager = UpscaleManager()
-img2img_upscaler = Img2ImgUpscaler()
+# Loads and warms up the configured models at startup (on every worker, with workers); gates /ready
+preloader = Preloader(preload_broadcast_steps() if worker_pool is not None else preload_steps())
+
+
+async def evict_idle_models() -> None:
+    """Periodically unload models that exceeded the idle TTL."""
+    if model_registry.idle_ttl is None:
+        return
+    interval = min(60.0, max(1.0, model_registry.idle_ttl / 4))
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(model_registry.evict_idle)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Manage pipeline cache lifecycle."""
+    """Manage model registry lifecycle."""
+    if worker_pool is not None:
+        await asyncio.to_thread(worker_pool.start)
+    eviction_task = asyncio.create_task(evict_idle_models())
+    # Preload in the background so /health answers while models load
+    preload_task = asyncio.create_task(preloader.run(inference_executor))
     yield
-    # Clean up pipelines on shutdown
-    pipeline_cache.clear()
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
+    # Clean up models on shutdown
+    preload_task.cancel()
+    eviction_task.cancel()
+    inference_executor.shutdown()
+    if worker_pool is not None:
+        await asyncio.to_thread(worker_pool.shutdown)
+    prompt_embeddings.clear()
+    control_maps.clear()
+    image_store.clear()
+    model_registry.clear()
 
 
 app = FastAPI(
@@ -54,8 +188,47 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# HTTP request counts and latencies, exported by /metrics
+request_metrics = RequestMetrics()
+app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
+# Stage timings in `Server-Timing` headers and one structured log line per request
+app.add_middleware(TimingMiddleware)
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, error: QueueFullError) -> JSONResponse:
+    """Reject requests with 503 and a `Retry-After` hint when the queue is full."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+@app.exception_handler(QuotaExceededError)
+async def quota_exceeded_handler(request: Request, error: QuotaExceededError) -> JSONResponse:
+    """Reject requests with 429 and a `Retry-After` hint when the caller's quota is spent."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+# Whether a result is returned, kept in the image store, or both
+OutputMode = Literal["image", "handle", "both"]
+
+
+class OutputOptions(BaseModel):
+    """Output options shared by every image request."""
 
-class TextToImageRequest(BaseModel):
+    output_format: ImageFormat | None = None  # png (default), webp, or jpeg
+    quality: int | None = None  # webp/jpeg quality, 1-100
+    compress_level: int | None = None  # png compression level, 0-9
+    output: OutputMode = "image"  # "handle"/"both" keep the result in the image store
+
+
+class TextToImageRequest(OutputOptions):
     """Request model for text-to-image generation."""
 
     model_id: str
@@ -71,71 +244,129 @@ class TextToImageRequest(BaseModel):
 class ImageResponse(BaseModel):
     """Response model containing generated image."""
 
-    image: str  # base64 encoded
+    image: str | None = None  # base64 encoded; omitted when only a handle was requested
     width: int
     height: int
-    format: str = "png"
+    format: ImageFormat | None = None
+    handle: str | None = None  # handle to reference the image in later requests
 
 
-def load_pipeline(model_id: str) -> DiffusionPipeline:
-    """Load or retrieve cached pipeline for the given model."""
-    if model_id in pipeline_cache:
-        return pipeline_cache[model_id]
+TextToImageItem = tuple[TextToImageRequest, ProgressCallback | None]
 
-    print(f"Loading model: {model_id}")
 
-    # Auto-detect pipeline type from model_id
-    # This is a simplified approach - proper detection would check model config
-    if "flux" in model_id.lower():
-        pipeline = FluxPipeline.from_pretrained(
-            model_id, torch_dtype=torch.float16
-        )
-    elif "sd3" in model_id.lower() or "stable-diffusion-3" in model_id.lower():
-        pipeline = StableDiffusion3Pipeline.from_pretrained(
-            model_id, torch_dtype=torch.float16
-        )
-    elif "xl" in model_id.lower():
-        pipeline = StableDiffusionXLPipeline.from_pretrained(
-            model_id, torch_dtype=torch.float16
-        )
-    else:
-        # Default to SD 1.5 pipeline
-        pipeline = StableDiffusionPipeline.from_pretrained(
-            model_id, torch_dtype=torch.float16
-        )
+def text_to_image_batch_key(item: TextToImageItem) -> Hashable:
+    """Get the key under which text-to-image requests can share a pipeline call."""
+    req, progress = item
+    # Previews render one request's latents, so a previewed request always runs alone
+    previewer = id(progress) if isinstance(progress, LatentPreviewer) else None
+    return (
+        previewer,
+        req.model_id,
+        req.width,
+        req.height,
+        req.num_inference_steps,
+        req.guidance_scale,
+        req.negative_prompt is None,
+    )
 
-    if torch.cuda.is_available():
-        pipeline = pipeline.to("cuda")
 
-    pipeline_cache[model_id] = pipeline
-    return pipeline
+def run_task(name: str, progress: ProgressCallback | None, /, **kwargs: Any) -> Any:
+    """
+    Run an inference task on a worker process, or on the calling thread without workers.
 
+    Blocks; called on the inference executor.
 
-def image_to_base64(img: Image.Image) -> str:
-    """Convert PIL Image to base64 string."""
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    Args:
+        name: Task name in `INFERENCE_TASKS`
+        progress: Callback receiving the task's progress (optional)
+        **kwargs: Task arguments
 
+    Returns:
+        The task's result
+    """
+    if worker_pool is None:
+        return run_task_locally(name, progress, kwargs)
+    affinity = INFERENCE_TASKS[name].affinity(kwargs)
+    return worker_pool.call(name, kwargs, progress, affinity)
+
+
+async def run_inference(name: str, progress: ProgressCallback | None, /, **kwargs: Any) -> Any:
+    """Run an inference task on the inference executor (see `run_task`)."""
+    return await inference_executor.run(run_task, name, progress, **kwargs)
+
+
+def text_to_image_kwargs(items: list[TextToImageItem]) -> dict[str, Any]:
+    """Get the arguments of the text-to-image task for a batch of compatible requests."""
+    first = items[0][0]
+    return {
+        "model_id": first.model_id,
+        "prompts": [req.prompt for req, _ in items],
+        "negative_prompts": [req.negative_prompt for req, _ in items],
+        "seeds": [req.seed for req, _ in items],
+        "width": first.width,
+        "height": first.height,
+        "num_inference_steps": first.num_inference_steps,
+        "guidance_scale": first.guidance_scale,
+    }
 
-def base64_to_image(b64: str) -> Image.Image:
-    """Convert base64 string to PIL Image."""
-    image_bytes = base64.b64decode(b64)
-    return Image.open(BytesIO(image_bytes))
+
+def run_text_to_image_batch(items: list[TextToImageItem]) -> list[Image.Image | Exception]:
+    """
+    Run a batch of text-to-image requests, reporting progress to each request.
+
+    Requests whose progress callback raised (e.g. cancelled jobs) get its error instead of
+    an image. When all of them raised, the call is aborted and the requests without a
+    callback are run again on their own.
+    """
+    callbacks = [callback for _, callback in items]
+    progress = fan_out(callbacks)
+    try:
+        images = run_task("text-to-image", progress, **text_to_image_kwargs(items))
+    except Exception:
+        if not isinstance(progress, FanOut) or not progress.stopped or None not in callbacks:
+            raise
+        plain_items = [item for item in items if item[1] is None]
+        plain = iter(run_task("text-to-image", None, **text_to_image_kwargs(plain_items)))
+        images = [next(plain) if callback is None else None for callback in callbacks]
+    if isinstance(progress, FanOut):
+        return progress.results(images)
+    return images
+
+
+# Groups compatible text-to-image requests into batched pipeline calls
+text_to_image_batcher: BatchScheduler[TextToImageItem, Image.Image] = BatchScheduler(
+    run_text_to_image_batch,
+    text_to_image_batch_key,
+    inference_executor,
+    max_batch_size=config.BATCH_MAX_SIZE,
+    max_wait=config.BATCH_MAX_WAIT_MS / 1000,
+)
 
 
-class ControlNetPreprocessRequest(BaseModel):
+class ControlNetPreprocessRequest(OutputOptions):
     """Request model for ControlNet preprocessing."""
 
-    image: str  # base64 encoded
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
     type: str  # control type (canny, depth, etc.)
 
 
-class ControlNetGenerateRequest(BaseModel):
-    """Request model for ControlNet generation."""
+class ControlNetGenerateRequest(OutputOptions):
+    """
+    Request model for ControlNet generation.
+
+    The control image is given as exactly one of `control_image` (an already preprocessed
+    control image), `control_handle` (returned by /controlnet/preprocess), or `image` (a
+    source image, preprocessed server-side for `type`).
+    """
+
+    image_fields: ClassVar[tuple[str, ...]] = ("control_image", "image")
 
     prompt: str
-    control_image: str  # base64 encoded
+    control_image: ImageInput | None = None  # base64 encoded, or an uploaded file
+    control_handle: str | None = None  # handle from /controlnet/preprocess
+    image: ImageInput | None = None  # source image to preprocess, base64 or uploaded
     type: str  # control type
     model_id: str = "runwayml/stable-diffusion-v1-5"
     strength: float = 1.0
@@ -153,11 +384,13 @@ class ControlTypesResponse(BaseModel):
     types: list[dict[str, str]]
 
 
-class InpaintRequest(BaseModel):
+class InpaintRequest(OutputOptions):
     """Request model for inpainting."""
 
-    image: str  # base64 encoded
-    mask: str  # base64 encoded, white = inpaint
+    image_fields: ClassVar[tuple[str, ...]] = ("image", "mask")
+
+    image: ImageInput  # base64 encoded, or an uploaded file
+    mask: ImageInput  # base64 encoded, or an uploaded file; white = inpaint
     prompt: str
     model_id: str = "runwayml/stable-diffusion-inpainting"
     strength: float = 0.8
@@ -170,14 +403,19 @@ class InpaintRequest(BaseModel):
     negative_prompt_2: str | None = None  # SDXL
     seed: int | None = None
     max_compute: float | None = None
+    mode: InpaintMode = "full"  # "crop" diffuses only the mask's surroundings
+    context_margin: int = 64  # pixels of context around the mask in crop mode
 
 
-class OutpaintRequest(BaseModel):
+class OutpaintRequest(OutputOptions):
     """Request model for outpainting."""
 
-    image: str  # base64 encoded
-    direction: str  # "left", "right", "top", or "bottom"
-    pixels: int
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
+    direction: str | None = None  # "left", "right", "top", or "bottom"
+    pixels: int | None = None
+    sides: dict[str, int] | None = None  # pixels per side, instead of direction/pixels
     prompt: str
     model_id: str = "runwayml/stable-diffusion-inpainting"
     strength: float = 0.8
@@ -188,20 +426,25 @@ class OutpaintRequest(BaseModel):
     negative_prompt_2: str | None = None  # SDXL
     seed: int | None = None
     max_compute: float | None = None
+    context: int = 256  # pixels of existing image generated alongside each new strip
 
 
-class TraditionalUpscaleRequest(BaseModel):
+class TraditionalUpscaleRequest(OutputOptions):
     """Request model for traditional upscaling."""
 
-    image: str  # base64 encoded
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
     method: str = "lanczos"  # nearest, bilinear, bicubic, lanczos, area
     factor: int = 2  # 2 or 4
 
 
-class Img2ImgUpscaleRequest(BaseModel):
+class Img2ImgUpscaleRequest(OutputOptions):
     """Request model for hybrid img2img upscaling."""
 
-    image: str  # base64 encoded
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
     prompt: str
     model_id: str = "runwayml/stable-diffusion-v1-5"
     factor: int = 2
@@ -211,27 +454,824 @@ class Img2ImgUpscaleRequest(BaseModel):
     guidance_scale: float = 7.5
     negative_prompt: str | None = None
     seed: int | None = None
+    tile_size: int | None = None  # refinement tile size; None = native when larger, 0 = off
+    tile_batch_size: int = 4  # tiles refined per pipeline call
 
 
-class UpscaleRequest(BaseModel):
+class UpscaleRequest(OutputOptions):
     """Request model for upscaling."""
 
-    image: str  # base64 encoded
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
     model: str = "realesrgan"  # "esrgan" or "realesrgan"
     factor: int = 2  # 2 or 4
+    tile: int | None = None  # tile size in input pixels; None picks one, 0 disables tiling
+    precision: UpscalePrecisionSetting | None = None  # fp32, fp16 (CUDA), bf16, or auto
 
 
-class FaceRestoreRequest(BaseModel):
+class FaceRestoreRequest(OutputOptions):
     """Request model for face restoration."""
 
-    image: str  # base64 encoded
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
     strength: float = 1.0
 
 
+class ImageUploadRequest(BaseModel):
+    """Request model for storing an image."""
+
+    image_fields: ClassVar[tuple[str, ...]] = ("image",)
+
+    image: ImageInput  # base64 encoded, or an uploaded file
+
+
+class StoredImageResponse(BaseModel):
+    """Response model describing a stored image."""
+
+    handle: str
+    width: int
+    height: int
+    expires_in: float  # seconds until the image expires unless it is used
+
+
+class JobRequest(BaseModel):
+    """Request model for starting a background job."""
+
+    operation: str  # name of an operation, e.g. "text-to-image" or "inpaint"
+    params: dict[str, Any]  # request body for that operation
+    preview_every: int | None = None  # stream a latent preview every N denoising steps
+
+
+class JobResponse(BaseModel):
+    """Response model describing a background job."""
+
+    id: str
+    operation: str
+    status: str  # queued, running, succeeded, failed, or cancelled
+    step: int
+    total: int
+    error: str | None = None
+    result: ImageResponse | None = None
+    created_at: float
+    updated_at: float
+
+
+def target_size(width: int | None, height: int | None) -> tuple[int, int] | None:
+    """Get the size an input image is resized to, if the request fixes one."""
+    if width is None or height is None:
+        return None
+    return (width, height)
+
+
+async def load_image(data: ImageInput, size: tuple[int, int] | None = None) -> Image.Image:
+    """
+    Get an input image from the image store or by decoding it.
+
+    Args:
+        data: Image handle, base64 string, or raw encoded bytes
+        size: Size the image will be resized to, if any (see `decode_image`)
+
+    Returns:
+        PIL Image
+
+    Raises:
+        HandleNotFoundError: If the handle does not exist or has expired
+    """
+    with stage("decode"):
+        if is_image_handle(data):
+            assert isinstance(data, str)
+            return await asyncio.to_thread(image_store.get, data)
+        return await asyncio.to_thread(decode_image, data, size)
+
+
+async def run_text_to_image(
+    req: TextToImageRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Generate an image from a text prompt, batching with compatible requests."""
+    if isinstance(progress, LatentPreviewer) and req.width and req.height:
+        progress.size = (req.width, req.height)
+    return await text_to_image_batcher.submit((req, progress))
+
+
+def control_map_handle(image: ImageInput, control_type: str) -> str:
+    """Get the handle of the control image preprocessed from a source image."""
+    return "ctl_" + content_key(image_digest(image), control_type)[:32]
+
+
+async def preprocess_control_image(
+    image: ImageInput, control_type: str, progress: ProgressCallback | None = None
+) -> tuple[Image.Image, str]:
+    """
+    Preprocess a source image into a control image, reusing cached results.
+
+    Args:
+        image: Source image, base64 encoded or raw bytes
+        control_type: Control type
+        progress: Callback receiving (step, total) progress (optional)
+
+    Returns:
+        Control image and its handle
+    """
+    handle = await asyncio.to_thread(control_map_handle, image, control_type)
+    control_image = control_maps.get(handle)
+    if control_image is None:
+        input_image = await load_image(image)
+        control_image = await run_inference(
+            "controlnet/preprocess", progress, image=input_image, control_type=control_type
+        )
+        control_maps.put(handle, control_image)
+    return control_image, handle
+
+
+async def run_controlnet_preprocess(
+    req: ControlNetPreprocessRequest, progress: ProgressCallback | None = None
+) -> tuple[Image.Image, str]:
+    """Preprocess an image into a ControlNet control image, returning it with its handle."""
+    return await preprocess_control_image(req.image, req.type, progress)
+
+
+async def resolve_control_image(
+    req: ControlNetGenerateRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Get the control image of a generation request from whichever input it was given."""
+    given = [
+        name
+        for name in ("control_image", "control_handle", "image")
+        if getattr(req, name) is not None
+    ]
+    if len(given) != 1:
+        raise ValueError("Provide exactly one of control_image, control_handle, or image")
+
+    if req.control_handle is not None:
+        control_image = control_maps.get(req.control_handle)
+        if control_image is None:
+            raise HandleNotFoundError(
+                f"Control handle '{req.control_handle}' not found or expired; "
+                "preprocess the image again or send it as `image`"
+            )
+        return control_image
+    if req.image is not None:
+        control_image, _ = await preprocess_control_image(req.image, req.type, progress)
+        return control_image
+    assert req.control_image is not None
+    return await load_image(req.control_image, target_size(req.width, req.height))
+
+
+async def run_controlnet_generate(
+    req: ControlNetGenerateRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Generate an image with ControlNet guidance."""
+    control_image = await resolve_control_image(req, progress)
+    return await run_inference(
+        "controlnet/generate",
+        progress,
+        prompt=req.prompt,
+        control_image=control_image,
+        control_type=req.type,
+        base_model=req.model_id,
+        strength=req.strength,
+        width=req.width,
+        height=req.height,
+        num_inference_steps=req.num_inference_steps,
+        guidance_scale=req.guidance_scale,
+        negative_prompt=req.negative_prompt,
+        seed=req.seed,
+    )
+
+
+async def run_inpaint(req: InpaintRequest, progress: ProgressCallback | None = None) -> Image.Image:
+    """Inpaint the masked region of an image."""
+    size = target_size(req.width, req.height)
+    image = await load_image(req.image, size)
+    mask = await load_image(req.mask, size)
+    return await run_inference(
+        "inpaint",
+        progress,
+        image=image,
+        mask=mask,
+        prompt=req.prompt,
+        model_id=req.model_id,
+        strength=req.strength,
+        width=req.width,
+        height=req.height,
+        num_inference_steps=req.num_inference_steps,
+        guidance_scale=req.guidance_scale,
+        negative_prompt=req.negative_prompt,
+        prompt_2=req.prompt_2,
+        negative_prompt_2=req.negative_prompt_2,
+        seed=req.seed,
+        max_compute=req.max_compute,
+        mode=req.mode,
+        context_margin=req.context_margin,
+    )
+
+
+def outpaint_sides(req: OutpaintRequest) -> dict[str, int]:
+    """Get the pixels to add per side from whichever form an outpainting request used."""
+    if req.sides is not None:
+        if req.direction is not None or req.pixels is not None:
+            raise ValueError("Provide either sides or direction and pixels, not both")
+        sides = req.sides
+    else:
+        if req.direction is None or req.pixels is None:
+            raise ValueError("Provide direction and pixels, or sides")
+        sides = {req.direction: req.pixels}
+    valid_directions = {"left", "right", "top", "bottom"}
+    if not sides.keys() <= valid_directions:
+        raise ValueError(f"Direction must be one of {valid_directions}")
+    return sides
+
+
+async def run_outpaint(
+    req: OutpaintRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Extend an image's canvas with generated content on one or more sides."""
+    sides = outpaint_sides(req)
+    image = await load_image(req.image)
+    return await run_inference(
+        "outpaint",
+        progress,
+        image=image,
+        sides=sides,
+        prompt=req.prompt,
+        model_id=req.model_id,
+        strength=req.strength,
+        num_inference_steps=req.num_inference_steps,
+        guidance_scale=req.guidance_scale,
+        negative_prompt=req.negative_prompt,
+        prompt_2=req.prompt_2,
+        negative_prompt_2=req.negative_prompt_2,
+        seed=req.seed,
+        max_compute=req.max_compute,
+        context=req.context,
+    )
+
+
+async def run_upscale(req: UpscaleRequest, progress: ProgressCallback | None = None) -> Image.Image:
+    """Upscale an image using RealESRGAN or ESRGAN."""
+    # Validate model and factor
+    if req.model not in ("esrgan", "realesrgan"):
+        raise ValueError("Model must be 'esrgan' or 'realesrgan'")
+    if req.factor not in (2, 4):
+        raise ValueError("Factor must be 2 or 4")
+
+    image = await load_image(req.image)
+    return await run_inference(
+        "upscale",
+        progress,
+        image=image,
+        model=req.model,
+        factor=req.factor,
+        tile=req.tile,
+        precision=req.precision or config.UPSCALE_PRECISION,
+    )
+
+
+async def run_face_restore(
+    req: FaceRestoreRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Restore faces in an image using GFPGAN."""
+    image = await load_image(req.image)
+    return await run_inference(
+        "face-restore",
+        progress,
+        image=image,
+        strength=req.strength,
+    )
+
+
+async def run_upscale_traditional(
+    req: TraditionalUpscaleRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Upscale an image with traditional interpolation."""
+    # Validate method and factor
+    valid_methods = {"nearest", "bilinear", "bicubic", "lanczos", "area"}
+    if req.method not in valid_methods:
+        raise ValueError(f"Method must be one of {valid_methods}")
+    if req.factor not in (2, 4):
+        raise ValueError("Factor must be 2 or 4")
+
+    image = await load_image(req.image)
+    return await asyncio.to_thread(
+        report_start(traditional_upscale, progress),
+        image=image,
+        method=req.method,  # type: ignore
+        factor=req.factor,
+    )
+
+
+async def run_upscale_img2img(
+    req: Img2ImgUpscaleRequest, progress: ProgressCallback | None = None
+) -> Image.Image:
+    """Upscale an image traditionally, then refine it with low-denoise img2img."""
+    # Validate factor and method
+    if req.factor not in (2, 4):
+        raise ValueError("Factor must be 2 or 4")
+    valid_methods = {"nearest", "bilinear", "bicubic", "lanczos", "area"}
+    if req.upscale_method not in valid_methods:
+        raise ValueError(f"Upscale method must be one of {valid_methods}")
+
+    image = await load_image(req.image)
+    return await run_inference(
+        "upscale/img2img",
+        progress,
+        image=image,
+        prompt=req.prompt,
+        model_id=req.model_id,
+        factor=req.factor,
+        denoise_strength=req.denoise_strength,
+        upscale_method=req.upscale_method,
+        num_inference_steps=req.num_inference_steps,
+        guidance_scale=req.guidance_scale,
+        negative_prompt=req.negative_prompt,
+        seed=req.seed,
+        tile_size=req.tile_size,
+        tile_batch_size=req.tile_batch_size,
+    )
+
+
+async def input_size(data: ImageInput) -> tuple[int, int]:
+    """Get an input image's size without decoding it."""
+    if is_image_handle(data):
+        assert isinstance(data, str)
+        info = await asyncio.to_thread(image_store.info, data)
+        return info["width"], info["height"]
+    return await asyncio.to_thread(image_size, data)
+
+
+async def estimate_text_to_image(req: TextToImageRequest) -> float:
+    """Estimate the compute cost of a text-to-image request."""
+    native = family_resolution(req.model_id)
+    return diffusion_cost(
+        req.width or native, req.height or native, req.num_inference_steps, req.model_id
+    )
+
+
+async def estimate_controlnet_preprocess(req: ControlNetPreprocessRequest) -> float:
+    """Estimate the compute cost of a ControlNet preprocessing request."""
+    return preprocess_cost(*await input_size(req.image))
+
+
+async def estimate_controlnet_generate(req: ControlNetGenerateRequest) -> float:
+    """Estimate the compute cost of a ControlNet generation, including any preprocessing."""
+    # Without a requested size the pipeline runs at the control image's size
+    native = family_resolution(req.model_id)
+    size = (native, native)
+    cost = 0.0
+    if req.control_handle is not None:
+        control_image = control_maps.get(req.control_handle)
+        if control_image is not None:
+            size = control_image.size
+    elif req.image is not None:
+        size = await input_size(req.image)
+        cost += preprocess_cost(*size)
+    elif req.control_image is not None:
+        size = await input_size(req.control_image)
+
+    width, height = req.width or size[0], req.height or size[1]
+    generation = diffusion_cost(width, height, req.num_inference_steps, req.model_id)
+    return cost + generation * CONTROLNET_WEIGHT
+
+
+async def estimate_inpaint(req: InpaintRequest) -> float:
+    """Estimate the compute cost of an inpainting request."""
+    if req.mode == "crop":
+        # The region around the mask is diffused at the model's native pixel count
+        native = family_resolution(req.model_id)
+        width, height = native, native
+    elif req.width is not None and req.height is not None:
+        width, height = req.width, req.height
+    else:
+        image_width, image_height = await input_size(req.image)
+        width, height = req.width or image_width, req.height or image_height
+    return diffusion_cost(
+        width // 8 * 8, height // 8 * 8, req.num_inference_steps, req.model_id, req.strength
+    )
+
+
+async def estimate_outpaint(req: OutpaintRequest) -> float:
+    """Estimate the compute cost of an outpainting request from its planned windows."""
+    native = family_resolution(req.model_id)
+    plan = plan_outpaint(
+        await input_size(req.image),
+        outpaint_sides(req),  # type: ignore
+        max(0, req.context),
+        native,
+    )
+    return outpaint_cost(plan, native, req.num_inference_steps, req.model_id, req.strength)
+
+
+async def estimate_upscale(req: UpscaleRequest) -> float:
+    """Estimate the compute cost of a RealESRGAN/ESRGAN upscale."""
+    return upscale_cost(*await input_size(req.image), req.factor)
+
+
+async def estimate_face_restore(req: FaceRestoreRequest) -> float:
+    """Estimate the compute cost of a face restoration request."""
+    return face_restore_cost(*await input_size(req.image))
+
+
+async def estimate_upscale_img2img(req: Img2ImgUpscaleRequest) -> float:
+    """Estimate the compute cost of an img2img upscale, which refines the full output."""
+    width, height = await input_size(req.image)
+    return diffusion_cost(
+        width * req.factor,
+        height * req.factor,
+        req.num_inference_steps,
+        req.model_id,
+        req.denoise_strength,
+    )
+
+
+@dataclass(frozen=True)
+class Operation:
+    """An image operation, available both as an endpoint and as a background job."""
+
+    request_model: type[OutputOptions]
+    # Returns the result image, or the image and a handle that refers to it
+    run: Callable[[Any, ProgressCallback | None], Awaitable[Image.Image | tuple[Image.Image, str]]]
+    failure: str  # error detail prefix for unexpected failures
+    invalid: str = "Invalid request"  # error detail prefix for invalid parameters
+    uses_executor: bool = True
+    cache_results: bool = True  # whether deterministic results go in the result cache
+    # Estimates a request's compute cost before it runs; None = free and not metered
+    estimate: Callable[[Any], Awaitable[float]] | None = None
+
+
+@dataclass(frozen=True)
+class OperationResult:
+    """An operation's result, encoded and/or kept in the image store."""
+
+    encoded: EncodedImage | None  # None when only a handle was requested
+    width: int
+    height: int
+    handle: str | None = None
+    cost: float = 0.0  # compute units charged for this request
+    cached: bool = False  # whether the result came from the result cache
+
+
+# Operations by name; names match the endpoint paths
+OPERATIONS: dict[str, Operation] = {
+    "text-to-image": Operation(
+        TextToImageRequest,
+        run_text_to_image,
+        "Generation failed",
+        estimate=estimate_text_to_image,
+    ),
+    "controlnet/preprocess": Operation(
+        ControlNetPreprocessRequest,
+        run_controlnet_preprocess,
+        "Preprocessing failed",
+        invalid="Invalid control type",
+        # Control images have their own cache, which their handles refer to
+        cache_results=False,
+        estimate=estimate_controlnet_preprocess,
+    ),
+    "controlnet/generate": Operation(
+        ControlNetGenerateRequest,
+        run_controlnet_generate,
+        "Generation failed",
+        estimate=estimate_controlnet_generate,
+    ),
+    "inpaint": Operation(
+        InpaintRequest, run_inpaint, "Inpainting failed", estimate=estimate_inpaint
+    ),
+    "outpaint": Operation(
+        OutpaintRequest, run_outpaint, "Outpainting failed", estimate=estimate_outpaint
+    ),
+    "upscale": Operation(
+        UpscaleRequest, run_upscale, "Upscaling failed", estimate=estimate_upscale
+    ),
+    "face-restore": Operation(
+        FaceRestoreRequest,
+        run_face_restore,
+        "Face restoration failed",
+        estimate=estimate_face_restore,
+    ),
+    "upscale/traditional": Operation(
+        TraditionalUpscaleRequest,
+        run_upscale_traditional,
+        "Traditional upscale failed",
+        uses_executor=False,
+    ),
+    "upscale/img2img": Operation(
+        Img2ImgUpscaleRequest,
+        run_upscale_img2img,
+        "Img2img upscale failed",
+        estimate=estimate_upscale_img2img,
+    ),
+}
+
+
+def caller_id(request: Request) -> str:
+    """Get the ID a request is charged to: its caller ID header, else the client address."""
+    caller = request.headers.get(CALLER_HEADER)
+    if caller:
+        return caller
+    return f"address:{request.client.host if request.client else 'unknown'}"
+
+
+async def admit(name: str, req: OutputOptions, caller: str) -> float:
+    """
+    Check that a request can run now and charge its cost to the caller.
+
+    Args:
+        name: Operation name
+        req: Validated request for the operation
+        caller: Caller ID
+
+    Returns:
+        Estimated cost of the request in compute units
+
+    Raises:
+        ComputeLimitError: If the request costs more than the per-request limit
+        QuotaExceededError: If the caller's quota cannot cover the request yet
+        QueueFullError: If the inference queue is full
+    """
+    operation = OPERATIONS[name]
+    # Queue rejections are checked first so they do not use up the caller's quota
+    if operation.uses_executor:
+        inference_executor.check_capacity()
+    if operation.estimate is None:
+        return 0.0
+    cost = await operation.estimate(req)
+    compute_quotas.charge(caller, cost)
+    return cost
+
+
+def result_cache_key(name: str, req: OutputOptions, image_format: ImageFormat) -> str | None:
+    """
+    Get the content key of a request's result.
+
+    Args:
+        name: Operation name
+        req: Validated request for the operation
+        image_format: Format the result is encoded in
+
+    Returns:
+        Hash of the operation, parameters, and input images, or None if the result is
+        random (the operation takes a seed and none was given)
+    """
+    image_fields: tuple[str, ...] = getattr(req, "image_fields", ())
+    params = req.model_dump(exclude={*image_fields, "output_format", "output"})
+    if "seed" in params and params["seed"] is None:
+        return None
+    inputs = {
+        field: image_digest(getattr(req, field))
+        for field in image_fields
+        if getattr(req, field) is not None
+    }
+    return content_key(name, params, inputs, image_format)
+
+
+def decode_result(encoded: EncodedImage) -> Image.Image:
+    """Decode a cached result, which unlike client input is trusted and may be large."""
+    with Image.open(BytesIO(encoded.data)) as image:
+        image.load()
+        return image.copy()
+
+
+def lookup_result(
+    name: str, req: OutputOptions, image_format: ImageFormat
+) -> tuple[str | None, EncodedImage | None]:
+    """Get a request's cache key and its cached result, if any."""
+    if not result_cache.enabled or not OPERATIONS[name].cache_results:
+        return None, None
+    key = result_cache_key(name, req, image_format)
+    if key is None:
+        return None, None
+    return key, result_cache.get(key)
+
+
+async def run_operation(
+    name: str,
+    req: OutputOptions,
+    progress: ProgressCallback | None = None,
+    image_format: ImageFormat | None = None,
+    caller: str | None = None,
+) -> OperationResult:
+    """
+    Run an operation and encode its result.
+
+    Results of deterministic requests are served from the result cache when possible,
+    without queueing for inference or being charged to the caller. Requests that fail get
+    their charge back.
+
+    Args:
+        name: Operation name
+        req: Validated request for the operation
+        progress: Callback receiving (step, total) progress (optional)
+        image_format: Output format (defaults to the request's `output_format`, then PNG)
+        caller: Caller to charge the request to (None = already admitted)
+
+    Returns:
+        OperationResult with the encoded result
+
+    Raises:
+        HTTPException: If the request is invalid or the operation fails
+        QueueFullError: If the inference queue is full
+        QuotaExceededError: If the caller's compute quota cannot cover the request
+    """
+    operation = OPERATIONS[name]
+    image_format = image_format or req.output_format or "png"
+    image_fields: tuple[str, ...] = getattr(req, "image_fields", ())
+    params = req.model_dump(exclude={*image_fields}, exclude_none=True)
+    annotate(operation=name, model_id=params.pop("model_id", None), params=params)
+    try:
+        # Stored images keep exact pixels, which only PNG results preserve
+        if req.output == "image" or image_format == "png":
+            with stage("cache"):
+                key, cached = await asyncio.to_thread(lookup_result, name, req, image_format)
+        else:
+            key, cached = None, None
+
+        image: Image.Image | None = None
+        handle: str | None = None
+        encoded = cached
+        cost = 0.0
+        if cached is None:
+            if caller is not None:
+                cost = await admit(name, req, caller)
+            try:
+                output = await operation.run(req, progress)
+            except Exception as error:
+                # Failed requests get their charge back; cancelled ones used the device
+                if caller is not None and cost > 0 and not isinstance(error, JobCancelledError):
+                    compute_quotas.refund(caller, cost)
+                raise
+            image, handle = output if isinstance(output, tuple) else (output, None)
+
+            if req.output != "handle" or key is not None:
+                with stage("encode"):
+                    encoded = await asyncio.to_thread(
+                        encode_image,
+                        image,
+                        image_format,
+                        quality=req.quality,
+                        compress_level=req.compress_level,
+                    )
+                if key is not None:
+                    with stage("store"):
+                        await asyncio.to_thread(result_cache.put, key, encoded)
+        annotate(cached=cached is not None, cost=round(cost, 2))
+
+        if req.output != "image":
+            with stage("store"):
+                if image is None:
+                    assert encoded is not None
+                    image = await asyncio.to_thread(decode_result, encoded)
+                handle = await asyncio.to_thread(image_store.put, image)
+
+        if encoded is not None:
+            width, height = encoded.width, encoded.height
+        else:
+            assert image is not None
+            width, height = image.size
+        if req.output == "handle":
+            encoded = None
+        return OperationResult(encoded, width, height, handle, cost, cached is not None)
+
+    except (QueueFullError, QuotaExceededError, JobCancelledError):
+        raise
+    except InputTooLargeError as error:
+        raise HTTPException(status_code=413, detail=str(error)) from error
+    except HandleNotFoundError as error:
+        raise HTTPException(status_code=404, detail=str(error)) from error
+    except ImportError as error:
+        raise HTTPException(
+            status_code=501, detail=f"Dependency not installed: {error!s}"
+        ) from error
+    except ComputeLimitError as error:
+        raise HTTPException(status_code=400, detail=str(error)) from error
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=f"{operation.invalid}: {error!s}") from error
+    except Exception as error:
+        log_event("operation_failed", logging.ERROR, operation=name, exc_info=error)
+        raise HTTPException(status_code=500, detail=f"{operation.failure}: {error!s}") from error
+
+
+def image_response(result: OperationResult) -> ImageResponse:
+    """Wrap an operation result in the JSON response model."""
+    encoded = result.encoded
+    return ImageResponse(
+        image=encoded.to_base64() if encoded is not None else None,
+        width=result.width,
+        height=result.height,
+        format=encoded.format if encoded is not None else None,
+        handle=result.handle,
+    )
+
+
+def result_response(result: OperationResult, binary: bool) -> Response:
+    """
+    Answer with an operation result, as raw image bytes or as ImageResponse.
+
+    Binary responses carry the size in `X-Image-Width`/`X-Image-Height` headers and any
+    handle in `X-Image-Handle`. Results without an encoded image are always JSON. Either
+    kind carries the compute units charged in `X-Compute-Cost`.
+
+    Args:
+        result: Operation result
+        binary: Whether the client accepts the result's image format
+
+    Returns:
+        Binary image response or JSON ImageResponse
+    """
+    headers = {"Vary": "Accept", "X-Compute-Cost": f"{result.cost:.2f}"}
+    encoded = result.encoded
+    if not binary or encoded is None:
+        content = image_response(result).model_dump(exclude_none=True)
+        return JSONResponse(content, headers=headers)
+
+    headers["X-Image-Width"] = str(encoded.width)
+    headers["X-Image-Height"] = str(encoded.height)
+    if result.handle is not None:
+        headers["X-Image-Handle"] = result.handle
+    return Response(content=encoded.data, media_type=encoded.media_type, headers=headers)
+
+
+async def respond(request: Request, name: str, req: OutputOptions) -> Response:
+    """
+    Run an operation for an endpoint, answering in the format the client accepts.
+
+    Clients that accept `image/png`, `image/webp`, or `image/jpeg` get the raw bytes;
+    everyone else gets ImageResponse. The request is charged to the caller in the
+    `X-Caller-Id` header, or to the client address.
+
+    Args:
+        request: Incoming HTTP request
+        name: Operation name
+        req: Validated request for the operation
+
+    Returns:
+        Binary image response or JSON ImageResponse
+    """
+    image_format = negotiate_format(request.headers.get("accept"), req.output_format)
+    result = await run_operation(name, req, image_format=image_format, caller=caller_id(request))
+    return result_response(result, binary=image_format is not None)
+
+
+# OpenAPI description of the binary responses available through content negotiation
+IMAGE_RESPONSES: dict[int | str, dict[str, Any]] = {
+    200: {"content": {media_type: {} for media_type in MEDIA_TYPES.values()}}
+}
+
+
 @app.get("/health")
 async def health() -> dict[str, str]:
     """Health check endpoint."""
-    return {"status": "ok", "device": "cuda" if torch.cuda.is_available() else "cpu"}
+    return {"status": "ok", "device": device}
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    """
+    Readiness probe, separate from the `/health` liveness check.
+
+    Answers 200 once every configured model is loaded and warmed up (in every worker
+    process, if enabled), and 503 while workers start, while preloading is running, or
+    if it failed. The body reports the preload progress.
+    """
+    warm = preloader.ready and (worker_pool is None or worker_pool.ready)
+    return JSONResponse(preloader.stats(), status_code=200 if warm else 503)
+
+
+@app.get("/stats")
+async def stats() -> dict[str, Any]:
+    """Runtime statistics for the inference queue, batching, models, jobs, and caches."""
+    return server_stats()
+
+
+@app.get("/metrics", response_class=Response)
+async def metrics() -> Response:
+    """Runtime statistics, request metrics, and memory use in Prometheus text format."""
+    body = (
+        request_metrics.render()
+        + stats_metrics(server_stats())
+        + process_metrics()
+        + accelerator_metrics()
+    )
+    return Response(content=body, media_type=CONTENT_TYPE)
+
+
+def server_stats() -> dict[str, Any]:
+    """Collect the runtime statistics of every component."""
+    return {
+        "executor": inference_executor.stats(),
+        "device": device_policy.stats(),
+        "models": model_registry.stats(),
+        "batching": {"text_to_image": text_to_image_batcher.stats()},
+        "jobs": job_manager.stats(),
+        "prompt_cache": prompt_embeddings.stats(),
+        "control_map_cache": control_maps.stats(),
+        "result_cache": result_cache.stats(),
+        "image_store": image_store.stats(),
+        "compute_quotas": compute_quotas.stats(),
+        "preload": preloader.stats(),
+        "workers": worker_pool.stats() if worker_pool is not None else None,
+    }
 
 
 @app.get("/controlnet/types", response_model=ControlTypesResponse)
@@ -246,463 +1286,453 @@ async def get_controlnet_types() -> ControlTypesResponse:
     return ControlTypesResponse(types=types)
 
 
-@app.post("/controlnet/preprocess", response_model=ImageResponse)
-async def controlnet_preprocess(req: ControlNetPreprocessRequest) -> ImageResponse:
+@app.post(
+    "/controlnet/preprocess",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(ControlNetPreprocessRequest),
+)
+async def controlnet_preprocess(
+    request: Request,
+    req: ControlNetPreprocessRequest = Depends(image_request(ControlNetPreprocessRequest)),
+) -> Response:
     """
     Preprocess an image for ControlNet.
 
     Args:
-        req: Request containing base64 image and control type
+        request: Incoming HTTP request, for content negotiation
+        req: Request containing image and control type
 
     Returns:
-        ImageResponse with preprocessed control image
+        ImageResponse with preprocessed control image and its handle (or the raw image, if
+        accepted)
 
     Raises:
         HTTPException: If preprocessing fails
     """
-    try:
-        # Decode input image
-        input_image = base64_to_image(req.image)
-
-        # Preprocess
-        control_image = controlnet_manager.preprocess(input_image, req.type)
+    return await respond(request, "controlnet/preprocess", req)
 
-        # Convert to base64
-        image_b64 = image_to_base64(control_image)
 
-        return ImageResponse(
-            image=image_b64,
-            width=control_image.width,
-            height=control_image.height,
-            format="png",
-        )
-
-    except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid control type: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(
-            status_code=500, detail=f"Preprocessing failed: {error!s}"
-        ) from error
-
-
-@app.post("/controlnet/generate", response_model=ImageResponse)
-async def controlnet_generate(req: ControlNetGenerateRequest) -> ImageResponse:
+@app.post(
+    "/controlnet/generate",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(ControlNetGenerateRequest),
+)
+async def controlnet_generate(
+    request: Request,
+    req: ControlNetGenerateRequest = Depends(image_request(ControlNetGenerateRequest)),
+) -> Response:
     """
     Generate an image with ControlNet guidance.
 
     Args:
+        request: Incoming HTTP request, for content negotiation
         req: Request containing prompt, control image, and parameters
 
     Returns:
-        ImageResponse with generated image
+        ImageResponse with generated image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If generation fails
     """
-    try:
-        # Decode control image
-        control_image = base64_to_image(req.control_image)
-
-        # Generate
-        result_image = controlnet_manager.generate(
-            prompt=req.prompt,
-            control_image=control_image,
-            control_type=req.type,
-            base_model=req.model_id,
-            strength=req.strength,
-            width=req.width,
-            height=req.height,
-            num_inference_steps=req.num_inference_steps,
-            guidance_scale=req.guidance_scale,
-            negative_prompt=req.negative_prompt,
-            seed=req.seed,
-        )
+    return await respond(request, "controlnet/generate", req)
 
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
-
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
-        )
 
-    except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(
-            status_code=500, detail=f"Generation failed: {error!s}"
-        ) from error
-
-
-@app.post("/text-to-image", response_model=ImageResponse)
-async def text_to_image(req: TextToImageRequest) -> ImageResponse:
+@app.post("/text-to-image", response_model=ImageResponse, responses=IMAGE_RESPONSES)
+async def text_to_image(request: Request, req: TextToImageRequest) -> Response:
     """
     Generate an image from a text prompt using Stable Diffusion.
 
     Args:
+        request: Incoming HTTP request, for content negotiation
         req: Request containing model_id, prompt, and generation parameters
 
     Returns:
-        ImageResponse with base64-encoded image
+        ImageResponse with base64-encoded image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If generation fails
     """
-    try:
-        pipeline = load_pipeline(req.model_id)
-
-        # Set random seed for reproducibility
-        generator = None
-        if req.seed is not None:
-            generator = torch.Generator(device="cuda" if torch.cuda.is_available() else "cpu")
-            generator.manual_seed(req.seed)
-
-        # Build kwargs based on what the pipeline supports
-        kwargs: dict[str, Any] = {
-            "prompt": req.prompt,
-            "num_inference_steps": req.num_inference_steps,
-            "guidance_scale": req.guidance_scale,
-            "generator": generator,
-        }
-
-        # Add optional parameters
-        if req.width is not None:
-            kwargs["width"] = req.width
-        if req.height is not None:
-            kwargs["height"] = req.height
-        if req.negative_prompt is not None:
-            kwargs["negative_prompt"] = req.negative_prompt
-
-        # Generate image
-        result = pipeline(**kwargs)
-
-        # Extract image from result
-        if hasattr(result, "images"):
-            image = result.images[0]
-        else:
-            image = result[0]
-
-        if not isinstance(image, Image.Image):
-            raise ValueError("Expected PIL Image from pipeline")
-
-        # Convert to base64
-        image_b64 = image_to_base64(image)
+    return await respond(request, "text-to-image", req)
 
-        return ImageResponse(
-            image=image_b64, width=image.width, height=image.height, format="png"
-        )
-
-    except Exception as error:
-        raise HTTPException(status_code=500, detail=f"Generation failed: {error!s}") from error
 
-
-@app.post("/inpaint", response_model=ImageResponse)
-async def inpaint(req: InpaintRequest) -> ImageResponse:
+@app.post(
+    "/inpaint",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(InpaintRequest),
+)
+async def inpaint(
+    request: Request,
+    req: InpaintRequest = Depends(image_request(InpaintRequest)),
+) -> Response:
     """
     Inpaint masked region of an image.
 
     Args:
+        request: Incoming HTTP request, for content negotiation
         req: Request containing image, mask, prompt, and parameters
 
     Returns:
-        ImageResponse with inpainted image
+        ImageResponse with inpainted image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If inpainting fails
     """
-    try:
-        # Decode images
-        image = base64_to_image(req.image)
-        mask = base64_to_image(req.mask)
-
-        # Inpaint
-        result_image = inpaint_manager.inpaint(
-            image=image,
-            mask=mask,
-            prompt=req.prompt,
-            model_id=req.model_id,
-            strength=req.strength,
-            width=req.width,
-            height=req.height,
-            num_inference_steps=req.num_inference_steps,
-            guidance_scale=req.guidance_scale,
-            negative_prompt=req.negative_prompt,
-            prompt_2=req.prompt_2,
-            negative_prompt_2=req.negative_prompt_2,
-            seed=req.seed,
-            max_compute=req.max_compute,
-        )
+    return await respond(request, "inpaint", req)
 
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
 
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
-        )
-
-    except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(status_code=500, detail=f"Inpainting failed: {error!s}") from error
-
-
-@app.post("/outpaint", response_model=ImageResponse)
-async def outpaint(req: OutpaintRequest) -> ImageResponse:
+@app.post(
+    "/outpaint",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(OutpaintRequest),
+)
+async def outpaint(
+    request: Request,
+    req: OutpaintRequest = Depends(image_request(OutpaintRequest)),
+) -> Response:
     """
     Extend canvas in the specified direction with generated content.
 
     Args:
+        request: Incoming HTTP request, for content negotiation
         req: Request containing image, direction, pixels, and parameters
 
     Returns:
-        ImageResponse with extended image
+        ImageResponse with extended image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If outpainting fails
     """
-    try:
-        # Decode image
-        image = base64_to_image(req.image)
-
-        # Validate direction
-        valid_directions = {"left", "right", "top", "bottom"}
-        if req.direction not in valid_directions:
-            raise ValueError(f"Direction must be one of {valid_directions}")
-
-        # Outpaint
-        result_image = inpaint_manager.outpaint(
-            image=image,
-            direction=req.direction,  # type: ignore
-            pixels=req.pixels,
-            prompt=req.prompt,
-            model_id=req.model_id,
-            strength=req.strength,
-            num_inference_steps=req.num_inference_steps,
-            guidance_scale=req.guidance_scale,
-            negative_prompt=req.negative_prompt,
-            prompt_2=req.prompt_2,
-            negative_prompt_2=req.negative_prompt_2,
-            seed=req.seed,
-            max_compute=req.max_compute,
-        )
-
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
-
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
-        )
-
-    except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(status_code=500, detail=f"Outpainting failed: {error!s}") from error
+    return await respond(request, "outpaint", req)
 
 
-@app.post("/upscale", response_model=ImageResponse)
-async def upscale_image(req: UpscaleRequest) -> ImageResponse:
+@app.post(
+    "/upscale",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(UpscaleRequest),
+)
+async def upscale_image(
+    request: Request,
+    req: UpscaleRequest = Depends(image_request(UpscaleRequest)),
+) -> Response:
     """
     Upscale an image using RealESRGAN or ESRGAN.
 
     Args:
+        request: Incoming HTTP request, for content negotiation
         req: Request containing image, model, and factor
 
     Returns:
-        ImageResponse with upscaled image
+        ImageResponse with upscaled image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If upscaling fails
     """
-    try:
-        # Decode image
-        image = base64_to_image(req.image)
-
-        # Validate model and factor
-        if req.model not in ("esrgan", "realesrgan"):
-            raise ValueError("Model must be 'esrgan' or 'realesrgan'")
-        if req.factor not in (2, 4):
-            raise ValueError("Factor must be 2 or 4")
-
-        # Upscale
-        result_image = upscale_manager.upscale(
-            image=image,
-            model=req.model,  # type: ignore
-            factor=req.factor,  # type: ignore
-        )
-
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
-
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
-        )
-
-    except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(status_code=500, detail=f"Upscaling failed: {error!s}") from error
+    return await respond(request, "upscale", req)
 
 
-@app.post("/face-restore", response_model=ImageResponse)
-async def face_restore(req: FaceRestoreRequest) -> ImageResponse:
+@app.post(
+    "/face-restore",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(FaceRestoreRequest),
+)
+async def face_restore(
+    request: Request,
+    req: FaceRestoreRequest = Depends(image_request(FaceRestoreRequest)),
+) -> Response:
     """
     Restore faces in an image using GFPGAN.
 
     Args:
+        request: Incoming HTTP request, for content negotiation
         req: Request containing image and strength
 
     Returns:
-        ImageResponse with face-restored image
+        ImageResponse with face-restored image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If face restoration fails
     """
-    try:
-        # Decode image
-        image = base64_to_image(req.image)
+    return await respond(request, "face-restore", req)
 
-        # Restore faces
-        result_image = upscale_manager.face_restore(
-            image=image,
-            strength=req.strength,
-        )
 
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
+@app.post(
+    "/upscale/traditional",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(TraditionalUpscaleRequest),
+)
+async def upscale_traditional_endpoint(
+    request: Request,
+    req: TraditionalUpscaleRequest = Depends(image_request(TraditionalUpscaleRequest)),
+) -> Response:
+    """
+    Traditional interpolation upscaling.
 
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
-        )
+    Args:
+        request: Incoming HTTP request, for content negotiation
+        req: Request containing image, method, and factor
 
-    except ImportError as error:
-        raise HTTPException(
-            status_code=501, detail=f"GFPGAN not installed: {error!s}"
-        ) from error
-    except Exception as error:
-        raise HTTPException(
-            status_code=500, detail=f"Face restoration failed: {error!s}"
-        ) from error
+    Returns:
+        ImageResponse with upscaled image (or the raw image, if accepted)
 
+    Raises:
+        HTTPException: If upscaling fails
+    """
+    return await respond(request, "upscale/traditional", req)
 
-@app.post("/upscale/traditional", response_model=ImageResponse)
-async def upscale_traditional_endpoint(req: TraditionalUpscaleRequest) -> ImageResponse:
+
+@app.post(
+    "/upscale/img2img",
+    response_model=ImageResponse,
+    responses=IMAGE_RESPONSES,
+    openapi_extra=image_request_body(Img2ImgUpscaleRequest),
+)
+async def upscale_img2img_endpoint(
+    request: Request,
+    req: Img2ImgUpscaleRequest = Depends(image_request(Img2ImgUpscaleRequest)),
+) -> Response:
     """
-    Traditional interpolation upscaling.
+    Hybrid upscale: traditional + img2img low-denoise refinement.
 
     Args:
-        req: Request containing image, method, and factor
+        request: Incoming HTTP request, for content negotiation
+        req: Request containing image, prompt, and parameters
 
     Returns:
-        ImageResponse with upscaled image
+        ImageResponse with upscaled and  refined image (or the raw image, if accepted)
 
     Raises:
         HTTPException: If upscaling fails
     """
-    try:
-        # Decode image
-        image = base64_to_image(req.image)
-
-        # Validate method and factor
-        valid_methods = {"nearest", "bilinear", "bicubic", "lanczos", "area"}
-        if req.method not in valid_methods:
-            raise ValueError(f"Method must be one of {valid_methods}")
-        if req.factor not in (2, 4):
-            raise ValueError("Factor must be 2 or 4")
-
-        # Upscale
-        result_image = traditional_upscale(
-            image=image,
-            method=req.method,  # type: ignore
-            factor=req.factor,
-        )
+    return await respond(request, "upscale/img2img", req)
 
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
 
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
-        )
+@app.post(
+    "/images",
+    response_model=StoredImageResponse,
+    status_code=201,
+    openapi_extra=image_request_body(ImageUploadRequest),
+)
+async def store_image(
+    req: ImageUploadRequest = Depends(image_request(ImageUploadRequest)),
+) -> StoredImageResponse:
+    """
+    Store an image for use by handle in later requests.
+
+    Args:
+        req: Request containing the image
+
+    Returns:
+        StoredImageResponse with the image's handle
 
+    Raises:
+        HTTPException: If the image is too large or invalid
+    """
+    try:
+        image = await load_image(req.image)
+        handle = await asyncio.to_thread(image_store.put, image)
+        return StoredImageResponse.model_validate(image_store.info(handle))
+    except InputTooLargeError as error:
+        raise HTTPException(status_code=413, detail=str(error)) from error
+    except HandleNotFoundError as error:
+        raise HTTPException(status_code=404, detail=str(error)) from error
     except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(
-            status_code=500, detail=f"Traditional upscale failed: {error!s}"
-        ) from error
+        raise HTTPException(status_code=400, detail=f"Invalid image: {error!s}") from error
 
 
-@app.post("/upscale/img2img", response_model=ImageResponse)
-async def upscale_img2img_endpoint(req: Img2ImgUpscaleRequest) -> ImageResponse:
+@app.get("/images/{handle}", response_model=ImageResponse, responses=IMAGE_RESPONSES)
+async def get_image(request: Request, handle: str) -> Response:
     """
-    Hybrid upscale: traditional + img2img low-denoise refinement.
+    Get a stored image, answering in the format the client accepts.
 
     Args:
-        req: Request containing image, prompt, and parameters
+        request: Incoming HTTP request, for content negotiation
+        handle: Image handle
 
     Returns:
-        ImageResponse with upscaled and  refined image
+        ImageResponse with the PNG-encoded image (or the raw image, if accepted)
 
     Raises:
-        HTTPException: If upscaling fails
+        HTTPException: If the handle does not exist or has expired
     """
+    image_format = negotiate_format(request.headers.get("accept"))
     try:
-        # Decode image
-        image = base64_to_image(req.image)
-
-        # Validate factor and method
-        if req.factor not in (2, 4):
-            raise ValueError("Factor must be 2 or 4")
-        valid_methods = {"nearest", "bilinear", "bicubic", "lanczos", "area"}
-        if req.upscale_method not in valid_methods:
-            raise ValueError(f"Upscale method must be one of {valid_methods}")
-
-        # Upscale with img2img refinement
-        result_image = img2img_upscaler.upscale(
-            image=image,
-            prompt=req.prompt,
-            model_id=req.model_id,
-            factor=req.factor,
-            denoise_strength=req.denoise_strength,
-            upscale_method=req.upscale_method,  # type: ignore
-            num_inference_steps=req.num_inference_steps,
-            guidance_scale=req.guidance_scale,
-            negative_prompt=req.negative_prompt,
-            seed=req.seed,
-        )
+        image = await asyncio.to_thread(image_store.get, handle)
+    except HandleNotFoundError as error:
+        raise HTTPException(status_code=404, detail=str(error)) from error
+    encoded = await asyncio.to_thread(encode_image, image, image_format or "png")
+    result = OperationResult(encoded, encoded.width, encoded.height, handle)
+    return result_response(result, binary=image_format is not None)
+
+
+@app.delete("/images/{handle}", status_code=204)
+async def delete_image(handle: str) -> Response:
+    """
+    Remove a stored image before it expires.
+
+    Args:
+        handle: Image handle
 
-        # Convert to base64
-        image_b64 = image_to_base64(result_image)
+    Raises:
+        HTTPException: If the handle does not exist or has expired
+    """
+    if not await asyncio.to_thread(image_store.delete, handle):
+        raise HTTPException(status_code=404, detail=f"Image handle '{handle}' not found")
+    return Response(status_code=204)
+
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(request: Request, req: JobRequest) -> JobResponse:
+    """
+    Start any image operation as a background job.
+
+    The job's cost is charged to the caller when it is created.
+
+    Args:
+        request: Incoming HTTP request, for the caller ID
+        req: Request containing the operation name and its parameters
+
+    Returns:
+        JobResponse for the queued job
 
-        return ImageResponse(
-            image=image_b64,
-            width=result_image.width,
-            height=result_image.height,
-            format="png",
+    Raises:
+        HTTPException: If the operation is unknown or its parameters are invalid
+        QueueFullError: If the inference queue is full
+        QuotaExceededError: If the caller's compute quota cannot cover the job
+    """
+    operation = OPERATIONS.get(req.operation)
+    if operation is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown operation '{req.operation}', expected one of {sorted(OPERATIONS)}",
         )
 
+    try:
+        params = operation.request_model.model_validate(req.params)
+    except ValidationError as error:
+        raise HTTPException(status_code=422, detail=error.errors()) from error
+
+    # Reject up front rather than queueing a job that cannot get a slot or is over quota
+    caller = caller_id(request)
+    try:
+        cost = await admit(req.operation, params, caller)
+    except InputTooLargeError as error:
+        raise HTTPException(status_code=413, detail=str(error)) from error
+    except HandleNotFoundError as error:
+        raise HTTPException(status_code=404, detail=str(error)) from error
+    except ComputeLimitError as error:
+        raise HTTPException(status_code=400, detail=str(error)) from error
     except ValueError as error:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {error!s}") from error
-    except Exception as error:
-        raise HTTPException(
-            status_code=500, detail=f"Img2img upscale failed: {error!s}"
-        ) from error
+        raise HTTPException(status_code=400, detail=f"{operation.invalid}: {error!s}") from error
+
+    async def run(progress: ProgressCallback) -> dict[str, Any]:
+        # The job outlives its HTTP request, so it is timed and logged on its own
+        timing = RequestTiming()
+        status = "failed"
+        # The job was charged on submission; it gets the charge back unless it used the device
+        refund = True
+        try:
+            with recording(timing):
+                result = await run_operation(req.operation, params, progress)
+            status = "succeeded"
+            refund = result.cached
+        except HTTPException as error:
+            raise RuntimeError(error.detail) from error
+        except QueueFullError as error:
+            raise RuntimeError(str(error)) from error
+        except (asyncio.CancelledError, JobCancelledError):
+            status = "cancelled"
+            refund = False
+            raise
+        finally:
+            if refund and cost > 0:
+                compute_quotas.refund(caller, cost)
+            log_event(
+                "job",
+                job_id=job.id,
+                status=status,
+                duration_ms=round(timing.elapsed() * 1000, 1),
+                stages=timing.stage_milliseconds(),
+                **timing.fields,
+            )
+        return image_response(result).model_dump(exclude_none=True)
+
+    job = job_manager.submit(req.operation, run, preview_every=req.preview_every)
+    return JobResponse.model_validate(job.snapshot())
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str) -> JobResponse:
+    """
+    Get a job's status, progress, and result.
+
+    Args:
+        job_id: Job ID returned by POST /jobs
+
+    Returns:
+        JobResponse with the result once the job has succeeded
+
+    Raises:
+        HTTPException: If the job does not exist or has expired
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return JobResponse.model_validate(job.snapshot())
+
+
+@app.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str) -> JobResponse:
+    """
+    Cancel a job. Running jobs stop after their current denoising step.
+
+    Args:
+        job_id: Job ID returned by POST /jobs
+
+    Returns:
+        JobResponse with the job's current state
+
+    Raises:
+        HTTPException: If the job does not exist or has expired
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return JobResponse.model_validate(job.snapshot(include_result=False))
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """
+    Stream a job's status and per-step progress as server-sent events.
+
+    The stream starts with the job's current state and ends once it finishes.
+
+    Args:
+        job_id: Job ID returned by POST /jobs
+
+    Returns:
+        `text/event-stream` response
+
+    Raises:
+        HTTPException: If the job does not exist or has expired
+    """
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+
+    async def stream() -> AsyncIterator[str]:
+        async for event in job_manager.events(job_id):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
 
 
 if __name__ == "__main__":
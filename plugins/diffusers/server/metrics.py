@@ -0,0 +1,546 @@
+"""
+Prometheus metrics for the diffusers server.
+
+HTTP request counts and latencies are recorded by an ASGI middleware, at the cost of a
+few dictionary updates per request. Everything else (queue depth, models, caches, jobs,
+memory) is read from the statistics the components already keep, only when `/metrics`
+is scraped, so the inference path does no extra work.
+
+Metrics are rendered in the Prometheus text exposition format without any client
+library.
+"""
+
+import bisect
+import os
+import resource
+import sys
+import time
+from collections.abc import Iterable
+from typing import Any
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PREFIX = "viwo_diffusers_"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request latency buckets in seconds, from cached lookups to long generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Label values of one sample, in the order of the metric's label names
+LabelValues = tuple[str, ...]
+
+# One sample of a metric family: its labels and value
+Sample = tuple[dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value."""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _sample_line(name: str, labels: dict[str, str], value: float) -> str:
+    """Render one sample."""
+    if labels:
+        pairs = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+        return f"{name}{{{pairs}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+def render_family(name: str, kind: str, help_text: str, samples: Iterable[Sample]) -> str:
+    """
+    Render a counter or gauge family.
+
+    Args:
+        name: Metric name without the server prefix (counters end in `_total`)
+        kind: "counter" or "gauge"
+        help_text: Description of the metric
+        samples: Labels and value of each sample
+
+    Returns:
+        Exposition text for the family
+    """
+    full_name = PREFIX + name
+    lines = [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} {kind}"]
+    lines.extend(_sample_line(full_name, labels, value) for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+class Counter:
+    """A labelled counter updated on the event loop."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        """
+        Initialize an empty counter.
+
+        Args:
+            name: Metric name without the server prefix, ending in `_total`
+            help_text: Description of the metric
+            labels: Label names
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0) -> None:
+        """Increase the counter of a label set."""
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> str:
+        """Render the counter."""
+        samples = [
+            (dict(zip(self.labels, values)), total) for values, total in self._values.items()
+        ]
+        return render_family(self.name, "counter", self.help_text, samples)
+
+
+class Histogram:
+    """A labelled histogram updated on the event loop."""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        """
+        Initialize an empty histogram.
+
+        Args:
+            name: Metric name without the server prefix
+            help_text: Description of the metric
+            labels: Label names
+            buckets: Upper bounds of the buckets, ascending
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # Per label set: non-cumulative bucket counts (plus +Inf), sum, and count
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        """Record a value for a label set."""
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def render(self) -> str:
+        """Render the histogram with cumulative buckets."""
+        full_name = PREFIX + self.name
+        lines = [f"# HELP {full_name} {self.help_text}", f"# TYPE {full_name} histogram"]
+        for values, counts in self._counts.items():
+            labels = dict(zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": _format_value(bound)}
+                lines.append(_sample_line(f"{full_name}_bucket", bucket_labels, cumulative))
+            lines.append(_sample_line(f"{full_name}_sum", labels, self._sums[values]))
+            lines.append(_sample_line(f"{full_name}_count", labels, cumulative))
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """Per-endpoint HTTP request counts, latencies, and in-flight requests."""
+
+    def __init__(self):
+        """Initialize empty request metrics."""
+        self.requests = Counter(
+            "http_requests_total",
+            "HTTP requests by route and status",
+            ("method", "route", "status"),
+        )
+        self.latency = Histogram(
+            "http_request_duration_seconds",
+            "HTTP request latency until the response is complete",
+            ("method", "route"),
+        )
+        self.in_flight = 0
+
+    def render(self) -> str:
+        """Render the request metrics."""
+        in_flight = render_family(
+            "http_requests_in_flight",
+            "gauge",
+            "HTTP requests being handled",
+            [({}, self.in_flight)],
+        )
+        return self.requests.render() + self.latency.render() + in_flight
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware that records request metrics.
+
+    Requests are labelled with their route template (e.g. `/jobs/{job_id}`) rather than
+    their path, so the number of label sets stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: RequestMetrics):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: Wrapped application
+            metrics: Metrics to record into
+        """
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Handle a request, recording its status and latency."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            self.metrics.requests.inc((method, route, str(status)))
+            self.metrics.latency.observe(time.perf_counter() - started, (method, route))
+
+
+def process_metrics() -> str:
+    """Render CPU time and memory of the server process."""
+    times = os.times()
+    output = render_family(
+        "process_cpu_seconds_total",
+        "counter",
+        "User and system CPU time of the server process",
+        [({}, times.user + times.system)],
+    )
+
+    # Current resident memory is only available from /proc; the peak is portable
+    try:
+        with open("/proc/self/statm") as statm:
+            resident = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        output += render_family(
+            "process_resident_memory_bytes",
+            "gauge",
+            "Resident memory of the server process",
+            [({}, resident)],
+        )
+    except (OSError, ValueError, IndexError):
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    peak *= 1 if os.uname().sysname == "Darwin" else 1024
+    output += render_family(
+        "process_max_resident_memory_bytes",
+        "gauge",
+        "Peak resident memory of the server process",
+        [({}, peak)],
+    )
+    return output
+
+
+def accelerator_metrics() -> str:
+    """Render memory of every CUDA device, or nothing on CPU-only deployments."""
+    # Nothing is on a device until a feature imported torch; don't import it for a scrape
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return ""
+
+    allocated: list[Sample] = []
+    reserved: list[Sample] = []
+    free: list[Sample] = []
+    total: list[Sample] = []
+    for index in range(torch.cuda.device_count()):
+        labels = {"device": f"cuda:{index}"}
+        allocated.append((labels, torch.cuda.memory_allocated(index)))
+        reserved.append((labels, torch.cuda.memory_reserved(index)))
+        device_free, device_total = torch.cuda.mem_get_info(index)
+        free.append((labels, device_free))
+        total.append((labels, device_total))
+
+    return (
+        render_family(
+            "accelerator_memory_allocated_bytes",
+            "gauge",
+            "Device memory allocated by tensors",
+            allocated,
+        )
+        + render_family(
+            "accelerator_memory_reserved_bytes",
+            "gauge",
+            "Device memory held by PyTorch's caching allocator",
+            reserved,
+        )
+        + render_family("accelerator_memory_free_bytes", "gauge", "Free device memory", free)
+        + render_family("accelerator_memory_total_bytes", "gauge", "Total device memory", total)
+    )
+
+
+def stats_metrics(stats: dict[str, Any]) -> str:
+    """
+    Render the server's runtime statistics as metrics.
+
+    Args:
+        stats: Statistics as returned by `GET /stats`
+
+    Returns:
+        Exposition text
+    """
+    executor = stats["executor"]
+    models = stats["models"]
+    device = {"device": executor["device"]}
+
+    # Step 1: Inference queue and batching
+    output = (
+        render_family(
+            "inference_running", "gauge", "Inference jobs running", [(device, executor["running"])]
+        )
+        + render_family(
+            "inference_queued",
+            "gauge",
+            "Inference jobs waiting for a free slot",
+            [(device, executor["queued"])],
+        )
+        + render_family(
+            "inference_max_concurrency",
+            "gauge",
+            "Inference jobs allowed to run at once",
+            [(device, executor["max_concurrency"])],
+        )
+        + render_family(
+            "inference_completed_total",
+            "counter",
+            "Inference jobs completed",
+            [(device, executor["completed"])],
+        )
+        + render_family(
+            "inference_rejected_total",
+            "counter",
+            "Requests rejected because the inference queue was full",
+            [(device, executor["rejected"])],
+        )
+        + render_family(
+            "batches_total",
+            "counter",
+            "Micro-batched pipeline calls",
+            [
+                ({"operation": operation}, batching["batches"])
+                for operation, batching in stats["batching"].items()
+            ],
+        )
+        + render_family(
+            "batch_items_total",
+            "counter",
+            "Requests run in micro-batched pipeline calls",
+            [
+                ({"operation": operation}, batching["items"])
+                for operation, batching in stats["batching"].items()
+            ],
+        )
+    )
+
+    # Step 2: Loaded models
+    loads = models["loads"]
+    output += (
+        render_family(
+            "models_loaded", "gauge", "Models in the model registry", [({}, len(models["models"]))]
+        )
+        + render_family(
+            "model_resident_bytes",
+            "gauge",
+            "Estimated size of each loaded model",
+            [({"model": model["key"]}, model["size_bytes"]) for model in models["models"]],
+        )
+        + render_family(
+            "model_memory_resident_bytes",
+            "gauge",
+            "Estimated size of all loaded models",
+            [({}, models["resident_bytes"])],
+        )
+        + render_family(
+            "model_memory_budget_bytes",
+            "gauge",
+            "Memory budget for loaded models",
+            [({}, models["budget_bytes"] or 0)],
+        )
+        + render_family(
+            "model_loads_total",
+            "counter",
+            "Model loads by kind",
+            [({"kind": kind}, load["count"]) for kind, load in loads.items()],
+        )
+        + render_family(
+            "model_load_seconds_total",
+            "counter",
+            "Time spent loading models, by kind",
+            [({"kind": kind}, load["seconds"]) for kind, load in loads.items()],
+        )
+        + render_family(
+            "model_evictions_total", "counter", "Models unloaded", [({}, models["evictions"])]
+        )
+    )
+
+    # Step 3: Caches, including the registry itself
+    caches = {
+        "models": models,
+        "prompt_embeddings": stats["prompt_cache"],
+        "control_maps": stats["control_map_cache"],
+        "results": stats["result_cache"],
+        "images": stats["image_store"],
+    }
+    sizes = {
+        "prompt_embeddings": stats["prompt_cache"]["bytes"],
+        "control_maps": stats["control_map_cache"]["bytes"],
+        "results": stats["result_cache"]["memory"]["bytes"],
+        "images": stats["image_store"]["memory_bytes"],
+    }
+    ratios: list[Sample] = []
+    for cache, cache_stats in caches.items():
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        ratios.append(({"cache": cache}, cache_stats["hits"] / lookups if lookups else 0.0))
+    output += (
+        render_family(
+            "cache_hits_total",
+            "counter",
+            "Cache lookups that found an entry",
+            [({"cache": cache}, cache_stats["hits"]) for cache, cache_stats in caches.items()],
+        )
+        + render_family(
+            "cache_misses_total",
+            "counter",
+            "Cache lookups that found nothing",
+            [({"cache": cache}, cache_stats["misses"]) for cache, cache_stats in caches.items()],
+        )
+        + render_family(
+            "cache_hit_ratio", "gauge", "Share of cache lookups that hit since startup", ratios
+        )
+        + render_family(
+            "cache_memory_bytes",
+            "gauge",
+            "Memory held by each cache",
+            [({"cache": cache}, size) for cache, size in sizes.items()],
+        )
+        + render_family(
+            "result_cache_disk_bytes",
+            "gauge",
+            "Size of the on-disk tier of the result cache",
+            [({}, stats["result_cache"]["disk"]["bytes"])],
+        )
+        + render_family(
+            "image_store_disk_bytes",
+            "gauge",
+            "Size of images spilled to disk by the image store",
+            [({}, stats["image_store"]["disk_bytes"])],
+        )
+    )
+
+    # Step 4: Jobs and compute quotas
+    quotas = stats["compute_quotas"]
+    output += (
+        render_family(
+            "jobs",
+            "gauge",
+            "Background jobs by status",
+            [({"status": status}, count) for status, count in stats["jobs"]["by_status"].items()],
+        )
+        + render_family(
+            "compute_admitted_total",
+            "counter",
+            "Requests admitted by the compute limits",
+            [({}, quotas["admitted"])],
+        )
+        + render_family(
+            "compute_rejected_total",
+            "counter",
+            "Requests rejected by the compute limits",
+            [({}, quotas["rejected"])],
+        )
+        + render_family(
+            "compute_units_total",
+            "counter",
+            "Estimated compute units of admitted requests",
+            [({}, quotas["spent"])],
+        )
+    )
+
+    # Step 5: Readiness
+    preload = stats["preload"]
+    workers = stats.get("workers")
+    ready = preload["ready"] and (workers is None or workers["ready"])
+    output += render_family(
+        "ready",
+        "gauge",
+        "Whether the configured models are preloaded and warmed up",
+        [({}, int(ready))],
+    ) + render_family(
+        "preload_seconds",
+        "gauge",
+        "Time spent preloading each configured model",
+        [({"step": name}, seconds) for name, seconds in preload["completed"].items()],
+    )
+
+    # Step 6: Worker processes
+    if workers is not None:
+        labels = [
+            ({"worker": str(worker["index"]), "device": worker["device"]}, worker)
+            for worker in workers["workers"]
+        ]
+        output += (
+            render_family(
+                "worker_pending",
+                "gauge",
+                "Inference tasks sent to each worker process and not yet finished",
+                [(label, worker["pending"]) for label, worker in labels],
+            )
+            + render_family(
+                "worker_models",
+                "gauge",
+                "Models loaded in each worker process",
+                [(label, len(worker["models"])) for label, worker in labels],
+            )
+            + render_family(
+                "worker_model_memory_bytes",
+                "gauge",
+                "Estimated memory of the models loaded in each worker process",
+                [(label, worker["resident_bytes"]) for label, worker in labels],
+            )
+            + render_family(
+                "worker_restarts_total",
+                "counter",
+                "Worker processes restarted after exiting",
+                [(label, worker["restarts"]) for label, worker in labels],
+            )
+            + render_family(
+                "worker_routes_total",
+                "counter",
+                "Inference tasks routed by whether a worker had their model loaded",
+                [({"route": route}, count) for route, count in workers["routes"].items()],
+            )
+        )
+    return output
@@ -0,0 +1,206 @@
+"""
+Diffusion pipeline loading shared by every feature.
+
+Each base model is loaded once as its text-to-image pipeline. Task variants (img2img,
+inpainting, ControlNet) are derived from the resident components of that base pipeline,
+so they cost almost no extra memory or load time. torch and diffusers are imported by
+the first load, so a server that never runs a diffusion model never pays for them.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Literal
+
+from devices import inference_policy
+from logs import log_event
+from registry import ModelRegistry
+
+if TYPE_CHECKING:
+    from diffusers import ControlNetModel, DiffusionPipeline, StableDiffusionControlNetPipeline
+
+ModelFamily = Literal["sd", "sdxl", "sd3", "flux"]
+PipelineTask = Literal["img2img", "inpaint"]
+
+
+def model_family(model_id: str) -> ModelFamily:
+    """
+    Detect the model family from a model ID.
+
+    This is a simplified approach - proper detection would check model config.
+
+    Args:
+        model_id: Huggingface model identifier
+
+    Returns:
+        Model family
+    """
+    lowered = model_id.lower()
+    if "flux" in lowered:
+        return "flux"
+    if "sd3" in lowered or "stable-diffusion-3" in lowered:
+        return "sd3"
+    if "xl" in lowered:
+        return "sdxl"
+    return "sd"
+
+
+def native_resolution(pipeline: DiffusionPipeline) -> int:
+    """
+    Get the image size a pipeline's model was trained at.
+
+    Args:
+        pipeline: Loaded pipeline
+
+    Returns:
+        Native width and height in pixels (512 if the model does not say)
+    """
+    sample_size = getattr(pipeline, "default_sample_size", None)
+    if sample_size is None:
+        denoiser = getattr(pipeline, "unet", None) or getattr(pipeline, "transformer", None)
+        sample_size = getattr(getattr(denoiser, "config", None), "sample_size", None)
+    if not isinstance(sample_size, int):
+        return 512
+    return sample_size * getattr(pipeline, "vae_scale_factor", 8)
+
+
+def is_inpainting_checkpoint(pipeline: DiffusionPipeline) -> bool:
+    """
+    Check whether a pipeline's UNet was trained for inpainting.
+
+    Inpainting UNets take the masked image and the mask as extra input channels, so they
+    only work in inpainting pipelines.
+
+    Args:
+        pipeline: Loaded pipeline
+
+    Returns:
+        True for inpainting checkpoints
+    """
+    unet_config = getattr(getattr(pipeline, "unet", None), "config", None)
+    return getattr(unet_config, "in_channels", 4) == 9
+
+
+def load_pipeline(registry: ModelRegistry, model_id: str) -> DiffusionPipeline:
+    """
+    Load or retrieve the base text-to-image pipeline for a model.
+
+    Args:
+        registry: Registry that holds loaded pipelines
+        model_id: Huggingface model identifier
+
+    Returns:
+        Loaded pipeline instance
+    """
+
+    def load() -> DiffusionPipeline:
+        from diffusers import (
+            FluxPipeline,
+            StableDiffusion3Pipeline,
+            StableDiffusionPipeline,
+            StableDiffusionXLPipeline,
+        )
+
+        policy = inference_policy()
+
+        # Auto-detect pipeline type from model_id
+        family = model_family(model_id)
+        log_event(
+            "model_loading",
+            kind="pipeline",
+            model_id=model_id,
+            family=family,
+            device=policy.device,
+            dtype=policy.dtype_name,
+        )
+        if family == "flux":
+            pipeline = FluxPipeline.from_pretrained(model_id, torch_dtype=policy.torch_dtype)
+        elif family == "sd3":
+            pipeline = StableDiffusion3Pipeline.from_pretrained(
+                model_id, torch_dtype=policy.torch_dtype
+            )
+        elif family == "sdxl":
+            pipeline = StableDiffusionXLPipeline.from_pretrained(
+                model_id, torch_dtype=policy.torch_dtype
+            )
+        else:
+            # Default to SD 1.5 pipeline
+            pipeline = StableDiffusionPipeline.from_pretrained(
+                model_id, torch_dtype=policy.torch_dtype
+            )
+
+        return policy.place(pipeline)
+
+    return registry.get_or_load(f"pipeline:{model_id}", load)
+
+
+def _fresh_scheduler(pipeline: DiffusionPipeline) -> Any:
+    """Create an independent scheduler with the same config (schedulers hold per-run state)."""
+    scheduler = pipeline.scheduler
+    return scheduler.__class__.from_config(scheduler.config)
+
+
+def load_task_pipeline(
+    registry: ModelRegistry, model_id: str, task: PipelineTask
+) -> DiffusionPipeline:
+    """
+    Load or retrieve a task variant of a model's pipeline.
+
+    The variant shares the UNet, VAE, and text encoders of the base pipeline.
+
+    Args:
+        registry: Registry that holds loaded pipelines
+        model_id: Huggingface model identifier
+        task: Pipeline task (img2img or inpaint)
+
+    Returns:
+        Pipeline for the task
+    """
+    base_key = f"pipeline:{model_id}"
+
+    def load() -> DiffusionPipeline:
+        from diffusers import AutoPipelineForImage2Image, AutoPipelineForInpainting
+
+        base = load_pipeline(registry, model_id)
+        log_event("pipeline_derived", task=task, model_id=model_id)
+        auto_class = AutoPipelineForInpainting if task == "inpaint" else AutoPipelineForImage2Image
+        return auto_class.from_pipe(base, scheduler=_fresh_scheduler(base))
+
+    return registry.get_or_load(f"{task}:{model_id}", load, depends_on=(base_key,))
+
+
+def load_controlnet_pipeline(
+    registry: ModelRegistry,
+    model_id: str,
+    controlnet_key: str,
+    controlnet: ControlNetModel,
+) -> StableDiffusionControlNetPipeline:
+    """
+    Load or retrieve a ControlNet pipeline built on a model's base pipeline.
+
+    Args:
+        registry: Registry that holds loaded pipelines
+        model_id: Huggingface model identifier of the base model
+        controlnet_key: Registry key of the ControlNet model
+        controlnet: Loaded ControlNet model
+
+    Returns:
+        ControlNet pipeline sharing the base pipeline's components
+    """
+    base_key = f"pipeline:{model_id}"
+
+    def load() -> StableDiffusionControlNetPipeline:
+        from diffusers import StableDiffusionControlNetPipeline
+
+        base = load_pipeline(registry, model_id)
+        log_event(
+            "pipeline_derived", task="controlnet", model_id=model_id, controlnet=controlnet_key
+        )
+        return StableDiffusionControlNetPipeline.from_pipe(
+            base, controlnet=controlnet, scheduler=_fresh_scheduler(base)
+        )
+
+    return registry.get_or_load(
+        f"controlnet-pipeline:{model_id}:{controlnet_key}",
+        load,
+        depends_on=(base_key, controlnet_key),
+    )
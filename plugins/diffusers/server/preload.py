@@ -0,0 +1,106 @@
+"""
+Model preloading and warmup at startup.
+
+Without preloading, the first request for a model pays for loading its weights and for
+the first run's kernel selection and allocator growth. The preloader does that work for
+the configured models before the server reports itself ready, one step at a time on the
+inference executor so it never competes with requests for the device.
+"""
+
+import logging
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from executor import InferenceExecutor
+from logs import log_event
+
+PreloadStatus = Literal["pending", "loading", "ready", "failed"]
+
+
+@dataclass
+class PreloadStep:
+    """One model to load and warm up."""
+
+    name: str  # e.g. "pipeline:runwayml/stable-diffusion-v1-5"
+    run: Callable[[], Any]  # blocking; loads the model and runs a warmup inference
+
+
+class Preloader:
+    """Runs the preload steps and tracks whether the server is ready for traffic."""
+
+    def __init__(self, steps: list[PreloadStep]):
+        """
+        Initialize the preloader.
+
+        Args:
+            steps: Steps to run, in order
+        """
+        self.steps = steps
+        self.status: PreloadStatus = "pending" if steps else "ready"
+        self.current: str | None = None
+        self.completed: dict[str, float] = {}  # step name -> seconds
+        self.failed: dict[str, str] = {}  # step name -> error
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether every step has succeeded."""
+        return self.status == "ready"
+
+    async def run(self, executor: InferenceExecutor) -> None:
+        """
+        Run every step on the inference executor.
+
+        A failed step is logged and the remaining steps still run, but the server is not
+        reported ready: a server that was configured to preload a model it cannot load
+        would otherwise take traffic cold.
+
+        Args:
+            executor: Executor the steps run on
+        """
+        self.status = "loading"
+        self.started_at = time.time()
+        log_event("preload_started", steps=[step.name for step in self.steps])
+
+        for step in self.steps:
+            self.current = step.name
+            started = time.perf_counter()
+            try:
+                await executor.run(step.run)
+            except Exception as error:
+                self.failed[step.name] = str(error)
+                log_event("preload_failed", logging.ERROR, step=step.name, exc_info=error)
+                continue
+            duration = time.perf_counter() - started
+            self.completed[step.name] = duration
+            log_event("preloaded", step=step.name, duration_ms=round(duration * 1000, 1))
+
+        self.current = None
+        self.finished_at = time.time()
+        self.status = "failed" if self.failed else "ready"
+        log_event(
+            "preload_finished",
+            status=self.status,
+            duration_ms=round((self.finished_at - self.started_at) * 1000, 1),
+        )
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get the preload progress.
+
+        Returns:
+            Dictionary with the status, the step running, and completed and failed steps
+        """
+        return {
+            "status": self.status,
+            "ready": self.ready,
+            "steps": len(self.steps),
+            "current": self.current,
+            "completed": {name: round(seconds, 3) for name, seconds in self.completed.items()},
+            "failed": dict(self.failed),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
@@ -0,0 +1,185 @@
+"""
+Cheap previews of intermediate latents during denoising.
+
+Instead of running the VAE, latents are projected to RGB with a fixed per-family linear
+map. The result is a low-resolution (1/8 scale) approximation of the final image that
+costs next to nothing to compute.
+"""
+
+from __future__ import annotations
+
+import base64
+from collections.abc import Callable
+from io import BytesIO
+from typing import TYPE_CHECKING, Any
+
+from PIL import Image
+
+if TYPE_CHECKING:
+    import torch
+
+# Latent channel -> RGB projections, with per-channel biases
+_LATENT_RGB_FACTORS: dict[str, tuple[list[list[float]], list[float]]] = {
+    "sd": (
+        [
+            [0.3512, 0.2297, 0.3227],
+            [0.3250, 0.4974, 0.2350],
+            [-0.2829, 0.1762, 0.2721],
+            [-0.2120, -0.2616, -0.7177],
+        ],
+        [0.0, 0.0, 0.0],
+    ),
+    "sdxl": (
+        [
+            [0.3651, 0.4232, 0.4341],
+            [-0.2533, -0.0042, 0.1068],
+            [0.1076, 0.1111, -0.0362],
+            [-0.3165, -0.2492, -0.2188],
+        ],
+        [0.1084, -0.0175, -0.0011],
+    ),
+    "sd3": (
+        [
+            [-0.0922, -0.0175, 0.0749],
+            [0.0311, 0.0633, 0.0954],
+            [0.1994, 0.0927, 0.0458],
+            [0.0856, 0.0339, 0.0902],
+            [0.0587, 0.0272, -0.0496],
+            [-0.0006, 0.1104, 0.0309],
+            [0.0978, 0.0306, 0.0427],
+            [-0.0042, 0.1038, 0.1358],
+            [-0.0194, 0.0020, 0.0669],
+            [-0.0488, 0.0130, -0.0268],
+            [0.0922, 0.0988, 0.0951],
+            [-0.0278, 0.0524, -0.0542],
+            [0.0332, 0.0456, 0.0895],
+            [-0.0069, -0.0030, -0.0810],
+            [-0.0596, -0.0465, -0.0293],
+            [-0.1448, -0.1463, -0.1189],
+        ],
+        [0.2394, 0.2135, 0.1925],
+    ),
+    "flux": (
+        [
+            [-0.0346, 0.0244, 0.0681],
+            [0.0034, 0.0210, 0.0687],
+            [0.0275, -0.0668, -0.0433],
+            [-0.0174, 0.0160, 0.0617],
+            [0.0859, 0.0721, 0.0329],
+            [0.0004, 0.0383, 0.0115],
+            [0.0405, 0.0861, 0.0915],
+            [-0.0236, -0.0185, -0.0259],
+            [-0.0245, 0.0250, 0.1180],
+            [0.1008, 0.0755, -0.0421],
+            [-0.0515, 0.0201, 0.0011],
+            [0.0428, -0.0012, -0.0036],
+            [0.0817, 0.0765, 0.0749],
+            [-0.1264, -0.0522, -0.1103],
+            [-0.0280, -0.0881, -0.0499],
+            [-0.1262, -0.0982, -0.0778],
+        ],
+        [-0.0329, -0.0718, -0.0851],
+    ),
+}
+
+PreviewHandler = Callable[[int, int, Image.Image], None]
+
+
+def _pipeline_family(pipeline: Any) -> str:
+    """Detect the latent format of a pipeline from its class."""
+    name = type(pipeline).__name__
+    if "Flux" in name:
+        return "flux"
+    if "StableDiffusion3" in name:
+        return "sd3"
+    if "XL" in name:
+        return "sdxl"
+    return "sd"
+
+
+def latents_to_image(
+    latents: torch.Tensor, pipeline: Any, size: tuple[int, int] | None = None
+) -> Image.Image:
+    """
+    Project the first latent of a batch to an approximate RGB image.
+
+    Args:
+        latents: Latents from a pipeline step callback
+        pipeline: Pipeline that produced the latents
+        size: Output (width, height) in pixels; needed to unpack Flux latents
+
+    Returns:
+        Low-resolution preview image
+    """
+    import torch
+
+    family = _pipeline_family(pipeline)
+    factors, bias = _LATENT_RGB_FACTORS[family]
+
+    latent = latents[:1].detach()
+    if latent.ndim == 3:
+        # Flux packs 2x2 latent patches into the channel dimension
+        vae_scale = getattr(pipeline, "vae_scale_factor", 8)
+        if size is None:
+            default = getattr(pipeline, "default_sample_size", 128) * vae_scale
+            size = (default, default)
+        height = 2 * (size[1] // (vae_scale * 2))
+        width = 2 * (size[0] // (vae_scale * 2))
+        channels = latent.shape[2] // 4
+        latent = latent.view(1, height // 2, width // 2, channels, 2, 2)
+        latent = latent.permute(0, 3, 1, 4, 2, 5).reshape(1, channels, height, width)
+
+    weights = torch.tensor(factors, dtype=torch.float32, device=latent.device)
+    offsets = torch.tensor(bias, dtype=torch.float32, device=latent.device)
+    rgb = torch.einsum("chw,cr->hwr", latent[0].float(), weights) + offsets
+    pixels = ((rgb.clamp(-1, 1) + 1) * 127.5).to(torch.uint8).cpu().numpy()
+    return Image.fromarray(pixels)
+
+
+def preview_to_base64(image: Image.Image, quality: int = 70) -> str:
+    """Encode a preview image as a base64 JPEG."""
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+class LatentPreviewer:
+    """
+    Progress callback that also renders previews of intermediate latents.
+
+    Pass it anywhere a progress callback is accepted; pipeline step callbacks recognize it
+    and hand it the current latents every `every` steps.
+    """
+
+    def __init__(
+        self,
+        progress: Callable[[int, int], None],
+        on_preview: PreviewHandler,
+        every: int = 5,
+        size: tuple[int, int] | None = None,
+    ):
+        """
+        Initialize the previewer.
+
+        Args:
+            progress: Progress callback to forward step updates to
+            on_preview: Called with (step, total, preview image) on preview steps
+            every: Render a preview every this many steps
+            size: Output (width, height) in pixels, if known
+        """
+        self.progress = progress
+        self.on_preview = on_preview
+        self.every = max(1, every)
+        self.size = size
+
+    def __call__(self, step: int, total: int) -> None:
+        """Forward a progress update."""
+        self.progress(step, total)
+
+    def wants_preview(self, step: int, total: int) -> bool:
+        """Whether a preview should be rendered after this step."""
+        return step % self.every == 0 and step < total
+
+    def preview(self, pipeline: Any, step: int, total: int, latents: torch.Tensor) -> None:
+        """Render and deliver a preview of the current latents."""
+        self.on_preview(step, total, latents_to_image(latents, pipeline, self.size))
@@ -0,0 +1,149 @@
+"""
+Progress reporting for long-running pipeline calls.
+
+Progress callbacks receive `(step, total)` after each denoising step. They run on the
+inference thread and may raise to abort the pipeline call (e.g. when a job is cancelled).
+A `LatentPreviewer` passed as the callback additionally receives intermediate latents.
+"""
+
+import functools
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+from previews import LatentPreviewer
+
+T = TypeVar("T")
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def report_start(fn: Callable[..., T], progress: ProgressCallback | None) -> Callable[..., T]:
+    """
+    Wrap a blocking function so it reports `(0, 0)` progress when it starts running.
+
+    This lets job tracking tell queued work from running work, even for operations
+    without denoising steps.
+
+    Args:
+        fn: Function to wrap
+        progress: Callback to report to (optional)
+
+    Returns:
+        Wrapped function (or `fn` itself when there is no callback)
+    """
+    if progress is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args: Any, **kwargs: Any) -> T:
+        progress(0, 0)
+        return fn(*args, **kwargs)
+
+    return run
+
+
+def step_callback_kwargs(progress: ProgressCallback | None, total_steps: int) -> dict[str, Any]:
+    """
+    Build pipeline kwargs that report denoising progress.
+
+    Args:
+        progress: Callback to report to (optional)
+        total_steps: Fallback step count if the pipeline does not expose one
+
+    Returns:
+        Keyword arguments to pass to a diffusers pipeline call
+    """
+    if progress is None:
+        return {}
+
+    previewer = progress if isinstance(progress, LatentPreviewer) else None
+
+    def on_step_end(
+        pipeline: Any, step: int, timestep: Any, callback_kwargs: dict[str, Any]
+    ) -> dict[str, Any]:
+        # img2img and inpainting skip steps based on strength, so prefer the real count
+        total = getattr(pipeline, "num_timesteps", None) or total_steps
+        progress(step + 1, total)
+        if previewer is not None and previewer.wants_preview(step + 1, total):
+            previewer.preview(pipeline, step + 1, total, callback_kwargs["latents"])
+        return callback_kwargs
+
+    kwargs: dict[str, Any] = {"callback_on_step_end": on_step_end}
+    if previewer is not None:
+        kwargs["callback_on_step_end_tensor_inputs"] = ["latents"]
+    return kwargs
+
+
+class FanOut:
+    """
+    Progress callback that reports to every request sharing one pipeline call.
+
+    A callback that raises (e.g. because its job was cancelled) stops receiving progress,
+    and its request gets the error instead of a result. The pipeline call is only aborted
+    once every callback has raised.
+    """
+
+    def __init__(self, callbacks: list[ProgressCallback | None]):
+        """
+        Initialize the callback.
+
+        Args:
+            callbacks: One callback per request (None for requests that do not report)
+        """
+        self.callbacks = callbacks
+        self.errors: list[Exception | None] = [None] * len(callbacks)
+        self._active = sum(callback is not None for callback in callbacks)
+
+    @property
+    def stopped(self) -> bool:
+        """Whether every callback has raised, so the pipeline call was aborted."""
+        return sum(error is not None for error in self.errors) == self._active
+
+    def __call__(self, step: int, total: int) -> None:
+        """Report progress to the callbacks that have not raised yet."""
+        for index, callback in enumerate(self.callbacks):
+            if callback is None or self.errors[index] is not None:
+                continue
+            try:
+                callback(step, total)
+            except Exception as error:
+                self.errors[index] = error
+        if self.stopped:
+            raise next(error for error in self.errors if error is not None)
+
+    def results(self, results: list[T]) -> list[T | Exception]:
+        """
+        Replace the results of requests whose callback raised with their error.
+
+        Args:
+            results: One result per request
+
+        Returns:
+            The results, with errors for the dropped requests
+        """
+        return [
+            result if error is None else error
+            for result, error in zip(results, self.errors, strict=True)
+        ]
+
+
+def fan_out(callbacks: list[ProgressCallback | None]) -> ProgressCallback | None:
+    """
+    Combine several progress callbacks into one.
+
+    Used when one pipeline call serves several requests, such as a micro-batch. Several
+    callbacks are combined into a `FanOut`.
+
+    Args:
+        callbacks: Callbacks to combine (None entries are skipped)
+
+    Returns:
+        Combined callback, or None if there is nothing to report to
+    """
+    active = [callback for callback in callbacks if callback is not None]
+    if not active:
+        return None
+    if len(callbacks) == 1:
+        # Keep a lone callback as is, so it can still receive latent previews
+        return active[0]
+    return FanOut(callbacks)
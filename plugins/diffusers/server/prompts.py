@@ -0,0 +1,184 @@
+"""
+Prompt embedding cache.
+
+Pipelines normally re-run their text encoders on every call. Seed sweeps and iterative
+edits reuse the same prompts, so the encoded embeddings are cached per model and prompt
+and handed to the pipelines as precomputed `prompt_embeds`.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from cache import LRUCache
+from pipelines import model_family
+from timing import stage
+
+if TYPE_CHECKING:
+    import torch
+    from diffusers import DiffusionPipeline
+
+PromptEmbeds = dict[str, "torch.Tensor"]
+
+# (model_id, prompt, prompt_2, negative_prompt, negative_prompt_2)
+PromptKey = tuple[str, str, str | None, str | None, str | None]
+
+
+def _embeds_bytes(embeds: PromptEmbeds) -> int:
+    """Size of a set of embeddings in bytes."""
+    return sum(tensor.numel() * tensor.element_size() for tensor in embeds.values())
+
+
+class PromptEmbeddingCache:
+    """Caches text encoder outputs per model and prompt."""
+
+    def __init__(self, max_bytes: int = 128 * 1024**2):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_bytes: Maximum size of cached embeddings (0 = disabled)
+        """
+        self._cache: LRUCache[PromptKey, PromptEmbeds] = LRUCache(
+            max_bytes=max_bytes, size_of=_embeds_bytes
+        )
+
+    def pipeline_kwargs(
+        self,
+        pipeline: DiffusionPipeline,
+        model_id: str,
+        prompt: str | list[str],
+        negative_prompt: str | list[str | None] | None = None,
+        prompt_2: str | None = None,
+        negative_prompt_2: str | None = None,
+    ) -> dict[str, Any]:
+        """
+        Get the prompt arguments for a pipeline call, using cached embeddings.
+
+        Pipelines without a supported `encode_prompt` get the prompts as text.
+
+        Args:
+            pipeline: Pipeline that will be called
+            model_id: Model the pipeline's text encoders belong to
+            prompt: Prompt, or one prompt per image of a batch
+            negative_prompt: Negative prompt, or one per image of a batch (optional)
+            prompt_2: Prompt for the second text encoder (SDXL, SD3, Flux; optional)
+            negative_prompt_2: Negative prompt for the second text encoder (optional)
+
+        Returns:
+            Keyword arguments to pass to the pipeline call
+        """
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        if isinstance(negative_prompt, list):
+            negative_prompts = negative_prompt
+        else:
+            negative_prompts = [negative_prompt] * len(prompts)
+
+        if not self._cache.enabled or not hasattr(pipeline, "encode_prompt"):
+            return self._text_kwargs(prompt, negative_prompt, prompt_2, negative_prompt_2)
+
+        family = model_family(model_id)
+        if family == "flux":
+            # Flux does not use negative prompts without true CFG
+            negative_prompts = [None] * len(prompts)
+            negative_prompt_2 = None
+
+        embeds = [
+            self._embed(pipeline, (model_id, text, prompt_2, negative, negative_prompt_2))
+            for text, negative in zip(prompts, negative_prompts, strict=True)
+        ]
+        if len(embeds) == 1:
+            return dict(embeds[0])
+
+        import torch
+
+        return {name: torch.cat([item[name] for item in embeds]) for name in embeds[0]}
+
+    def _text_kwargs(
+        self,
+        prompt: str | list[str],
+        negative_prompt: str | list[str | None] | None,
+        prompt_2: str | None,
+        negative_prompt_2: str | None,
+    ) -> dict[str, Any]:
+        """Prompt arguments passed as text, for pipelines that encode prompts themselves."""
+        kwargs: dict[str, Any] = {"prompt": prompt}
+        if isinstance(negative_prompt, list) and all(item is None for item in negative_prompt):
+            negative_prompt = None
+        if negative_prompt is not None:
+            kwargs["negative_prompt"] = negative_prompt
+        if prompt_2 is not None:
+            kwargs["prompt_2"] = prompt_2
+        if negative_prompt_2 is not None:
+            kwargs["negative_prompt_2"] = negative_prompt_2
+        return kwargs
+
+    def _embed(self, pipeline: DiffusionPipeline, key: PromptKey) -> PromptEmbeds:
+        """Get the embeddings of one prompt, encoding them on a miss."""
+        import torch
+
+        embeds = self._cache.get(key)
+        if embeds is None:
+            with torch.no_grad(), stage("encode_prompt"):
+                embeds = self._encode(pipeline, key)
+            self._cache.put(key, embeds)
+        return embeds
+
+    def _encode(self, pipeline: Any, key: PromptKey) -> PromptEmbeds:
+        """Run a pipeline's text encoders on one prompt."""
+        model_id, prompt, prompt_2, negative_prompt, negative_prompt_2 = key
+        device = pipeline._execution_device
+        family = model_family(model_id)
+
+        if family == "flux":
+            prompt_embeds, pooled_prompt_embeds, _ = pipeline.encode_prompt(
+                prompt=prompt, prompt_2=prompt_2, device=device, num_images_per_prompt=1
+            )
+            return {"prompt_embeds": prompt_embeds, "pooled_prompt_embeds": pooled_prompt_embeds}
+
+        # Negative embeddings are always computed, so one entry serves any guidance scale
+        if family in ("sdxl", "sd3"):
+            extra: dict[str, Any] = {"prompt_3": None} if family == "sd3" else {}
+            (
+                prompt_embeds,
+                negative_prompt_embeds,
+                pooled_prompt_embeds,
+                negative_pooled_prompt_embeds,
+            ) = pipeline.encode_prompt(
+                prompt=prompt,
+                prompt_2=prompt_2,
+                device=device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=True,
+                negative_prompt=negative_prompt,
+                negative_prompt_2=negative_prompt_2,
+                **extra,
+            )
+            return {
+                "prompt_embeds": prompt_embeds,
+                "negative_prompt_embeds": negative_prompt_embeds,
+                "pooled_prompt_embeds": pooled_prompt_embeds,
+                "negative_pooled_prompt_embeds": negative_pooled_prompt_embeds,
+            }
+
+        prompt_embeds, negative_prompt_embeds = pipeline.encode_prompt(
+            prompt,
+            device,
+            1,
+            True,
+            negative_prompt=negative_prompt,
+        )
+        return {"prompt_embeds": prompt_embeds, "negative_prompt_embeds": negative_prompt_embeds}
+
+    def clear(self) -> None:
+        """Drop every cached embedding."""
+        self._cache.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dictionary with size and hit/miss counters
+        """
+        return self._cache.stats()
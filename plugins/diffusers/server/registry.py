@@ -0,0 +1,399 @@
+"""
+Memory-budgeted registry for loaded models.
+
+Every pipeline, model, and preprocessor the server loads is registered here together
+with an estimate of its resident size. The registry enforces a global memory budget by
+evicting least recently used entries and unloads entries that sit idle for too long.
+"""
+
+import gc
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from devices import cuda_total_memory
+from logs import log_event
+from timing import record
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Entry:
+    """A loaded model and its bookkeeping."""
+
+    value: Any
+    size_bytes: int
+    loaded_at: float
+    last_used: float
+    depends_on: tuple[str, ...] = ()
+
+
+def estimate_bytes(obj: Any, _seen: set[tuple[str, int]] | None = None, _depth: int = 0) -> int:
+    """
+    Estimate the resident size of a loaded model.
+
+    Counts parameters and buffers of every `torch.nn.Module` reachable from `obj`: the
+    components of a diffusers pipeline, or modules stored as attributes of wrapper objects
+    such as `RealESRGANer` or the controlnet_aux detectors. Shared tensors are counted once.
+
+    Args:
+        obj: Pipeline, module, or wrapper object
+
+    Returns:
+        Estimated size in bytes
+    """
+    seen = _seen if _seen is not None else set()
+    if obj is None or ("object", id(obj)) in seen or _depth > 3:
+        return 0
+    seen.add(("object", id(obj)))
+
+    # Anything holding tensors was created after torch was imported
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(obj, torch.nn.Module):
+        total = 0
+        for tensor in [*obj.parameters(), *obj.buffers()]:
+            key = ("tensor", tensor.data_ptr())
+            if key in seen:
+                continue
+            seen.add(key)
+            total += tensor.numel() * tensor.element_size()
+        return total
+
+    # Diffusers pipelines expose their modules through `components`
+    components = getattr(obj, "components", None)
+    if isinstance(components, dict):
+        return sum(estimate_bytes(value, seen, _depth + 1) for value in components.values())
+
+    attributes = getattr(obj, "__dict__", None)
+    if isinstance(attributes, dict):
+        return sum(estimate_bytes(value, seen, _depth + 1) for value in attributes.values())
+
+    return 0
+
+
+def default_memory_budget(device: str) -> int:
+    """
+    Pick a memory budget for loaded models on a device.
+
+    Uses 80% of accelerator memory, or half of physical RAM on CPU.
+
+    Args:
+        device: Device models are loaded onto
+
+    Returns:
+        Budget in bytes
+    """
+    index = int(device.partition(":")[2] or 0)
+    total = cuda_total_memory(index) if device.startswith("cuda") else 0
+    if total:
+        return int(total * 0.8)
+
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        physical = 16 * 1024**3
+    return physical // 2
+
+
+def available_memory(device: str) -> int:
+    """
+    Get the memory currently available for activations on a device.
+
+    On CUDA this counts free device memory plus memory cached but unused by PyTorch's
+    allocator. On CPU it is the available physical RAM.
+
+    Args:
+        device: Device to query
+
+    Returns:
+        Available memory in bytes
+    """
+    if device.startswith("cuda"):
+        import torch
+
+        if torch.cuda.is_available():
+            free, _ = torch.cuda.mem_get_info(device)
+            reserved = torch.cuda.memory_reserved(device)
+            return free + reserved - torch.cuda.memory_allocated(device)
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return default_memory_budget(device)
+
+
+class ModelRegistry:
+    """Tracks loaded models and evicts them by LRU order and idle time."""
+
+    def __init__(self, budget_bytes: int | None = None, idle_ttl: float | None = None):
+        """
+        Initialize an empty registry.
+
+        Args:
+            budget_bytes: Maximum estimated size of all loaded models (None = unlimited)
+            idle_ttl: Seconds after which an unused model is unloaded (None = never)
+        """
+        self.budget_bytes = budget_bytes
+        self.idle_ttl = idle_ttl
+
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks: dict[str, threading.Lock] = {}
+        # Sizes of previously loaded entries, used to make room before reloading them
+        self._known_sizes: dict[str, int] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # Number of loads and total load time, by kind (the key's namespace)
+        self._loads: dict[str, tuple[int, float]] = {}
+        # Time spent in loads nested in the current thread's load (derived models)
+        self._nested = threading.local()
+
+    @property
+    def resident_bytes(self) -> int:
+        """Estimated size of all loaded models."""
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    def __contains__(self, key: str) -> bool:
+        """Check whether a model is loaded."""
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str) -> Any | None:
+        """
+        Get a loaded model and mark it as recently used.
+
+        Args:
+            key: Registry key
+
+        Returns:
+            The loaded model, or None if it is not loaded
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            now = time.monotonic()
+            # Using a derived model also uses the models it is built from
+            for dependency in (*entry.depends_on, key):
+                dependency_entry = self._entries.get(dependency)
+                if dependency_entry is not None:
+                    dependency_entry.last_used = now
+                    self._entries.move_to_end(dependency)
+            return entry.value
+
+    def get_or_load(self, key: str, loader: Callable[[], T], depends_on: tuple[str, ...] = ()) -> T:
+        """
+        Get a loaded model, loading it first if needed.
+
+        Concurrent callers asking for the same key wait for a single load.
+
+        Args:
+            key: Registry key, namespaced by kind (e.g. `inpaint:<model_id>`)
+            loader: Function that loads the model
+            depends_on: Keys of models whose components the loaded model shares
+
+        Returns:
+            The loaded model
+        """
+        with self._lock:
+            if key in self._entries:
+                self._hits += 1
+                return self.get(key)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                if key in self._entries:
+                    self._hits += 1
+                    return self.get(key)
+                self._misses += 1
+
+            # Make room up front when we know how big this model is
+            known_size = self._known_sizes.get(key)
+            if known_size is not None:
+                self._enforce_budget(extra_bytes=known_size, keep=depends_on)
+
+            # Loads of the models this one is built from are timed on their own
+            outer_nested = getattr(self._nested, "seconds", 0.0)
+            self._nested.seconds = 0.0
+            started = time.monotonic()
+            try:
+                value = loader()
+            finally:
+                elapsed = time.monotonic() - started
+                duration = elapsed - self._nested.seconds
+                self._nested.seconds = outer_nested + elapsed
+            record("load", duration)
+            with self._lock:
+                kind = key.partition(":")[0]
+                count, seconds = self._loads.get(kind, (0, 0.0))
+                self._loads[kind] = (count + 1, seconds + duration)
+
+            self.put(key, value, depends_on=depends_on)
+            log_event(
+                "model_loaded",
+                key=key,
+                duration_ms=round(duration * 1000, 1),
+                size_bytes=self._known_sizes.get(key),
+            )
+            return value
+
+    def put(
+        self,
+        key: str,
+        value: Any,
+        size_bytes: int | None = None,
+        depends_on: tuple[str, ...] = (),
+    ) -> None:
+        """
+        Register a loaded model, evicting others if the budget is exceeded.
+
+        A model that shares components with its dependencies is only charged for the
+        memory it adds on top of them. Unloading a dependency also unloads the model.
+
+        Args:
+            key: Registry key
+            value: Loaded model
+            size_bytes: Resident size (estimated from the model if not given)
+            depends_on: Keys of models whose components this model shares
+        """
+        if size_bytes is None:
+            seen: set[tuple[str, int]] = set()
+            for dependency in depends_on:
+                estimate_bytes(self.get(dependency), seen)
+            size_bytes = estimate_bytes(value, seen)
+
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = _Entry(
+                value=value,
+                size_bytes=size_bytes,
+                loaded_at=now,
+                last_used=now,
+                depends_on=depends_on,
+            )
+            self._entries.move_to_end(key)
+            self._known_sizes[key] = size_bytes
+
+        self._enforce_budget(keep=(key,))
+
+    def evict(self, key: str) -> bool:
+        """
+        Unload a model.
+
+        Args:
+            key: Registry key
+
+        Returns:
+            True if the model was loaded
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._evictions += 1
+            dependents = [
+                other
+                for other, other_entry in self._entries.items()
+                if key in other_entry.depends_on
+            ]
+
+        log_event("model_unloaded", key=key, size_bytes=entry.size_bytes)
+        del entry
+        # Derived models keep the shared components alive, so they have to go too
+        for dependent in dependents:
+            self.evict(dependent)
+        self._release_memory()
+        return True
+
+    def evict_idle(self) -> list[str]:
+        """
+        Unload models that have not been used within the idle TTL.
+
+        Returns:
+            Keys of the unloaded models
+        """
+        if self.idle_ttl is None:
+            return []
+
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            idle = [key for key, entry in self._entries.items() if entry.last_used < cutoff]
+
+        return [key for key in idle if self.evict(key)]
+
+    def clear(self) -> None:
+        """Unload every model."""
+        with self._lock:
+            self._entries.clear()
+        self._release_memory()
+
+    def _enforce_budget(self, extra_bytes: int = 0, keep: tuple[str, ...] = ()) -> None:
+        """Evict least recently used models, sparing `keep` and its dependencies."""
+        if self.budget_bytes is None:
+            return
+
+        while True:
+            with self._lock:
+                if self.resident_bytes + extra_bytes <= self.budget_bytes:
+                    return
+                protected = set(keep)
+                for kept in keep:
+                    if kept in self._entries:
+                        protected.update(self._entries[kept].depends_on)
+                victim = next((key for key in self._entries if key not in protected), None)
+            if victim is None:
+                # Only the model being loaded remains; it is allowed to exceed the budget
+                return
+            self.evict(victim)
+
+    def _release_memory(self) -> None:
+        """Return freed memory to the allocator and device."""
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get registry statistics.
+
+        Returns:
+            Dictionary with budget, resident size, counters, load times by kind, and
+            per-model details
+        """
+        now = time.monotonic()
+        with self._lock:
+            models = [
+                {
+                    "key": key,
+                    "size_bytes": entry.size_bytes,
+                    "idle_seconds": now - entry.last_used,
+                    "loaded_seconds": now - entry.loaded_at,
+                    "depends_on": list(entry.depends_on),
+                }
+                for key, entry in self._entries.items()
+            ]
+            loads = {
+                kind: {"count": count, "seconds": seconds}
+                for kind, (count, seconds) in sorted(self._loads.items())
+            }
+        return {
+            "budget_bytes": self.budget_bytes,
+            "resident_bytes": sum(model["size_bytes"] for model in models),
+            "idle_ttl": self.idle_ttl,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "loads": loads,
+            "models": models,
+        }
@@ -0,0 +1 @@
+"""Tests for the diffusers server; run `python -m pytest` from `plugins/diffusers/server`."""
@@ -0,0 +1,35 @@
+"""Shared fixtures: the server app, running in-process on scratch directories."""
+
+import os
+import tempfile
+from collections.abc import Iterator
+from types import ModuleType
+
+import pytest
+from fastapi.testclient import TestClient
+
+# The server reads its configuration once, on import, so its directories are set first
+_scratch = tempfile.TemporaryDirectory(prefix="viwo-tests-")
+os.environ.setdefault("VIWO_DIFFUSERS_RESULT_CACHE_DIR", os.path.join(_scratch.name, "results"))
+os.environ.setdefault("VIWO_DIFFUSERS_IMAGE_STORE_DIR", os.path.join(_scratch.name, "images"))
+os.environ.setdefault("VIWO_DIFFUSERS_LOG_LEVEL", "WARNING")
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    """Remove the scratch directories."""
+    _scratch.cleanup()
+
+
+@pytest.fixture(scope="session")
+def server() -> ModuleType:
+    """The server module, imported on first use."""
+    import main
+
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(server: ModuleType) -> Iterator[TestClient]:
+    """A client for the server app, with its lifespan running."""
+    with TestClient(server.app) as client:
+        yield client
@@ -0,0 +1,18 @@
+"""Sample images for requests."""
+
+import base64
+import io
+
+from PIL import Image
+
+
+def png_bytes(size: tuple[int, int] = (16, 16), color: tuple[int, int, int] = (0, 0, 0)) -> bytes:
+    """Encode a solid image as PNG."""
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def png_base64(size: tuple[int, int] = (16, 16), color: tuple[int, int, int] = (0, 0, 0)) -> str:
+    """Encode a solid image as base64 PNG, as JSON requests carry it."""
+    return base64.b64encode(png_bytes(size, color)).decode()
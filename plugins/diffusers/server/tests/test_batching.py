@@ -0,0 +1,28 @@
+"""Tests for micro-batching."""
+
+import asyncio
+
+from batching import BatchScheduler
+from executor import InferenceExecutor
+
+
+def test_exception_results_fail_only_their_item():
+    executor = InferenceExecutor("test", max_concurrency=1, max_queue=4)
+
+    def run_batch(items: list[int]) -> list[int | Exception]:
+        return [ValueError(f"dropped {item}") if item < 0 else item * 2 for item in items]
+
+    scheduler = BatchScheduler(run_batch, lambda item: None, executor, max_batch_size=3)
+
+    async def scenario() -> list[int | BaseException]:
+        return await asyncio.gather(
+            scheduler.submit(1), scheduler.submit(-1), scheduler.submit(2), return_exceptions=True
+        )
+
+    try:
+        first, second, third = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+    assert (first, third) == (2, 4)
+    assert isinstance(second, ValueError) and str(second) == "dropped -1"
+    assert scheduler.stats()["batches"] == 1
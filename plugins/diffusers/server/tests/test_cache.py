@@ -0,0 +1,53 @@
+"""Tests for the result cache's on-disk tier."""
+
+from pathlib import Path
+
+from cache import ResultCache, hash_bytes
+from encoding import EncodedImage
+
+
+def result(size: int, fill: bytes = b"x") -> EncodedImage:
+    """A stand-in encoded result of `size` bytes."""
+    return EncodedImage(data=fill * size, format="png", width=8, height=4)
+
+
+def test_foreign_files_are_not_adopted_or_deleted(tmp_path: Path):
+    foreign = {
+        name: tmp_path / name
+        for name in ("user-a.bin", "user-b.bin", "notes.txt", f"{'0' * 64}-8x4.gif")
+    }
+    for path in foreign.values():
+        path.write_bytes(b"f" * 600_000)
+
+    cache = ResultCache(disk_dir=str(tmp_path), disk_bytes=1_000_000)
+    assert cache.stats()["disk"]["entries"] == 0
+    assert cache.stats()["disk"]["bytes"] == 0
+
+    # The disk tier still works, and filling it never touches the foreign files
+    keys = [hash_bytes(bytes([index])) for index in range(3)]
+    for key in keys:
+        cache.put(key, result(400_000))
+    assert cache.stats()["disk"]["entries"] == 2
+    assert cache.stats()["disk"]["bytes"] == 800_000
+    assert all(path.exists() for path in foreign.values())
+
+    cache.memory.clear()
+    assert cache.get(keys[2]) == result(400_000)
+
+
+def test_results_survive_a_restart_within_budget(tmp_path: Path):
+    cache = ResultCache(disk_dir=str(tmp_path), disk_bytes=1_000_000)
+    keys = [hash_bytes(bytes([index])) for index in range(3)]
+    for index, key in enumerate(keys):
+        cache.put(key, result(300_000, bytes([65 + index])))
+    (tmp_path / "user-a.bin").write_bytes(b"f" * 600_000)
+
+    # A smaller budget drops the oldest result on startup, and nothing else
+    restarted = ResultCache(disk_dir=str(tmp_path), disk_bytes=700_000)
+    assert restarted.stats()["disk"]["entries"] == 2
+    assert restarted.get(keys[0]) is None
+    assert restarted.get(keys[2]) == result(300_000, b"C")
+    assert (tmp_path / "user-a.bin").exists()
+
+    restarted.clear()
+    assert [path.name for path in tmp_path.iterdir()] == ["user-a.bin"]
@@ -0,0 +1,86 @@
+"""Tests for response encoding and `Accept` header negotiation."""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from encoding import encode_image, negotiate_format
+from tests.samples import png_base64
+
+
+@pytest.mark.parametrize(
+    ("accept", "expected"),
+    [
+        # The highest q-value wins, whatever the header order
+        ("image/png;q=0.5, image/webp;q=0.9", "webp"),
+        ("image/jpeg;q=0.8, application/json", None),
+        # Ties keep header order, and q=0 excludes a type
+        ("image/webp, image/png", "webp"),
+        ("image/webp;q=0, image/jpeg", "jpeg"),
+        ("IMAGE/PNG", "png"),
+        # Clients that accept anything get JSON
+        ("*/*", None),
+        ("*/*;q=0.1, image/png", "png"),
+        (None, None),
+        ("", None),
+        # Unsupported image types fall back to JSON
+        ("image/gif", None),
+        ("image/avif, image/gif;q=0.5", None),
+    ],
+)
+def test_negotiate_format(accept, expected):
+    assert negotiate_format(accept) == expected
+
+
+def test_any_image_type_uses_the_requested_format():
+    assert negotiate_format("image/*") == "png"
+    assert negotiate_format("image/*", preferred="jpeg") == "jpeg"
+    assert negotiate_format("image/gif, image/*;q=0.5", preferred="webp") == "webp"
+
+
+def test_encoding_options_override_the_defaults():
+    image = Image.effect_noise((64, 64), 64).convert("RGB")
+
+    small = encode_image(image, "jpeg", quality=10)
+    large = encode_image(image, "jpeg", quality=95)
+    assert len(small.data) < len(large.data)
+
+    stored = encode_image(image, "png", compress_level=0)
+    packed = encode_image(image, "png", compress_level=9)
+    assert len(packed.data) < len(stored.data)
+    assert Image.open(io.BytesIO(stored.data)).tobytes() == image.tobytes()
+
+    with pytest.raises(ValueError, match="Quality"):
+        encode_image(image, "webp", quality=0)
+    with pytest.raises(ValueError, match="Compression"):
+        encode_image(image, "png", compress_level=10)
+
+
+def test_jpeg_drops_alpha():
+    encoded = encode_image(Image.new("RGBA", (8, 4), (255, 0, 0, 128)), "jpeg")
+    assert Image.open(io.BytesIO(encoded.data)).mode == "RGB"
+    assert (encoded.media_type, encoded.width, encoded.height) == ("image/jpeg", 8, 4)
+
+
+def test_accepted_image_type_gets_raw_bytes(client):
+    body = {"image": png_base64(color=(1, 2, 3)), "output_format": "png"}
+    response = client.post("/upscale/traditional", json=body, headers={"Accept": "image/webp"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["vary"] == "Accept"
+    assert (response.headers["x-image-width"], response.headers["x-image-height"]) == ("32", "32")
+    assert Image.open(io.BytesIO(response.content)).format == "WEBP"
+
+
+def test_unsupported_type_falls_back_to_json(client):
+    body = {"image": png_base64(color=(4, 5, 6)), "output_format": "jpeg", "quality": 50}
+    response = client.post("/upscale/traditional", json=body, headers={"Accept": "image/gif"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    result = response.json()
+    assert (result["format"], result["width"], result["height"]) == ("jpeg", 32, 32)
+    assert Image.open(io.BytesIO(base64.b64decode(result["image"]))).format == "JPEG"
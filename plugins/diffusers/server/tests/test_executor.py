@@ -0,0 +1,77 @@
+"""Tests for the inference executor's admission accounting."""
+
+import asyncio
+import threading
+
+import pytest
+
+from executor import InferenceExecutor, QueueFullError
+
+
+def test_cancelled_caller_keeps_slot_until_job_finishes():
+    """A job whose caller stopped waiting still counts against capacity while it runs."""
+    executor = InferenceExecutor("test", max_concurrency=1, max_queue=0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    async def scenario() -> None:
+        task = asyncio.create_task(executor.run(block))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert executor.running == 1
+        with pytest.raises(QueueFullError):
+            executor.check_capacity()
+
+        release.set()
+        for _ in range(100):
+            if executor.running == 0 and executor.queued == 0:
+                break
+            await asyncio.sleep(0.01)
+        executor.check_capacity()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_cancelled_queued_job_frees_its_slot():
+    """A queued job that is cancelled before it starts frees its slot right away."""
+    executor = InferenceExecutor("test", max_concurrency=1, max_queue=1)
+    started = threading.Event()
+    release = threading.Event()
+    ran = threading.Event()
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    async def scenario() -> None:
+        running = asyncio.create_task(executor.run(block))
+        await asyncio.to_thread(started.wait, 5)
+        queued = asyncio.create_task(executor.run(ran.set))
+        await asyncio.sleep(0)
+        assert executor.queued == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert executor.queued == 0
+
+        release.set()
+        await running
+        assert not ran.is_set()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+        executor.shutdown()
@@ -0,0 +1,80 @@
+"""Tests for the image store's startup cleanup, disk spill, and expiry."""
+
+import time
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from cache import HandleNotFoundError
+from images import ImageStore
+
+# Decoded size of one 16x16 RGB image
+IMAGE_BYTES = 16 * 16 * 3
+
+
+def solid(value: int) -> Image.Image:
+    """A 16x16 gray image."""
+    return Image.new("RGB", (16, 16), (value, value, value))
+
+
+def test_startup_deletes_only_spilled_images(tmp_path: Path):
+    (tmp_path / "img_0123.png").write_bytes(b"spilled")
+    kept = [tmp_path / "img_notes.txt", tmp_path / "photo.png", tmp_path / "img_dir.png"]
+    kept[0].write_text("notes")
+    kept[1].write_bytes(b"png")
+    kept[2].mkdir()
+
+    ImageStore(disk_dir=str(tmp_path), disk_bytes=1_000_000)
+
+    assert not (tmp_path / "img_0123.png").exists()
+    assert all(path.exists() for path in kept)
+
+
+def test_images_over_the_memory_budget_spill_to_disk(tmp_path: Path):
+    store = ImageStore(memory_bytes=IMAGE_BYTES, disk_dir=str(tmp_path), disk_bytes=1_000_000)
+    first = store.put(solid(1))
+    second = store.put(solid(2))
+
+    # The least recently used image went to disk
+    assert store.stats()["in_memory"] == 1
+    assert store.stats()["spills"] == 1
+    assert [path.name for path in tmp_path.iterdir()] == [f"{first}.png"]
+
+    # Reading it back spills the other one instead
+    assert store.get(first).tobytes() == solid(1).tobytes()
+    assert store.get(second).tobytes() == solid(2).tobytes()
+    assert store.put(solid(1)) == first
+
+    store.clear()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_images_without_room_are_dropped(tmp_path: Path):
+    store = ImageStore(memory_bytes=IMAGE_BYTES)
+    first = store.put(solid(1))
+    store.put(solid(2))
+
+    with pytest.raises(HandleNotFoundError):
+        store.get(first)
+
+    # A spilled image over the disk budget is dropped too
+    store = ImageStore(memory_bytes=IMAGE_BYTES, disk_dir=str(tmp_path), disk_bytes=1)
+    first = store.put(solid(3))
+    store.put(solid(4))
+    with pytest.raises(HandleNotFoundError):
+        store.info(first)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unused_images_expire(tmp_path: Path):
+    store = ImageStore(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=1_000_000, ttl=0.2)
+    handle = store.put(solid(5))
+    assert 0 < store.info(handle)["expires_in"] <= 0.2
+    assert len(list(tmp_path.iterdir())) == 1
+
+    time.sleep(0.3)
+    with pytest.raises(HandleNotFoundError, match="not found or expired"):
+        store.get(handle)
+    assert store.stats()["expired"] == 1
+    assert list(tmp_path.iterdir()) == []
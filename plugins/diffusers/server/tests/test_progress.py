@@ -0,0 +1,54 @@
+"""Tests for progress fan-out across the requests of a batch."""
+
+import pytest
+
+from progress import FanOut, fan_out
+
+
+class Cancelled(Exception):
+    """Raised by a callback whose request was cancelled."""
+
+
+def recorder(log: list[tuple[int, int]], cancel_at: int | None = None):
+    """Build a callback that records progress and raises from step `cancel_at` on."""
+
+    def report(step: int, total: int) -> None:
+        if cancel_at is not None and step >= cancel_at:
+            raise Cancelled(f"cancelled at {step}")
+        log.append((step, total))
+
+    return report
+
+
+def test_lone_callback_is_returned_as_is():
+    callback = recorder([])
+    assert fan_out([callback]) is callback
+    assert fan_out([None, None]) is None
+
+
+def test_partial_cancel_drops_only_that_result():
+    kept: list[tuple[int, int]] = []
+    dropped: list[tuple[int, int]] = []
+    progress = fan_out([recorder(kept), None, recorder(dropped, cancel_at=2)])
+    assert isinstance(progress, FanOut)
+
+    for step in range(1, 5):
+        progress(step, 4)
+
+    assert not progress.stopped
+    assert kept == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert dropped == [(1, 4)]
+    results = progress.results(["a", "b", "c"])
+    assert results[:2] == ["a", "b"]
+    assert isinstance(results[2], Cancelled)
+
+
+def test_cancelling_every_reporting_request_aborts_even_with_plain_requests():
+    progress = fan_out([None, recorder([], cancel_at=2), recorder([], cancel_at=3)])
+    assert isinstance(progress, FanOut)
+
+    progress(1, 4)
+    progress(2, 4)
+    with pytest.raises(Cancelled, match="cancelled at 2"):
+        progress(3, 4)
+    assert progress.stopped
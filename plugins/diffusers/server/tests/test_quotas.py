@@ -0,0 +1,123 @@
+"""Tests for per-caller compute quotas and what requests are charged."""
+
+import dataclasses
+import time
+
+import pytest
+
+from costs import ComputeLimitError, ComputeQuotas, QuotaExceededError, upscale_cost
+from tests.samples import png_base64
+
+
+def test_bucket_refills_at_its_rate():
+    quotas = ComputeQuotas(rate=100.0, burst=10.0)
+    quotas.charge("a", 10.0)
+
+    with pytest.raises(QuotaExceededError) as raised:
+        quotas.charge("a", 5.0)
+    assert raised.value.retry_after == 1
+
+    time.sleep(0.06)
+    quotas.charge("a", 5.0)
+    assert quotas.stats()["admitted"] == 2 and quotas.stats()["rejected"] == 1
+
+
+def test_callers_have_separate_buckets():
+    quotas = ComputeQuotas(rate=0.001, burst=10.0)
+    quotas.charge("a", 8.0)
+
+    with pytest.raises(QuotaExceededError, match="'a'"):
+        quotas.charge("a", 8.0)
+    quotas.charge("b", 8.0)
+
+
+def test_requests_over_the_limit_are_rejected_outright():
+    quotas = ComputeQuotas(max_request=5.0, rate=1.0, burst=10.0)
+    with pytest.raises(ComputeLimitError, match="exceeds limit 5.00"):
+        quotas.charge("a", 6.0)
+
+    # Without a per-request limit, the burst is the most a request may cost
+    with pytest.raises(ComputeLimitError, match="exceeds limit 10.00"):
+        ComputeQuotas(rate=1.0, burst=10.0).charge("a", 11.0)
+
+
+def test_refund_returns_the_charge_up_to_the_burst():
+    quotas = ComputeQuotas(rate=0.001, burst=10.0)
+    quotas.charge("a", 6.0)
+    quotas.refund("a", 6.0)
+    quotas.refund("a", 6.0)
+
+    quotas.charge("a", 10.0)
+    with pytest.raises(QuotaExceededError):
+        quotas.charge("a", 1.0)
+    assert quotas.stats()["refunded"] == 2
+
+
+@pytest.fixture
+def metered(server, monkeypatch):
+    """Meter `/upscale` with a fake network that fails for `tile=1`, and fresh quotas."""
+
+    async def run(req, progress=None):
+        if req.tile == 1:
+            raise RuntimeError("network failed")
+        image = await server.load_image(req.image)
+        return image.resize((image.width * req.factor, image.height * req.factor))
+
+    operation = dataclasses.replace(server.OPERATIONS["upscale"], run=run)
+    monkeypatch.setitem(server.OPERATIONS, "upscale", operation)
+    cost = upscale_cost(64, 64, 2)
+    quotas = ComputeQuotas(rate=1e-6, burst=2 * cost)
+    monkeypatch.setattr(server, "compute_quotas", quotas)
+    return quotas, cost
+
+
+def wait_for_job(client, job_id: str) -> dict:
+    """Wait for a job to finish and get its final state."""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        time.sleep(0.02)
+    pytest.fail(f"Job {job_id} did not finish")
+
+
+def test_only_work_that_runs_uses_quota(client, metered):
+    quotas, cost = metered
+    caller = {"X-Caller-Id": "quota-test"}
+
+    def upscale(color: int, **params):
+        body = {"image": png_base64((64, 64), (color, 0, 0)), **params}
+        return client.post("/upscale", json=body, headers=caller)
+
+    def job(color: int, **params) -> dict:
+        body = {"image": png_base64((64, 64), (color, 0, 0)), **params}
+        response = client.post(
+            "/jobs", json={"operation": "upscale", "params": body}, headers=caller
+        )
+        assert response.status_code == 202
+        return wait_for_job(client, response.json()["id"])
+
+    # Charged once; the repeat comes from the result cache
+    assert upscale(201).headers["x-compute-cost"] == f"{cost:.2f}"
+    assert upscale(201).headers["x-compute-cost"] == "0.00"
+    # A job is charged when created, and refunded when its result was cached
+    assert job(201)["status"] == "succeeded"
+    # Failed requests and jobs are refunded
+    assert upscale(202, tile=1).status_code == 500
+    assert job(203, tile=1)["status"] == "failed"
+    assert quotas.stats()["refunded"] == 3
+
+    # One request's worth is left, then the caller has to wait
+    assert upscale(204).status_code == 200
+    response = upscale(205)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+    # Other callers are unaffected
+    other = client.post(
+        "/upscale",
+        json={"image": png_base64((64, 64), (205, 0, 0))},
+        headers={"X-Caller-Id": "someone-else"},
+    )
+    assert other.status_code == 200
@@ -0,0 +1,133 @@
+"""Tests for tiled upscaling: tile layout, seam blending, and the out-of-memory retry."""
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import upscale
+from registry import ModelRegistry
+from tiling import TileBlender, feather, tile_spans
+from upscale import UpscaleManager
+
+
+class Upscaler:
+    """Stands in for a RealESRGANer, with a smooth interpolating network."""
+
+    def __init__(self, scale: int, max_pixels: int | None = None):
+        self.scale = scale
+        self.device = "cpu"
+        self.model = Interpolate(scale, max_pixels)
+
+
+class Interpolate(torch.nn.Module):
+    """Bilinear upscaling that runs out of memory on inputs over `max_pixels`."""
+
+    def __init__(self, scale: int, max_pixels: int | None):
+        super().__init__()
+        self.scale = scale
+        self.max_pixels = max_pixels
+        self.sizes: list[tuple[int, int]] = []
+
+    def forward(self, pixels: torch.Tensor) -> torch.Tensor:
+        height, width = pixels.shape[2:]
+        self.sizes.append((width, height))
+        if self.max_pixels is not None and width * height > self.max_pixels:
+            raise torch.OutOfMemoryError("out of memory")
+        return torch.nn.functional.interpolate(
+            pixels, scale_factor=self.scale, mode="bilinear", align_corners=False
+        )
+
+
+def manager(upscaler: Upscaler) -> UpscaleManager:
+    """An upscale manager whose registry holds the stand-in upscaler."""
+    registry = ModelRegistry(budget_bytes=1024**3)
+    registry.put(f"upscaler:realesrgan_{upscaler.scale}x", upscaler, size_bytes=1)
+    return UpscaleManager(registry)
+
+
+def sample(width: int, height: int) -> Image.Image:
+    """A busy RGB image, so any seam shows up."""
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize(("length", "tile"), [(100, 32), (257, 64), (64, 64), (1000, 96)])
+def test_tiles_cover_the_axis_with_overlap(length, tile):
+    spans = tile_spans(length, tile, 16)
+
+    assert spans[0][0] == 0 and spans[-1][1] == length
+    assert all(end - start == min(tile, length) for start, end in spans)
+    assert all(previous[1] - start >= 16 for previous, (start, _) in zip(spans, spans[1:]))
+
+
+def test_single_tile_when_tiling_is_off_or_unneeded():
+    assert tile_spans(100, 0, 16) == [(0, 100)]
+    assert tile_spans(100, 128, 16) == [(0, 100)]
+    assert feather([(0, 100)], 0, scale=2).tolist() == [1.0] * 200
+
+
+def test_feather_weights_sum_to_one_across_seams():
+    spans = tile_spans(300, 96, 16)
+    total = np.zeros(600, dtype=np.float32)
+    for index, (start, end) in enumerate(spans):
+        total[start * 2 : end * 2] += feather(spans, index, scale=2)
+
+    np.testing.assert_allclose(total, 1.0, atol=1e-5)
+
+
+def test_blender_averages_overlapping_tiles():
+    blender = TileBlender(4, 1)
+    blender.add(np.full((1, 3, 3), 100.0), 0, 0, np.array([[1.0, 1.0, 0.75]]))
+    blender.add(np.full((1, 3, 3), 200.0), 0, 1, np.array([[0.25, 0.25, 1.0]]))
+    with pytest.raises(ValueError, match="row order"):
+        blender.add(np.zeros((0, 1, 3)), -1, 0, np.zeros((0, 1)))
+
+    assert np.asarray(blender.image())[0, :, 0].tolist() == [100, 120, 125, 200]
+
+
+@pytest.mark.parametrize("scale", [2, 4])
+def test_tiled_upscale_matches_the_untiled_one(scale):
+    upscaler = Upscaler(scale)
+    image = sample(150, 90)
+    progress: list[tuple[int, int]] = []
+
+    whole = manager(upscaler).upscale(image, factor=scale, tile=0, precision="fp32")
+    tiled = manager(upscaler).upscale(
+        image,
+        factor=scale,
+        tile=48,
+        precision="fp32",
+        progress=lambda *update: progress.append(update),
+    )
+
+    assert tiled.size == whole.size == (150 * scale, 90 * scale)
+    difference = np.abs(np.asarray(tiled, dtype=int) - np.asarray(whole, dtype=int))
+    assert difference.max() <= 1  # rounding only; no seams
+    tiles = len(tile_spans(150, 48, upscale.TILE_OVERLAP)) * len(
+        tile_spans(90, 48, upscale.TILE_OVERLAP)
+    )
+    assert [step for step, _ in progress] == list(range(1, tiles + 1))
+    assert tiles > 4 and progress[-1][1] == tiles
+
+
+def test_out_of_memory_retries_with_smaller_tiles(monkeypatch):
+    monkeypatch.setattr(upscale, "auto_tile_size", lambda *args: 0)
+    upscaler = Upscaler(2, max_pixels=100 * 100)
+    image = sample(300, 200)
+
+    result = manager(upscaler).upscale(image, tile=None, precision="fp32")
+
+    # The whole image, then 128-pixel tiles, ran out of memory; 64-pixel tiles fit
+    assert upscaler.model.sizes[0] == (300, 200)
+    assert max(upscaler.model.sizes[-1]) <= 64 + 2 * upscale.TILE_PAD
+    whole = manager(Upscaler(2)).upscale(image, tile=0, precision="fp32")
+    assert np.abs(np.asarray(result, dtype=int) - np.asarray(whole, dtype=int)).max() <= 1
+
+
+def test_explicit_tile_size_is_not_retried():
+    upscaler = Upscaler(2, max_pixels=10 * 10)
+
+    with pytest.raises(torch.OutOfMemoryError):
+        manager(upscaler).upscale(sample(64, 64), tile=32, precision="fp32")
+    assert len(upscaler.model.sizes) == 1
@@ -0,0 +1,109 @@
+"""Tests for input image limits and the JSON, multipart, and raw request encodings."""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+import config
+from tests.samples import png_bytes
+from uploads import InputTooLargeError, decode_image
+
+
+def jpeg_bytes(size: tuple[int, int]) -> bytes:
+    """Encode a gradient image as JPEG."""
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize(size).convert("RGB").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_byte_limit_applies_to_raw_and_base64_inputs(monkeypatch):
+    monkeypatch.setattr(config, "MAX_INPUT_MB", 0.001)
+    encoded = io.BytesIO()
+    Image.effect_noise((64, 64), 64).save(encoded, format="PNG")  # about 4 KB
+
+    with pytest.raises(InputTooLargeError, match="exceeds 0.001 MB"):
+        decode_image(encoded.getvalue())
+    with pytest.raises(InputTooLargeError, match="exceeds 0.001 MB"):
+        decode_image(base64.b64encode(encoded.getvalue()).decode())
+
+
+def test_pixel_limit_reports_the_image_size(monkeypatch):
+    monkeypatch.setattr(config, "MAX_INPUT_MEGAPIXELS", 0.5)
+
+    with pytest.raises(InputTooLargeError, match="1000x600, over the 0.5 megapixel limit"):
+        decode_image(png_bytes((1000, 600)))
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale(monkeypatch):
+    monkeypatch.setattr(config, "MAX_INPUT_MEGAPIXELS", 0.5)
+    data = jpeg_bytes((2000, 1200))
+
+    # The draft scale is at least the target size, and under the pixel limit
+    image = decode_image(data, target_size=(400, 240))
+    assert 400 <= image.width < 2000 and 240 <= image.height < 1200
+
+    with pytest.raises(InputTooLargeError, match="2000x1200"):
+        decode_image(data)
+
+
+def test_truncated_image_is_invalid():
+    data = png_bytes((256, 256), (10, 200, 30))
+    with pytest.raises(ValueError, match="Invalid image data"):
+        decode_image(data[: len(data) // 2])
+    with pytest.raises(ValueError, match="Invalid image"):
+        decode_image(b"not an image")
+
+
+def test_oversized_bodies_are_rejected(client, monkeypatch):
+    monkeypatch.setattr(config, "MAX_INPUT_MB", 0.01)
+    headers = {"Content-Type": "image/png"}
+
+    # Declared too large: rejected before the body is read
+    response = client.post("/upscale/traditional", content=b"0" * 2_000_000, headers=headers)
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Request body is too large"
+
+    # Within the declared bound, but a raw image over the byte limit
+    response = client.post("/upscale/traditional", content=b"0" * 20_000, headers=headers)
+    assert response.status_code == 413
+    assert "exceeds 0.01 MB" in response.json()["detail"]
+
+
+def test_truncated_body_is_a_bad_request(client):
+    data = png_bytes((256, 256), (20, 30, 40))
+    response = client.post(
+        "/upscale/traditional",
+        content=data[: len(data) // 2],
+        headers={"Content-Type": "image/png"},
+    )
+
+    assert response.status_code == 400
+    assert "Invalid image data" in response.json()["detail"]
+
+
+def test_multipart_and_raw_uploads_match(client):
+    data = png_bytes((24, 16), (50, 60, 70))
+    headers = {"Accept": "image/png"}
+
+    multipart = client.post(
+        "/upscale/traditional",
+        files={"image": ("input.png", data, "image/png")},
+        data={"factor": "4", "method": "nearest"},
+        headers=headers,
+    )
+    raw = client.post(
+        "/upscale/traditional?factor=4&method=nearest",
+        content=data,
+        headers={**headers, "Content-Type": "image/png"},
+    )
+    as_json = client.post(
+        "/upscale/traditional",
+        json={"image": base64.b64encode(data).decode(), "factor": 4, "method": "nearest"},
+        headers=headers,
+    )
+
+    assert multipart.status_code == raw.status_code == as_json.status_code == 200
+    assert multipart.headers["x-image-width"] == "96"
+    assert multipart.content == raw.content == as_json.content
@@ -0,0 +1,167 @@
+"""Tests for the worker pool, running the stub tasks of `tests.worker_tasks`."""
+
+import os
+import signal
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from workers import SharedImage, WorkerCrashedError, WorkerPool, WorkerSpec
+
+SHM = Path("/dev/shm")
+
+
+def shared_blocks() -> set[str]:
+    """Names of the shared memory blocks that exist now."""
+    return {path.name for path in SHM.glob("psm_*")} if SHM.is_dir() else set()
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 30.0) -> None:
+    """Wait for a condition, failing the test if it does not hold in time."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("Timed out waiting for the worker pool")
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def start_pool() -> Iterator[Callable[..., WorkerPool]]:
+    """Start worker pools on the stub tasks, shutting them down after the test."""
+    pools: list[WorkerPool] = []
+
+    def start(count: int = 1, max_pending: int = 2, warmup: list | None = None) -> WorkerPool:
+        specs = [WorkerSpec(index, "cpu") for index in range(count)]
+        pool = WorkerPool(specs, max_pending, warmup, module="tests.worker_tasks")
+        pools.append(pool)
+        pool.start()
+        wait_until(lambda: pool.ready)
+        return pool
+
+    try:
+        yield start
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+
+def test_shared_image_round_trip_frees_its_block():
+    """An image taken from shared memory is unchanged, and its block is gone."""
+    before = shared_blocks()
+    image = Image.linear_gradient("L").convert("RGB")
+
+    shared = SharedImage.share(image)
+    taken = shared.take()
+
+    assert (taken.mode, taken.size, taken.tobytes()) == ("RGB", image.size, image.tobytes())
+    assert shared_blocks() == before
+    # Discarding an image that was already taken is a no-op
+    shared.discard()
+    SharedImage.share(image).discard()
+    assert shared_blocks() == before
+
+
+def test_images_cross_processes_through_shared_memory(start_pool):
+    """Images in arguments and results reach the other process, and no block leaks."""
+    before = shared_blocks()
+    pool = start_pool()
+    image = Image.new("RGB", (32, 16), (10, 20, 30))
+
+    result = pool.call("invert", {"image": image})
+
+    assert result["size"] == (32, 16)
+    assert result["images"][0].getpixel((0, 0)) == (245, 235, 225)
+    assert shared_blocks() == before
+
+
+def test_worker_does_not_import_the_server(start_pool):
+    """Workers import only their task module, never the server and its stores."""
+    pool = start_pool()
+
+    assert pool.call("whoami", {})["modules"] == []
+
+
+def test_tasks_go_to_the_worker_with_their_model(start_pool):
+    """A task follows its model, and overflows elsewhere once that worker is busy."""
+    pool = start_pool(count=2, max_pending=1)
+    pid = pool.call("load", {"key": "model:a"}, affinity="model:a")
+    assert pool.call("whoami", {}, affinity="model:a")["pid"] == pid
+
+    # While the worker with the model is busy, the next task for it goes to the other
+    started = threading.Event()
+    with ThreadPoolExecutor(1) as executor:
+        busy = executor.submit(
+            pool.call,
+            "count",
+            {"steps": 20, "delay": 0.05},
+            lambda step, total: started.set(),
+            "model:a",
+        )
+        assert started.wait(10)
+        assert pool.call("whoami", {}, affinity="model:a")["pid"] != pid
+        assert busy.result() == 20
+
+    assert pool.stats()["routes"] == {"hit": 2, "load": 1, "overflow": 1}
+
+
+def test_task_errors_reach_the_caller(start_pool):
+    """An error raised by a task is raised by `call`, and the worker keeps serving."""
+    pool = start_pool()
+
+    with pytest.raises(ValueError, match="broken"):
+        pool.call("fail", {"message": "broken"})
+    assert pool.call("count", {"steps": 1, "delay": 0}) == 1
+
+
+def test_progress_callback_error_cancels_the_task(start_pool):
+    """An error from the progress callback stops the task in the worker and is raised."""
+    pool = start_pool()
+    steps: list[int] = []
+
+    class Cancelled(Exception):
+        pass
+
+    def progress(step: int, total: int) -> None:
+        steps.append(step)
+        if step == 3:
+            raise Cancelled
+
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        pool.call("count", {"steps": 200, "delay": 0.02}, progress)
+
+    # The worker stopped early instead of running the remaining steps
+    assert time.monotonic() - started < 3
+    assert steps[-1] < 10
+    assert pool.call("count", {"steps": 2, "delay": 0}) == 2
+    assert pool.stats()["workers"][0]["pending"] == 0
+
+
+def test_crashed_worker_fails_its_task_and_restarts_warm(start_pool):
+    """A killed worker fails its task, then comes back after replaying the warm-up tasks."""
+    pool = start_pool(warmup=[("preload", {"step": "a"})])
+    # At startup the server runs the preload steps itself, not the pool
+    assert pool.stats()["workers"][0]["models"] == []
+    pid = pool.call("whoami", {})["pid"]
+
+    started = threading.Event()
+    with ThreadPoolExecutor(1) as executor:
+        crashed = executor.submit(
+            pool.call, "count", {"steps": 500, "delay": 0.02}, lambda step, total: started.set()
+        )
+        assert started.wait(10)
+        os.kill(pid, signal.SIGKILL)
+        with pytest.raises(WorkerCrashedError):
+            crashed.result(timeout=10)
+
+    wait_until(lambda: pool.stats()["workers"][0]["restarts"] == 1 and pool.ready)
+    worker = pool.stats()["workers"][0]
+    assert worker["pid"] != pid
+    assert worker["pending"] == 0
+    assert worker["models"] == ["warm:a"]
+    assert pool.call("count", {"steps": 1, "delay": 0}) == 1
@@ -0,0 +1,68 @@
+"""Stub inference tasks for the worker pool tests, standing in for the `inference` module."""
+
+import os
+import sys
+import time
+from collections.abc import Callable
+from typing import Any
+
+from PIL import Image, ImageOps
+
+from progress import ProgressCallback, report_start
+from registry import ModelRegistry
+
+model_registry = ModelRegistry(budget_bytes=1024**3)
+
+
+def invert(image: Image.Image) -> dict[str, Any]:
+    """Invert an image, returning it among other values."""
+    return {"images": [ImageOps.invert(image.convert("RGB"))], "size": image.size}
+
+
+def load(key: str) -> int:
+    """Register a model under a key, returning the worker's PID."""
+    model_registry.put(key, object(), size_bytes=1)
+    return os.getpid()
+
+
+def count(steps: int, delay: float, progress: ProgressCallback | None = None) -> int:
+    """Report `steps` steps of progress, `delay` seconds apart."""
+    for step in range(1, steps + 1):
+        time.sleep(delay)
+        if progress is not None:
+            progress(step, steps)
+    return steps
+
+
+def whoami() -> dict[str, Any]:
+    """Get the worker's PID and which server modules it imported."""
+    return {"pid": os.getpid(), "modules": [name for name in ("main",) if name in sys.modules]}
+
+
+def preload(step: str) -> None:
+    """Stand in for a preload step by registering a model named after it."""
+    model_registry.put(f"warm:{step}", object(), size_bytes=1)
+
+
+def fail(message: str) -> None:
+    """Raise an error that crosses the process boundary."""
+    raise ValueError(message)
+
+
+# Task functions by name, and whether they take a progress callback
+TASKS: dict[str, tuple[Callable[..., Any], bool]] = {
+    "invert": (invert, False),
+    "load": (load, False),
+    "count": (count, True),
+    "whoami": (whoami, False),
+    "preload": (preload, False),
+    "fail": (fail, False),
+}
+
+
+def run_task_locally(name: str, progress: ProgressCallback | None, kwargs: dict[str, Any]) -> Any:
+    """Run a stub task like `inference.run_task_locally`."""
+    run, reports_progress = TASKS[name]
+    if reports_progress:
+        kwargs = {**kwargs, "progress": progress}
+    return report_start(run, progress)(**kwargs)
@@ -0,0 +1,145 @@
+"""
+Tiled processing with feathered seams.
+
+Large images are processed as overlapping tiles. Each tile is weighted with a linear ramp
+across its overlaps with neighbouring tiles, and the weighted tiles are averaged, so seams
+fade smoothly instead of showing hard edges.
+"""
+
+import numpy as np
+from PIL import Image
+
+# (start, end) of a tile along one axis
+Span = tuple[int, int]
+
+
+def tile_spans(length: int, tile: int, overlap: int) -> list[Span]:
+    """
+    Split an axis into evenly spaced, overlapping tiles.
+
+    Args:
+        length: Length of the axis
+        tile: Tile length (0 or at least `length` = a single tile)
+        overlap: Minimum overlap between neighbouring tiles
+
+    Returns:
+        Tile spans in order
+    """
+    if tile <= 0 or length <= tile:
+        return [(0, length)]
+
+    overlap = min(overlap, tile // 2)
+    count = -(-(length - overlap) // (tile - overlap))  # ceil
+    count = max(count, 2)
+    stride = (length - tile) / (count - 1)
+    return [(round(index * stride), round(index * stride) + tile) for index in range(count)]
+
+
+def feather(spans: list[Span], index: int, scale: int = 1) -> np.ndarray:
+    """
+    Get a tile's blend weights along one axis.
+
+    Weights ramp linearly across the overlaps with the previous and next tiles and are 1
+    elsewhere, including at the image border.
+
+    Args:
+        spans: Tile spans along the axis, from `tile_spans`
+        index: Index of the tile
+        scale: Output pixels per input pixel (for tiles that are upscaled)
+
+    Returns:
+        Weights, one per output pixel of the tile
+    """
+    start, end = spans[index]
+    weights = np.ones((end - start) * scale, dtype=np.float32)
+
+    if index > 0:
+        overlap = (spans[index - 1][1] - start) * scale
+        if overlap > 0:
+            ramp = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+            weights[:overlap] = np.minimum(weights[:overlap], ramp)
+    if index < len(spans) - 1:
+        overlap = (end - spans[index + 1][0]) * scale
+        if overlap > 0:
+            ramp = (np.arange(overlap, 0, -1, dtype=np.float32) - 0.5) / overlap
+            weights[-overlap:] = np.minimum(weights[-overlap:], ramp)
+    return weights
+
+
+class TileBlender:
+    """
+    Accumulates weighted tiles into an RGB image.
+
+    Tiles must be added in row order (non-decreasing `top`). Rows above the current tile
+    row can no longer change, so they are finalized as soon as the next row starts, and
+    only one row of tiles is held at float precision at a time.
+    """
+
+    def __init__(self, width: int, height: int):
+        """
+        Initialize an empty canvas.
+
+        Args:
+            width: Output width
+            height: Output height
+        """
+        self.width = width
+        self.height = height
+        self._output = np.zeros((height, width, 3), dtype=np.uint8)
+
+        # Weighted sums and total weights of the rows from `_top` down
+        self._top = 0
+        self._sum = np.zeros((0, width, 3), dtype=np.float32)
+        self._weight = np.zeros((0, width, 1), dtype=np.float32)
+
+    def add(self, tile: np.ndarray, top: int, left: int, weights: np.ndarray) -> None:
+        """
+        Blend a tile into the canvas.
+
+        Args:
+            tile: Tile pixels, (height, width, 3) with values in 0-255
+            top: Output row of the tile's top edge
+            left: Output column of the tile's left edge
+            weights: Blend weights, (height, width)
+        """
+        if top < self._top:
+            raise ValueError("Tiles must be added in row order")
+        self._flush(top)
+
+        bottom = top + tile.shape[0]
+        missing = bottom - self._top - self._sum.shape[0]
+        if missing > 0:
+            self._sum = np.concatenate(
+                [self._sum, np.zeros((missing, self.width, 3), dtype=np.float32)]
+            )
+            self._weight = np.concatenate(
+                [self._weight, np.zeros((missing, self.width, 1), dtype=np.float32)]
+            )
+
+        rows = slice(top - self._top, bottom - self._top)
+        columns = slice(left, left + tile.shape[1])
+        self._sum[rows, columns] += tile * weights[..., None]
+        self._weight[rows, columns] += weights[..., None]
+
+    def _flush(self, until: int) -> None:
+        """Finalize the rows above `until`."""
+        count = min(until, self.height) - self._top
+        if count <= 0:
+            return
+        weight = np.maximum(self._weight[:count], 1e-8)
+        rows = np.clip(np.rint(self._sum[:count] / weight), 0, 255)
+        self._output[self._top : self._top + count] = rows.astype(np.uint8)
+
+        self._sum = self._sum[count:].copy()
+        self._weight = self._weight[count:].copy()
+        self._top += count
+
+    def image(self) -> Image.Image:
+        """
+        Finalize every row and get the blended image.
+
+        Returns:
+            Blended PIL Image
+        """
+        self._flush(self.height)
+        return Image.fromarray(self._output)
@@ -0,0 +1,197 @@
+"""
+Per-request stage timing.
+
+Each HTTP request gets a `RequestTiming` in a context variable. Code along the request's
+path records how long its stages take (decoding inputs, waiting for the queue, loading
+models, encoding prompts, denoising, VAE decoding, encoding the output), including on the
+inference threads, which inherit the request's context. The breakdown is returned in a
+`Server-Timing` header and logged as one structured line when the request completes.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from logs import log_event
+
+# Timings that stages are recorded into; several when one call serves several requests
+_current: contextvars.ContextVar[tuple["RequestTiming", ...]] = contextvars.ContextVar(
+    "request_timings", default=()
+)
+
+
+class RequestTiming:
+    """Accumulated stage durations and log fields of one request."""
+
+    def __init__(self):
+        """Start timing a request."""
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.fields: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add time to a stage; stages that run several times add up."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        """Seconds since the request started."""
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Render the stages and the total as a `Server-Timing` header value."""
+        with self._lock:
+            stages = list(self.stages.items())
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def stage_milliseconds(self) -> dict[str, float]:
+        """Get the stage durations in milliseconds, for logging."""
+        with self._lock:
+            return {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+
+
+def current_timings() -> tuple[RequestTiming, ...]:
+    """Get the timings that stages are currently recorded into."""
+    return _current.get()
+
+
+@contextmanager
+def recording(*timings: RequestTiming) -> Iterator[None]:
+    """
+    Record stages into the given timings within the block.
+
+    Args:
+        *timings: Timings to record into
+    """
+    token = _current.set(timings)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def record(name: str, seconds: float) -> None:
+    """Add time to a stage of the current requests."""
+    for timing in _current.get():
+        timing.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a block as a stage of the current requests.
+
+    Args:
+        name: Stage name
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def annotate(**fields: Any) -> None:
+    """Add fields to the log lines of the current requests."""
+    for timing in _current.get():
+        timing.fields.update(fields)
+
+
+def run_pipeline(pipeline: Any, **kwargs: Any) -> Any:
+    """
+    Call a diffusers pipeline, timing denoising and VAE decoding as separate stages.
+
+    The end of the last denoising step splits the call: everything before it (including
+    latent preparation) counts as `denoise`, everything after it as `vae_decode`.
+
+    Args:
+        pipeline: Pipeline to call
+        **kwargs: Pipeline arguments; an existing `callback_on_step_end` is kept
+
+    Returns:
+        The pipeline's output
+    """
+    if not _current.get():
+        return pipeline(**kwargs)
+
+    started = time.perf_counter()
+    last_step = started
+    inner = kwargs.get("callback_on_step_end")
+
+    def on_step_end(
+        pipe: Any, step: int, timestep: Any, callback_kwargs: dict[str, Any]
+    ) -> dict[str, Any]:
+        nonlocal last_step
+        if inner is not None:
+            callback_kwargs = inner(pipe, step, timestep, callback_kwargs)
+        last_step = time.perf_counter()
+        return callback_kwargs
+
+    kwargs["callback_on_step_end"] = on_step_end
+    try:
+        return pipeline(**kwargs)
+    finally:
+        record("denoise", last_step - started)
+        record("vae_decode", time.perf_counter() - last_step)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times requests by stage.
+
+    The stages recorded until the response starts are sent in a `Server-Timing` header.
+    When the response completes, one `request` log line carries the status, duration,
+    stages, and any fields added with `annotate`. Requests without fields (health checks,
+    metrics scrapes, job polling) are logged at debug level.
+    """
+
+    def __init__(self, app: ASGIApp):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: Wrapped application
+        """
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Handle a request within its own timing context."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            with recording(timing):
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            log_event(
+                "request",
+                logging.INFO if timing.fields else logging.DEBUG,
+                method=scope["method"],
+                route=getattr(scope.get("route"), "path", scope["path"]),
+                status=status,
+                duration_ms=round(timing.elapsed() * 1000, 1),
+                stages=timing.stage_milliseconds(),
+                **timing.fields,
+            )
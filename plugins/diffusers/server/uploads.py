@@ -0,0 +1,282 @@
+"""
+Input images from JSON, multipart, and raw binary request bodies.
+
+Image endpoints accept their inputs as base64 strings in a JSON body (the original API),
+as files in a `multipart/form-data` body, or as the raw request body with the remaining
+parameters in the query string. Inputs are checked against byte and pixel limits before
+they are fully decoded. Any image input may instead be a handle from the image store.
+"""
+
+import base64
+import binascii
+import json
+from collections.abc import Awaitable, Callable
+from io import BytesIO
+from typing import Any, TypeVar
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from PIL import Image
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import UploadFile
+
+import config
+from cache import hash_bytes
+from images import is_image_handle
+from timing import stage
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# Base64 string or image handle in JSON bodies, raw bytes from multipart or binary uploads
+ImageInput = str | bytes
+
+RAW_MEDIA_TYPES = ("image/", "application/octet-stream")
+
+# Base64 characters decoded when reading just an image's header (a multiple of 4)
+HEADER_PREFIX = 64 * 1024
+
+
+class InputTooLargeError(ValueError):
+    """Raised when an input image exceeds the configured byte or pixel limit."""
+
+
+def max_input_bytes() -> int:
+    """Maximum encoded size of one input image."""
+    return int(config.MAX_INPUT_MB * 1024 * 1024)
+
+
+def max_input_pixels() -> int:
+    """Maximum decoded size of one input image."""
+    return int(config.MAX_INPUT_MEGAPIXELS * 1_000_000)
+
+
+def _open_image(data: ImageInput) -> Image.Image:
+    """Decode base64 if needed and read an image's header, enforcing the byte limit."""
+    limit = max_input_bytes()
+    if isinstance(data, str):
+        if len(data) * 3 // 4 > limit:
+            raise InputTooLargeError(f"Input image exceeds {config.MAX_INPUT_MB:g} MB")
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error as error:
+            raise ValueError(f"Invalid base64 image: {error}") from error
+    if len(data) > limit:
+        raise InputTooLargeError(f"Input image exceeds {config.MAX_INPUT_MB:g} MB")
+
+    try:
+        return Image.open(BytesIO(data))
+    except Image.DecompressionBombError as error:
+        raise InputTooLargeError(str(error)) from error
+    except OSError as error:
+        raise ValueError(f"Invalid image: {error}") from error
+
+
+def decode_image(data: ImageInput, target_size: tuple[int, int] | None = None) -> Image.Image:
+    """
+    Decode an input image, enforcing the input limits.
+
+    Args:
+        data: Base64 string or raw encoded bytes
+        target_size: Size the image will be resized to, if any. JPEGs much larger than
+            this are decoded at a reduced scale (at least this size) to save time and memory
+
+    Returns:
+        Decoded PIL Image
+
+    Raises:
+        InputTooLargeError: If the image exceeds the byte or pixel limit
+        ValueError: If the data is not a valid image
+    """
+    # Step 1: Check the encoded size and read the header only
+    image = _open_image(data)
+
+    # Step 2: Check the size that will be decoded
+    width, height = image.size
+    if target_size is not None and image.format == "JPEG":
+        image.draft(None, target_size)
+
+    if image.width * image.height > max_input_pixels():
+        raise InputTooLargeError(
+            f"Input image is {width}x{height}, "
+            f"over the {config.MAX_INPUT_MEGAPIXELS:g} megapixel limit"
+        )
+
+    # Step 3: Decode; a valid header can still precede truncated or corrupt data
+    try:
+        image.load()
+    except OSError as error:
+        raise ValueError(f"Invalid image data: {error}") from error
+    return image
+
+
+def image_size(data: ImageInput) -> tuple[int, int]:
+    """
+    Read an input image's size from its header, without decoding it.
+
+    Base64 inputs are first tried with only their start decoded, which holds the header
+    of almost every image.
+
+    Args:
+        data: Base64 string or raw encoded bytes
+
+    Returns:
+        Width and height
+
+    Raises:
+        InputTooLargeError: If the image exceeds the byte limit
+        ValueError: If the data is not a valid image
+    """
+    if isinstance(data, str) and len(data) > HEADER_PREFIX:
+        try:
+            with Image.open(BytesIO(base64.b64decode(data[:HEADER_PREFIX]))) as image:
+                return image.size
+        except (binascii.Error, OSError, Image.DecompressionBombError):
+            pass
+    with _open_image(data) as image:
+        return image.size
+
+
+def image_digest(data: ImageInput) -> str:
+    """
+    Hash an input image's encoded bytes, however it was sent.
+
+    Image handles are derived from the stored image's pixels, so they are their own digest.
+
+    Args:
+        data: Base64 string, raw encoded bytes, or image handle
+
+    Returns:
+        Hex SHA-256 digest, or the image handle
+    """
+    if is_image_handle(data):
+        assert isinstance(data, str)
+        return data
+    if isinstance(data, str):
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error:
+            data = data.encode("utf-8")
+    return hash_bytes(data)
+
+
+async def _read_body(request: Request, limit: int) -> bytes:
+    """Read a raw request body, stopping as soon as it exceeds the limit."""
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(
+                status_code=413, detail=f"Input image exceeds {config.MAX_INPUT_MB:g} MB"
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_image_request(request: Request, model: type[ModelT]) -> ModelT:
+    """
+    Parse an image request from a JSON, multipart, or raw binary body.
+
+    Multipart bodies carry images as file parts and other parameters as form fields. A
+    raw body (`image/*` or `application/octet-stream`) is the model's first image field,
+    with other parameters in the query string.
+
+    Args:
+        request: Incoming HTTP request
+        model: Request model; its `image_fields` class attribute names the image inputs
+
+    Returns:
+        Validated request
+
+    Raises:
+        HTTPException: If the body is too large (413) or invalid (422)
+    """
+    image_fields: tuple[str, ...] = getattr(model, "image_fields", ())
+    limit = max_input_bytes()
+
+    # Step 1: Reject oversized bodies before reading them (base64 inflates images by 4/3)
+    content_length = request.headers.get("content-length")
+    max_body = limit * max(1, len(image_fields)) * 4 // 3 + 1024 * 1024
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_body:
+        raise HTTPException(status_code=413, detail="Request body is too large")
+
+    # Step 2: Collect fields from the body
+    media_type = request.headers.get("content-type", "").partition(";")[0].strip().lower()
+    data: dict[str, Any]
+    if media_type == "multipart/form-data":
+        form = await request.form(max_files=len(image_fields))
+        data = {}
+        for key, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                if value.size is not None and value.size > limit:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Input image '{key}' exceeds {config.MAX_INPUT_MB:g} MB",
+                    )
+                data[key] = await value.read()
+            else:
+                data[key] = value
+    elif image_fields and media_type.startswith(RAW_MEDIA_TYPES):
+        data = dict(request.query_params)
+        data[image_fields[0]] = await _read_body(request, limit)
+    else:
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError) as error:
+            raise HTTPException(status_code=422, detail=f"Invalid JSON body: {error}") from error
+
+    # Step 3: Validate
+    try:
+        return model.model_validate(data)
+    except ValidationError as error:
+        detail = jsonable_encoder(error.errors(include_url=False, include_input=False))
+        raise HTTPException(status_code=422, detail=detail) from error
+
+
+def image_request(model: type[ModelT]) -> Callable[[Request], Awaitable[ModelT]]:
+    """
+    Create a FastAPI dependency that parses an image request in any supported encoding.
+
+    Args:
+        model: Request model
+
+    Returns:
+        Dependency returning the validated request
+    """
+
+    async def parse(request: Request) -> ModelT:
+        with stage("read"):
+            return await read_image_request(request, model)
+
+    return parse
+
+
+def image_request_body(model: type[BaseModel]) -> dict[str, Any]:
+    """
+    Describe the request body encodings of an image endpoint for OpenAPI.
+
+    Args:
+        model: Request model
+
+    Returns:
+        `openapi_extra` for the endpoint
+    """
+    image_fields: tuple[str, ...] = getattr(model, "image_fields", ())
+    schema = model.model_json_schema()
+    multipart_schema = {
+        **schema,
+        "properties": {
+            name: {"type": "string", "format": "binary"} if name in image_fields else value
+            for name, value in schema.get("properties", {}).items()
+        },
+    }
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": schema},
+                "multipart/form-data": {"schema": multipart_schema},
+                "image/*": {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    }
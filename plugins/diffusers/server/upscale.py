@@ -2,32 +2,138 @@
 Upscaling and face restoration manager.
 
 Provides image quality enhancement using RealESRGAN and face restoration using GFPGAN.
+RealESRGAN runs over overlapping tiles sized to the available memory, so large upscales
+work in bounded memory. torch, RealESRGAN, and GFPGAN are imported by the first upscale
+or restore.
 """
 
-from typing import Any, Literal
+from __future__ import annotations
+
+import contextlib
+import importlib.util
+import logging
+import math
+from typing import TYPE_CHECKING, Any, Literal
 
 import cv2
 import numpy as np
-from basicsr.archs.rrdbnet_arch import RRDBNet
 from PIL import Image
-from realesrgan import RealESRGANer
 
-try:
-    from gfpgan import GFPGANer
-    GFPGAN_AVAILABLE = True
-except ImportError:
-    GFPGAN_AVAILABLE = False
+import config
+from devices import inference_policy
+from logs import log_event
+from progress import ProgressCallback
+from registry import ModelRegistry, available_memory
+from tiling import TileBlender, feather, tile_spans
+
+if TYPE_CHECKING:
+    import torch
+    from realesrgan import RealESRGANer
+
+# Whether the optional GFPGAN package is installed (it is imported by the first restore)
+GFPGAN_AVAILABLE = importlib.util.find_spec("gfpgan") is not None
 
 UpscaleModel = Literal["esrgan", "realesrgan"]
+UpscalePrecision = Literal["fp32", "fp16", "bf16"]
+
+# A precision, or "auto" to let the device policy pick one
+UpscalePrecisionSetting = UpscalePrecision | Literal["auto"]
+
+# Input pixels of context around each tile, cropped from its output
+TILE_PAD = 10
+# Input pixels neighbouring tiles overlap by, blended across
+TILE_OVERLAP = 16
+# Bounds of automatically picked tile sizes, in input pixels
+MIN_TILE = 64
+MAX_TILE = 1024
+
+
+def upscale_bytes_per_pixel(scale: int, precision: UpscalePrecision) -> int:
+    """
+    Estimate the peak activation memory of RRDBNet per input pixel.
+
+    The body keeps up to 192 feature channels at input resolution, and the upsampling
+    layers keep a few 64-channel maps at output resolution.
+
+    Args:
+        scale: Upscale factor of the network
+        precision: Precision the network runs in
+
+    Returns:
+        Estimated bytes per input pixel
+    """
+    values = 3 * 64 * scale * scale + 400
+    return values * (4 if precision == "fp32" else 2)
+
+
+def auto_tile_size(
+    width: int, height: int, scale: int, precision: UpscalePrecision, device: str
+) -> int:
+    """
+    Pick a tile size that keeps an upscale within the available memory.
+
+    Args:
+        width: Input width
+        height: Input height
+        scale: Upscale factor of the network
+        precision: Precision the network runs in
+        device: Device the network runs on
+
+    Returns:
+        Tile size in input pixels, or 0 if the whole image fits at once
+    """
+    budget = available_memory(device) * config.UPSCALE_MEMORY_FRACTION
+    per_pixel = upscale_bytes_per_pixel(scale, precision)
+    if width * height * per_pixel <= budget:
+        return 0
+    tile = int(math.sqrt(budget / per_pixel)) // 32 * 32
+    return max(MIN_TILE, min(MAX_TILE, tile))
+
+
+def precision_context(device: torch.device, precision: UpscalePrecision) -> Any:
+    """
+    Get the autocast context for running a network at a precision.
+
+    Autocast leaves the shared fp32 weights untouched, so each request can pick its own
+    precision.
+
+    Args:
+        device: Device the network runs on
+        precision: Requested precision
+
+    Returns:
+        Context manager
+
+    Raises:
+        ValueError: If the device does not support the precision
+    """
+    if precision == "fp32":
+        return contextlib.nullcontext()
+
+    import torch
+
+    if precision == "fp16":
+        if device.type != "cuda":
+            raise ValueError("fp16 upscaling requires a CUDA device; use bf16 on CPU")
+        return torch.autocast(device_type="cuda", dtype=torch.float16)
+    if precision == "bf16":
+        if device.type == "cuda" and not torch.cuda.is_bf16_supported():
+            raise ValueError("This GPU does not support bf16; use fp16")
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+    raise ValueError(f"Unknown precision: {precision}")
 
 
 class UpscaleManager:
     """Manages upscaling models and face restoration."""
 
-    def __init__(self):
-        """Initialize the upscale manager with empty cache."""
-        self.upscalers: dict[str, RealESRGANer] = {}
-        self.face_restorer: Any | None = None
+    def __init__(self, registry: ModelRegistry):
+        """
+        Initialize the upscale manager.
+
+        Args:
+            registry: Registry that holds loaded upscalers and face restorers
+        """
+        self.registry = registry
 
     def _get_upscaler(self, model: UpscaleModel, scale: int) -> RealESRGANer:
         """
@@ -41,10 +147,18 @@ class UpscaleManager:
             RealESRGANer instance
         """
         key = f"{model}_{scale}x"
-        if key in self.upscalers:
-            return self.upscalers[key]
+        return self.registry.get_or_load(
+            f"upscaler:{key}", lambda: self._load_upscaler(model, scale)
+        )
+
+    def _load_upscaler(self, model: UpscaleModel, scale: int) -> RealESRGANer:
+        """Build a RealESRGANer for the given model and scale."""
+        import torch
+        from basicsr.archs.rrdbnet_arch import RRDBNet
+        from realesrgan import RealESRGANer
 
-        print(f"Loading upscale model: {key}")
+        policy = inference_policy()
+        log_event("model_loading", kind="upscale", model=model, scale=scale)
 
         # Select model architecture and weights
         if model == "realesrgan":
@@ -73,13 +187,14 @@ class UpscaleManager:
             scale=netscale,
             model_path=f"https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/{model_name}.pth",
             model=model_arch,
-            tile=0,  # No tiling for smaller images
+            tile=0,  # Tiling and precision are handled per request by `upscale`
             tile_pad=10,
             pre_pad=0,
-            half=False,  # Use FP32 for better quality
+            half=False,  # Weights stay float32; `precision_context` autocasts per request
+            device=torch.device(policy.device),
         )
+        upscaler.model = policy.place(upscaler.model)
 
-        self.upscalers[key] = upscaler
         return upscaler
 
     def upscale(
@@ -87,30 +202,127 @@ class UpscaleManager:
         image: Image.Image,
         model: UpscaleModel = "realesrgan",
         factor: Literal[2, 4] = 2,
+        tile: int | None = None,
+        precision: UpscalePrecisionSetting | None = None,
+        progress: ProgressCallback | None = None,
     ) -> Image.Image:
         """
         Upscale an image using RealESRGAN or ESRGAN.
 
+        The image is processed in overlapping tiles with feathered seams. When the tile
+        size is picked automatically and the device still runs out of memory, the upscale
+        is retried with smaller tiles.
+
         Args:
             image: Input PIL Image
             model: Model to use (realesrgan or esrgan)
             factor: Upscale factor (2 or 4)
+            tile: Tile size in input pixels (None = pick from available memory, 0 = none)
+            precision: fp32, fp16 (CUDA only), bf16, or auto for the device policy's choice
+                (None = `UPSCALE_PRECISION`)
+            progress: Callback receiving (tile, total) progress (optional)
 
         Returns:
             Upscaled PIL Image
+
+        Raises:
+            ValueError: If the tile size or precision is invalid
         """
+        if tile is not None and 0 < tile < 32:
+            raise ValueError("Tile size must be 0 (no tiling) or at least 32")
+
+        import torch
+
+        setting = precision or config.UPSCALE_PRECISION
+        if setting == "auto":
+            precision = inference_policy().upscale_precision
+        elif setting in ("fp32", "fp16", "bf16"):
+            precision = setting
+        else:
+            raise ValueError(f"Unknown precision: {setting}")
         upscaler = self._get_upscaler(model, factor)
+        device = torch.device(upscaler.device)
+        pixels = np.asarray(image.convert("RGB"), dtype=np.float32) / 255
 
-        # Convert PIL to numpy array (RGB -> BGR for OpenCV)
-        img_array = np.array(image)
-        img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+        tile_size = tile
+        if tile_size is None:
+            tile_size = auto_tile_size(
+                image.width, image.height, upscaler.scale, precision, str(device)
+            )
 
-        # Upscale
-        output_array, _ = upscaler.enhance(img_array, outscale=factor)
+        while True:
+            try:
+                with torch.inference_mode(), precision_context(device, precision):
+                    return self._upscale_tiles(
+                        upscaler.model, pixels, upscaler.scale, device, tile_size, progress
+                    )
+            except torch.OutOfMemoryError:
+                longest = max(image.width, image.height)
+                if tile is not None or 0 < tile_size <= MIN_TILE:
+                    raise
+                if device.type == "cuda":
+                    torch.cuda.empty_cache()
+                tile_size = max(MIN_TILE, (tile_size or longest) // 2 // 32 * 32)
+                log_event("upscale_out_of_memory", logging.WARNING, retry_tile_size=tile_size)
 
-        # Convert back to PIL (BGR -> RGB)
-        output_array = cv2.cvtColor(output_array, cv2.COLOR_BGR2RGB)
-        return Image.fromarray(output_array)
+    def _upscale_tiles(
+        self,
+        network: torch.nn.Module,
+        pixels: np.ndarray,
+        scale: int,
+        device: torch.device,
+        tile_size: int,
+        progress: ProgressCallback | None,
+    ) -> Image.Image:
+        """Run the network over overlapping tiles and blend the results."""
+        height, width = pixels.shape[:2]
+        rows = tile_spans(height, tile_size, TILE_OVERLAP)
+        columns = tile_spans(width, tile_size, TILE_OVERLAP)
+        blender = TileBlender(width * scale, height * scale)
+
+        total = len(rows) * len(columns)
+        for row, (top, bottom) in enumerate(rows):
+            row_weights = feather(rows, row, scale)
+            for column, (left, right) in enumerate(columns):
+                # Step 1: Upscale the tile with some context around it
+                pad_top, pad_left = min(top, TILE_PAD), min(left, TILE_PAD)
+                crop = pixels[
+                    top - pad_top : min(height, bottom + TILE_PAD),
+                    left - pad_left : min(width, right + TILE_PAD),
+                ]
+                output = self._run_network(network, crop, scale, device)
+
+                # Step 2: Drop the context and blend the tile in
+                y, x = pad_top * scale, pad_left * scale
+                output = output[y : y + (bottom - top) * scale, x : x + (right - left) * scale]
+                weights = np.outer(row_weights, feather(columns, column, scale))
+                blender.add(output * 255, top * scale, left * scale, weights)
+
+                if progress is not None:
+                    progress(row * len(columns) + column + 1, total)
+
+        return blender.image()
+
+    def _run_network(
+        self, network: torch.nn.Module, pixels: np.ndarray, scale: int, device: torch.device
+    ) -> np.ndarray:
+        """Upscale an RGB array (values 0-1) with the network."""
+        import torch
+        import torch.nn.functional as F
+
+        tensor = torch.from_numpy(np.ascontiguousarray(pixels.transpose(2, 0, 1)))
+        tensor = tensor.unsqueeze(0).to(device)
+
+        # RRDBNet pixel-unshuffles its input at scales below 4, so pad to a multiple
+        modulus = {1: 4, 2: 2}.get(scale, 1)
+        height, width = tensor.shape[2:]
+        pad_bottom, pad_right = -height % modulus, -width % modulus
+        if pad_bottom or pad_right:
+            tensor = F.pad(tensor, (0, pad_right, 0, pad_bottom), mode="replicate")
+
+        output = network(tensor)[:, :, : height * scale, : width * scale]
+        output = output.float().clamp_(0, 1)
+        return output[0].permute(1, 2, 0).cpu().numpy()
 
     def face_restore(
         self,
@@ -131,27 +343,31 @@ class UpscaleManager:
             ImportError: If GFPGAN is not installed
         """
         if not GFPGAN_AVAILABLE:
-            raise ImportError(
-                "GFPGAN is not installed. Install with: pip install gfpgan"
-            )
+            raise ImportError("GFPGAN is not installed. Install with: pip install gfpgan")
 
         # Lazy load face restorer
-        if self.face_restorer is None:
-            print("Loading GFPGAN face restoration model")
-            self.face_restorer = GFPGANer(
+        def load() -> Any:
+            import torch
+            from gfpgan import GFPGANer
+
+            log_event("model_loading", kind="face_restore", model="gfpgan")
+            return GFPGANer(
                 model_path="https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.3.pth",
                 upscale=1,  # Don't upscale, just restore
                 arch="clean",
                 channel_multiplier=2,
                 bg_upsampler=None,
+                device=torch.device(inference_policy().device),
             )
 
+        face_restorer = self.registry.get_or_load("face-restorer:gfpgan", load)
+
         # Convert PIL to numpy array (RGB -> BGR)
         img_array = np.array(image)
         img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
 
         # Restore faces
-        _, _, output_array = self.face_restorer.enhance(
+        _, _, output_array = face_restorer.enhance(
             img_array, has_aligned=False, only_center_face=False, paste_back=True, weight=strength
         )
 
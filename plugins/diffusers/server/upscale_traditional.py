@@ -1,15 +1,34 @@
-"""Traditional upscaling methods and hybrid img2img upscaling."""
+"""
+Traditional upscaling methods and hybrid img2img upscaling.
 
-from typing import Literal
+Traditional upscaling only needs PIL and OpenCV; torch and diffusers are imported by the
+first img2img refinement.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Literal
 
 import cv2
 import numpy as np
-import torch
-from diffusers import StableDiffusionImg2ImgPipeline
 from PIL import Image
 
+from devices import inference_policy
+from pipelines import load_task_pipeline, native_resolution
+from progress import ProgressCallback, step_callback_kwargs
+from prompts import PromptEmbeddingCache
+from registry import ModelRegistry
+from tiling import TileBlender, feather, tile_spans
+from timing import run_pipeline
+
+if TYPE_CHECKING:
+    from diffusers import DiffusionPipeline
+
 UpscaleMethod = Literal["nearest", "bilinear", "bicubic", "lanczos", "area"]
 
+# Overlap between refinement tiles, as a fraction of the tile size
+TILE_OVERLAP_FRACTION = 1 / 8
+
 
 def traditional_upscale(
     image: Image.Image,
@@ -51,25 +70,22 @@ def traditional_upscale(
 class Img2ImgUpscaler:
     """Hybrid upscaler using traditional upscale + img2img refinement."""
 
-    def __init__(self):
-        """Initialize with empty pipeline cache."""
-        self.pipelines: dict[str, StableDiffusionImg2ImgPipeline] = {}
-
-    def _load_pipeline(self, model_id: str) -> StableDiffusionImg2ImgPipeline:
-        """Load or retrieve cached img2img pipeline."""
-        if model_id in self.pipelines:
-            return self.pipelines[model_id]
-
-        print(f"Loading img2img pipeline: {model_id}")
-        pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(
-            model_id, torch_dtype=torch.float16
-        )
+    def __init__(
+        self, registry: ModelRegistry, prompt_embeddings: PromptEmbeddingCache | None = None
+    ):
+        """
+        Initialize the upscaler.
 
-        if torch.cuda.is_available():
-            pipeline = pipeline.to("cuda")
+        Args:
+            registry: Registry that holds loaded pipelines
+            prompt_embeddings: Cache of encoded prompts (optional)
+        """
+        self.registry = registry
+        self.prompt_embeddings = prompt_embeddings or PromptEmbeddingCache(max_bytes=0)
 
-        self.pipelines[model_id] = pipeline
-        return pipeline
+    def _load_pipeline(self, model_id: str) -> DiffusionPipeline:
+        """Load or retrieve an img2img pipeline sharing the model's loaded weights."""
+        return load_task_pipeline(self.registry, model_id, "img2img")
 
     def upscale(
         self,
@@ -83,12 +99,17 @@ class Img2ImgUpscaler:
         guidance_scale: float = 7.5,
         negative_prompt: str | None = None,
         seed: int | None = None,
+        tile_size: int | None = None,
+        tile_batch_size: int = 4,
+        progress: ProgressCallback | None = None,
     ) -> Image.Image:
         """
         ComfyUI-style upscale: traditional upscale + img2img refinement.
 
         This gives better quality than pure traditional methods while being
-        faster than diffusion-only upscaling.
+        faster than diffusion-only upscaling. Upscaled images larger than the model's
+        native resolution are refined in overlapping native-size tiles that are feathered
+        back together, so memory stays flat and cost grows linearly with area.
 
         Args:
             image: Input PIL Image
@@ -101,31 +122,136 @@ class Img2ImgUpscaler:
             guidance_scale: Classifier-free guidance scale
             negative_prompt: Negative prompt (optional)
             seed: Random seed (optional)
+            tile_size: Refinement tile size (None = the model's native resolution when the
+                upscaled image is larger, 0 = refine the whole image in one pass)
+            tile_batch_size: Tiles refined per pipeline call
+            progress: Callback receiving (step, total) after each denoising step (optional)
 
         Returns:
             Upscaled and refined PIL Image
+
+        Raises:
+            ValueError: If the tile size or batch size is invalid
         """
+        if tile_size is not None and tile_size != 0 and (tile_size < 64 or tile_size % 8):
+            raise ValueError("Tile size must be 0 or a multiple of 8 of at least 64")
+        if tile_batch_size < 1:
+            raise ValueError("Tile batch size must be at least 1")
+
         # Step 1: Traditional upscale
         upscaled = traditional_upscale(image, upscale_method, factor)
 
         # Step 2: img2img refinement with low denoise
         pipeline = self._load_pipeline(model_id)
 
+        if tile_size is None:
+            native = native_resolution(pipeline)
+            tile_size = native if max(upscaled.size) > native else 0
+        if tile_size:
+            return self._refine_tiles(
+                pipeline,
+                upscaled.convert("RGB"),
+                prompt,
+                model_id,
+                tile_size,
+                tile_batch_size,
+                denoise_strength,
+                num_inference_steps,
+                guidance_scale,
+                negative_prompt,
+                seed,
+                progress,
+            )
+
         # Generator for seed
-        generator = None
-        if seed is not None:
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            generator = torch.Generator(device=device).manual_seed(seed)
+        generator = inference_policy().generator(seed) if seed is not None else None
 
         # img2img with low strength (high init image influence)
-        result = pipeline(
-            prompt=prompt,
+        result = run_pipeline(
+            pipeline,
+            **self.prompt_embeddings.pipeline_kwargs(pipeline, model_id, prompt, negative_prompt),
             image=upscaled,
             strength=denoise_strength,  # Low value = more faithful to input
             num_inference_steps=num_inference_steps,
             guidance_scale=guidance_scale,
-            negative_prompt=negative_prompt,
             generator=generator,
+            **step_callback_kwargs(progress, num_inference_steps),
         )
 
         return result.images[0]
+
+    def _refine_tiles(
+        self,
+        pipeline: DiffusionPipeline,
+        upscaled: Image.Image,
+        prompt: str,
+        model_id: str,
+        tile_size: int,
+        batch_size: int,
+        denoise_strength: float,
+        num_inference_steps: int,
+        guidance_scale: float,
+        negative_prompt: str | None,
+        seed: int | None,
+        progress: ProgressCallback | None,
+    ) -> Image.Image:
+        """
+        Refine an upscaled image in overlapping tiles and feather them back together.
+
+        Tiles are refined in row-major batches. Each tile gets its own generator (seeded
+        with `seed + index`), so the batch size does not change the noise a tile gets.
+        """
+        width, height = upscaled.size
+        overlap = int(tile_size * TILE_OVERLAP_FRACTION)
+        rows = tile_spans(height, tile_size, overlap)
+        columns = tile_spans(width, tile_size, overlap)
+        tiles = [(row, column) for row in range(len(rows)) for column in range(len(columns))]
+        batches = [tiles[start : start + batch_size] for start in range(0, len(tiles), batch_size)]
+        policy = inference_policy()
+        blender = TileBlender(width, height)
+
+        def batch_progress(number: int) -> ProgressCallback | None:
+            """Report a batch's denoising steps as progress across all batches."""
+            if progress is None:
+                return None
+            report = progress
+            return lambda step, total: report(number * total + step, len(batches) * total)
+
+        for number, batch in enumerate(batches):
+            # Step 1: Crop the batch's tiles, each with its own generator
+            boxes = [
+                (columns[column][0], rows[row][0], columns[column][1], rows[row][1])
+                for row, column in batch
+            ]
+            crops = [upscaled.crop(box) for box in boxes]
+            generators = [
+                policy.generator(None if seed is None else seed + row * len(columns) + column)
+                for row, column in batch
+            ]
+
+            # Step 2: Refine the batch (every tile has the same size)
+            result = run_pipeline(
+                pipeline,
+                **self.prompt_embeddings.pipeline_kwargs(
+                    pipeline, model_id, [prompt] * len(crops), [negative_prompt] * len(crops)
+                ),
+                image=crops,
+                strength=denoise_strength,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                generator=generators,
+                **step_callback_kwargs(batch_progress(number), num_inference_steps),
+            )
+
+            # Step 3: Feather the refined tiles into the output
+            for (row, column), box, crop, tile in zip(
+                batch, boxes, crops, result.images, strict=True
+            ):
+                if tile.size != crop.size:
+                    # The pipeline rounds sizes down to a multiple of the VAE scale factor
+                    tile = tile.resize(crop.size, Image.LANCZOS)
+                weights = np.outer(feather(rows, row), feather(columns, column))
+                pixels = np.asarray(tile.convert("RGB"), dtype=np.float32)
+                blender.add(pixels, box[1], box[0], weights)
+
+        return blender.image()
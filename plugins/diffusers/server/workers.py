@@ -0,0 +1,711 @@
+"""
+Worker processes that run inference, with model-affinity routing.
+
+By default inference runs on threads of the server process, which share one GIL, one
+CUDA context, and one model registry. With `VIWO_DIFFUSERS_WORKERS` set, the server
+process only handles HTTP, caching, batching, and encoding, and hands each inference
+task to one of several worker processes. Every worker is pinned to a device (or to its
+share of the CPU cores), has its own model registry, and runs one task at a time.
+Workers import the `inference` module rather than the server, so they never create or
+touch the server's caches, image store, quotas, or jobs.
+
+Loading a model costs far more than waiting for a busy worker, so a task goes to a
+worker that already has its model loaded. Only when that worker already holds
+`WORKER_MAX_PENDING` tasks does the task go to the least loaded worker, which loads the
+model too. Images cross the process boundary through shared memory instead of being
+pickled through the task queues. Each worker reports back on a pipe of its own, so a
+worker killed mid-message cannot block the others. A worker that exits is restarted, and
+runs the warm-up tasks (the server's preload steps) before it takes requests again.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import wait
+from typing import Any
+
+from PIL import Image
+
+import config
+from devices import available_cpus, cuda_device_count, detect_device
+from logs import configure_logging, log_event
+from previews import LatentPreviewer
+from progress import ProgressCallback
+from timing import RequestTiming, record, recording
+
+# How often workers unload idle models and the pool checks that workers are alive, in seconds
+_POLL_INTERVAL = 1.0
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised for tasks whose worker process exited before finishing them."""
+
+
+class TaskCancelledError(Exception):
+    """Raised in a worker when the server cancelled the task it is running."""
+
+
+@dataclass(frozen=True)
+class SharedImage:
+    """A PIL image copied into a shared memory block, to be taken by another process."""
+
+    name: str  # shared memory block
+    mode: str
+    size: tuple[int, int]
+
+    @classmethod
+    def share(cls, image: Image.Image) -> SharedImage:
+        """
+        Copy an image into a new shared memory block.
+
+        The block belongs to whoever takes the image; this process does not unlink it.
+
+        Args:
+            image: Image to share (not palette-based)
+
+        Returns:
+            Descriptor of the shared image
+        """
+        data = image.tobytes()
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(create=True, size=max(1, len(data)), track=False)
+        else:
+            block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+            # Otherwise this process's resource tracker unlinks the block when it exits
+            resource_tracker.unregister(block._name, "shared_memory")  # type: ignore[attr-defined]
+        block.buf[: len(data)] = data
+        block.close()
+        return cls(block.name, image.mode, image.size)
+
+    def take(self) -> Image.Image:
+        """Copy the image out of its shared memory block and free the block."""
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            return Image.frombytes(self.mode, self.size, block.buf)
+        finally:
+            block.close()
+            block.unlink()
+
+    def discard(self) -> None:
+        """Free the shared memory block without reading it."""
+        try:
+            block = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        block.close()
+        block.unlink()
+
+
+def share_images(value: Any) -> Any:
+    """Replace the images in a value (and its lists, tuples, and dicts) with shared images."""
+    if isinstance(value, Image.Image) and value.mode != "P":
+        return SharedImage.share(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(share_images(item) for item in value)
+    if isinstance(value, dict):
+        return {key: share_images(item) for key, item in value.items()}
+    return value
+
+
+def take_images(value: Any) -> Any:
+    """Replace the shared images in a value with the images, freeing their blocks."""
+    if isinstance(value, SharedImage):
+        return value.take()
+    if isinstance(value, (list, tuple)):
+        return type(value)(take_images(item) for item in value)
+    if isinstance(value, dict):
+        return {key: take_images(item) for key, item in value.items()}
+    return value
+
+
+def discard_images(value: Any) -> None:
+    """Free the blocks of shared images that will never be taken."""
+    if isinstance(value, SharedImage):
+        value.discard()
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            discard_images(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            discard_images(item)
+
+
+@dataclass(frozen=True)
+class WorkerSpec:
+    """Where a worker process runs."""
+
+    index: int
+    device: str  # e.g. "cuda:1" or "cpu"
+    cpus: tuple[int, ...] = ()  # CPU cores the worker is pinned to (empty = not pinned)
+    cpu_threads: int = 0  # PyTorch intra-op threads on CPU (0 = the device policy's default)
+    shared_by: int = 1  # workers sharing the device, which split its memory budget
+
+
+def plan_workers(count: int, devices: list[str] | None = None) -> list[WorkerSpec]:
+    """
+    Assign devices and CPU cores to worker processes.
+
+    Devices are assigned round-robin. Without configured devices every visible GPU gets
+    workers when there are several, otherwise all workers use the configured device.
+    Workers on CPU split the cores this process may use between them.
+
+    Args:
+        count: Number of workers
+        devices: Devices to assign (default: `WORKER_DEVICES`)
+
+    Returns:
+        One spec per worker
+    """
+    devices = devices if devices is not None else config.WORKER_DEVICES
+    if not devices:
+        configured = detect_device() if config.DEVICE == "auto" else config.DEVICE
+        gpus = cuda_device_count() if configured == "cuda" else 0
+        devices = [f"cuda:{index}" for index in range(gpus)] if gpus > 1 else [configured]
+    assigned = [devices[index % len(devices)] for index in range(count)]
+
+    # Step 1: Split the CPU cores between the workers on CPU
+    on_cpu = [index for index, device in enumerate(assigned) if device == "cpu"]
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = []
+    core_sets: dict[int, tuple[int, ...]] = {}
+    if on_cpu and len(cores) >= len(on_cpu):
+        for number, index in enumerate(on_cpu):
+            start = number * len(cores) // len(on_cpu)
+            end = (number + 1) * len(cores) // len(on_cpu)
+            core_sets[index] = tuple(cores[start:end])
+    # The CPU quota may be smaller than the set of cores, so threads follow the quota
+    threads = max(1, available_cpus() // len(on_cpu)) if on_cpu else 0
+
+    # Step 2: Describe each worker
+    return [
+        WorkerSpec(
+            index=index,
+            device=device,
+            cpus=core_sets.get(index, ()),
+            cpu_threads=threads if device == "cpu" else 0,
+            shared_by=assigned.count(device),
+        )
+        for index, device in enumerate(assigned)
+    ]
+
+
+@dataclass
+class _Task:
+    """A task sent to a worker."""
+
+    id: int
+    name: str
+    kwargs: dict[str, Any]  # images replaced by `SharedImage`s
+    progress: bool  # whether to report progress
+    preview: tuple[int, tuple[int, int] | None] | None  # preview interval and size
+
+
+def _progress_proxy(task: _Task, outbox: Any, cancel: Any) -> ProgressCallback | None:
+    """Build the progress callback of a task, forwarding updates to the server."""
+    if not task.progress:
+        return None
+
+    def report(step: int, total: int) -> None:
+        if cancel.value == task.id:
+            raise TaskCancelledError(f"Task {task.id} was cancelled")
+        outbox.send(("progress", task.id, step, total))
+
+    if task.preview is None:
+        return report
+
+    def on_preview(step: int, total: int, image: Image.Image) -> None:
+        outbox.send(("preview", task.id, step, total, share_images(image)))
+
+    every, size = task.preview
+    return LatentPreviewer(report, on_preview, every=every, size=size)
+
+
+def _serve(
+    spec: WorkerSpec,
+    module: str,
+    warmup: list[tuple[str, dict[str, Any]]],
+    inbox: Any,
+    outbox: Any,
+    cancel: Any,
+) -> None:
+    """Run tasks in a worker process until the server sends None."""
+    # Step 1: Pin the worker and configure inference before importing it
+    if spec.cpus:
+        os.sched_setaffinity(0, spec.cpus)
+    config.WORKERS = 0
+    config.DEVICE = spec.device
+    if spec.cpu_threads and not config.CPU_THREADS:
+        config.CPU_THREADS = spec.cpu_threads
+    if not config.MODEL_MEMORY_BUDGET_MB and spec.shared_by > 1:
+        from registry import default_memory_budget
+
+        budget = default_memory_budget(spec.device) // spec.shared_by
+        config.MODEL_MEMORY_BUDGET_MB = budget / 1024**2
+
+    configure_logging(config.LOG_LEVEL)
+    tasks = importlib.import_module(module)
+
+    if config.WORKER_INITIALIZER:
+        initializer, _, function = config.WORKER_INITIALIZER.partition(":")
+        getattr(importlib.import_module(initializer), function)(tasks)
+
+    # Step 2: Warm up (after a restart) before reporting ready, so no request finds it cold
+    for name, kwargs in warmup:
+        try:
+            tasks.run_task_locally(name, None, kwargs)
+        except Exception as error:
+            log_event(
+                "worker_warmup_failed", logging.ERROR, worker=spec.index, task=name, exc_info=error
+            )
+    registry = tasks.model_registry
+    outbox.send(("ready", spec.index, registry.stats()))
+
+    # Step 3: Run tasks one at a time, unloading idle models in between
+    while True:
+        try:
+            task = inbox.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            registry.evict_idle()
+            continue
+        if task is None:
+            break
+
+        timing = RequestTiming()
+        try:
+            kwargs = take_images(task.kwargs)
+            with recording(timing):
+                result = tasks.run_task_locally(
+                    task.name, _progress_proxy(task, outbox, cancel), kwargs
+                )
+            message: tuple[Any, ...] = ("done", task.id, share_images(result))
+        except Exception as error:
+            try:
+                pickle.dumps(error)
+            except Exception:
+                error = RuntimeError(f"{type(error).__name__}: {error}")
+            message = ("failed", task.id, error)
+        registry.evict_idle()
+        outbox.send((*message, timing.stages, spec.index, registry.stats()))
+
+
+@contextlib.contextmanager
+def _hidden_main() -> Iterator[None]:
+    """
+    Keep processes spawned meanwhile from importing this process's `__main__` module.
+
+    Spawned processes normally run the parent's main script again, as `__mp_main__`. Under
+    `python main.py` that would build the server's stores in every worker, and workers
+    only need this module and the inference module.
+    """
+    main = sys.modules["__main__"]
+    saved = {name: main.__dict__[name] for name in ("__file__", "__spec__") if name in vars(main)}
+    main.__dict__.pop("__file__", None)
+    main.__spec__ = None
+    try:
+        yield
+    finally:
+        main.__dict__.update(saved)
+
+
+@dataclass
+class _Call:
+    """A task waiting for its worker."""
+
+    worker: _Worker
+    task: _Task
+    affinity: str | None
+    progress: ProgressCallback | None
+    future: concurrent.futures.Future[Any] = field(default_factory=concurrent.futures.Future)
+    error: Exception | None = None  # raised by the progress callback, e.g. on cancellation
+    stages: dict[str, float] = field(default_factory=dict)  # timings recorded by the worker
+
+
+@dataclass
+class _Worker:
+    """A worker process and what the server knows about it."""
+
+    spec: WorkerSpec
+    process: Any = None
+    inbox: Any = None
+    messages: Any = None  # read end of the pipe the worker reports on
+    cancel: Any = None
+    ready: bool = False
+    failed: bool = False  # exited before it became ready; not restarted
+    pending: int = 0  # tasks sent and not yet finished
+    completed: int = 0
+    restarts: int = 0
+    models: set[str] = field(default_factory=set)  # registry keys it reported loaded
+    routed: Counter[str] = field(default_factory=Counter)  # affinity keys of pending tasks
+    registry: dict[str, Any] = field(default_factory=dict)  # its last registry statistics
+
+    def holds(self, key: str) -> bool:
+        """Whether the worker has a model loaded, or is about to load it for a pending task."""
+        return key in self.models or self.routed[key] > 0
+
+
+class WorkerPool:
+    """Runs inference tasks on worker processes, routing each to a worker with its model."""
+
+    def __init__(
+        self,
+        specs: list[WorkerSpec],
+        max_pending: int = 2,
+        warmup: list[tuple[str, dict[str, Any]]] | None = None,
+        module: str = "inference",
+    ):
+        """
+        Initialize the pool; no process starts until `start`.
+
+        Args:
+            specs: Workers to run
+            max_pending: Tasks a worker may hold before tasks for its models go elsewhere
+            warmup: Tasks (name and arguments) a restarted worker runs before it reports
+                ready, e.g. the server's preload steps
+            module: Module the workers import, with `run_task_locally` and `model_registry`
+        """
+        self.max_pending = max(1, max_pending)
+        self.warmup = list(warmup or [])
+        self.module = module
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(spec) for spec in specs]
+        self._calls: dict[int, _Call] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._reader: threading.Thread | None = None
+        self._stopping = False
+        self._routes: Counter[str] = Counter()  # "hit", "load", or "overflow"
+
+    @property
+    def size(self) -> int:
+        """Number of workers."""
+        return len(self._workers)
+
+    @property
+    def ready(self) -> bool:
+        """Whether every worker has started and, after a restart, warmed up again."""
+        return all(worker.ready for worker in self._workers)
+
+    def start(self) -> None:
+        """Start the worker processes and the thread that reads their messages."""
+        for worker in self._workers:
+            self._spawn(worker)
+        self._reader = threading.Thread(target=self._read, name="worker-pool", daemon=True)
+        self._reader.start()
+
+    def _spawn(self, worker: _Worker) -> None:
+        """Start a worker's process with a fresh task queue and message pipe."""
+        # At startup the server preloads every worker itself; restarted workers warm up alone
+        warmup = self.warmup if worker.restarts else []
+        worker.inbox = self._context.Queue()
+        worker.messages, outbox = self._context.Pipe(duplex=False)
+        worker.cancel = self._context.Value("q", 0, lock=False)
+        worker.process = self._context.Process(
+            target=_serve,
+            args=(worker.spec, self.module, warmup, worker.inbox, outbox, worker.cancel),
+            name=f"inference-worker-{worker.spec.index}",
+            daemon=True,
+        )
+        with _hidden_main():
+            worker.process.start()
+        # Only the worker writes to the pipe, so reading it fails once the worker exits
+        outbox.close()
+        log_event(
+            "worker_started",
+            worker=worker.spec.index,
+            pid=worker.process.pid,
+            device=worker.spec.device,
+            cpus=list(worker.spec.cpus),
+        )
+
+    def _choose(self, affinity: str | None) -> _Worker:
+        """Pick the worker for a task; called with the lock held."""
+        workers = [worker for worker in self._workers if not worker.failed]
+        if not workers:
+            raise RuntimeError("No inference worker is running")
+        # Restarted workers warming up only take tasks when no worker is ready
+        workers = [worker for worker in workers if worker.ready] or workers
+
+        if affinity is not None:
+            holding = [worker for worker in workers if worker.holds(affinity)]
+            if holding:
+                best = min(holding, key=lambda worker: worker.pending)
+                if best.pending < self.max_pending:
+                    self._routes["hit"] += 1
+                    return best
+                self._routes["overflow"] += 1
+            else:
+                self._routes["load"] += 1
+        # Among equally busy workers, the one with the fewest models has the most room
+        return min(workers, key=lambda worker: (worker.pending, len(worker.models)))
+
+    def call(
+        self,
+        task: str,
+        kwargs: dict[str, Any],
+        progress: ProgressCallback | None = None,
+        affinity: str | None = None,
+    ) -> Any:
+        """
+        Run a task on a worker and wait for its result.
+
+        Blocks the calling thread; the server calls it from its inference executor. Stage
+        timings recorded by the worker are added to the current requests.
+
+        Args:
+            task: Name of a task in the server's `INFERENCE_TASKS`
+            kwargs: Task arguments; images are passed through shared memory
+            progress: Callback receiving the worker's progress updates (optional)
+            affinity: Registry key of the model the task needs (optional)
+
+        Returns:
+            The task's result
+
+        Raises:
+            WorkerCrashedError: If the worker exited while running the task
+            Exception: Whatever the task or the progress callback raised
+        """
+        with self._lock:
+            worker = self._choose(affinity)
+            call = self._send(worker, task, kwargs, progress, affinity)
+        return self._wait(call)
+
+    def broadcast(self, task: str, kwargs: dict[str, Any]) -> list[Any]:
+        """
+        Run a task on every worker, e.g. to preload a model everywhere.
+
+        Args:
+            task: Name of a task in the server's `INFERENCE_TASKS`
+            kwargs: Task arguments
+
+        Returns:
+            Each worker's result, in worker order
+        """
+        with self._lock:
+            calls = [
+                self._send(worker, task, kwargs, None, None)
+                for worker in self._workers
+                if not worker.failed
+            ]
+        return [self._wait(call) for call in calls]
+
+    def _send(
+        self,
+        worker: _Worker,
+        name: str,
+        kwargs: dict[str, Any],
+        progress: ProgressCallback | None,
+        affinity: str | None,
+    ) -> _Call:
+        """Queue a task on a worker; called with the lock held."""
+        preview = None
+        if isinstance(progress, LatentPreviewer):
+            preview = (progress.every, progress.size)
+        task = _Task(next(self._ids), name, share_images(kwargs), progress is not None, preview)
+        call = _Call(worker, task, affinity, progress)
+        self._calls[task.id] = call
+        worker.pending += 1
+        if affinity is not None:
+            worker.routed[affinity] += 1
+        worker.inbox.put(task)
+        return call
+
+    def _wait(self, call: _Call) -> Any:
+        """Wait for a call's result and record the worker's stage timings."""
+        try:
+            return take_images(call.future.result())
+        finally:
+            for name, seconds in call.stages.items():
+                record(name, seconds)
+
+    def _finish(self, call: _Call) -> None:
+        """Forget a finished call; called with the lock held."""
+        self._calls.pop(call.task.id, None)
+        call.worker.pending -= 1
+        if call.affinity is not None:
+            call.worker.routed[call.affinity] -= 1
+            if call.worker.routed[call.affinity] <= 0:
+                del call.worker.routed[call.affinity]
+
+    def _read(self) -> None:
+        """Handle the workers' messages, and restart workers that exited."""
+        while not self._stopping:
+            pipes = {worker.messages: worker for worker in self._workers if worker.messages}
+            for pipe in wait(list(pipes), timeout=_POLL_INTERVAL):
+                try:
+                    message = pipe.recv()
+                except (EOFError, OSError):
+                    # The worker exited; `_check_workers` fails its tasks and restarts it
+                    pipe.close()
+                    pipes[pipe].messages = None
+                    continue
+                try:
+                    self._handle(message)
+                except Exception as error:
+                    log_event("worker_message_failed", logging.ERROR, exc_info=error)
+            self._check_workers()
+
+    def _handle(self, message: tuple[Any, ...]) -> None:
+        """Handle one message from a worker."""
+        kind = message[0]
+        if kind == "ready":
+            _, index, registry = message
+            worker = self._workers[index]
+            with self._lock:
+                worker.ready = True
+                worker.registry = registry
+                worker.models = {model["key"] for model in registry["models"]}
+            log_event("worker_ready", worker=index, pid=worker.process.pid)
+            return
+
+        call = self._calls.get(message[1])
+        if kind in ("progress", "preview"):
+            if call is None or call.progress is None or call.error is not None:
+                discard_images(message[4:])
+                return
+            try:
+                if kind == "progress":
+                    call.progress(message[2], message[3])
+                else:
+                    assert isinstance(call.progress, LatentPreviewer)
+                    call.progress.on_preview(message[2], message[3], take_images(message[4]))
+            except Exception as error:
+                # Abort the task at its next step, and raise this error instead of the worker's
+                call.error = error
+                call.worker.cancel.value = call.task.id
+            return
+
+        # "done" or "failed"
+        _, _, payload, stages, index, registry = message
+        worker = self._workers[index]
+        with self._lock:
+            worker.completed += 1
+            worker.registry = registry
+            worker.models = {model["key"] for model in registry["models"]}
+            if call is not None:
+                self._finish(call)
+        if call is None or (kind == "done" and call.error is not None):
+            discard_images(payload)
+        if call is None:
+            return
+        call.stages = stages
+        if kind == "done" and call.error is None:
+            call.future.set_result(payload)
+        else:
+            call.future.set_exception(call.error or payload)
+
+    def _check_workers(self) -> None:
+        """Fail the tasks of workers that exited, and restart those that had started."""
+        for worker in self._workers:
+            if self._stopping:
+                return
+            if worker.failed or worker.process is None or worker.process.is_alive():
+                continue
+            if worker.messages is not None:
+                continue  # read what it sent before exiting first
+            exitcode = worker.process.exitcode
+            error = WorkerCrashedError(
+                f"Inference worker {worker.spec.index} exited with code {exitcode}"
+            )
+            with self._lock:
+                calls = [call for call in self._calls.values() if call.worker is worker]
+                for call in calls:
+                    self._finish(call)
+                worker.models.clear()
+                worker.registry = {}
+                worker.failed = not worker.ready
+                worker.ready = False
+            for call in calls:
+                discard_images(call.task.kwargs)
+                call.future.set_exception(error)
+            log_event(
+                "worker_exited",
+                logging.ERROR,
+                worker=worker.spec.index,
+                exitcode=exitcode,
+                failed_tasks=len(calls),
+                restarting=not worker.failed,
+            )
+            if not worker.failed:
+                worker.restarts += 1
+                self._spawn(worker)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Get worker statistics.
+
+        Returns:
+            Dictionary with routing counters and, per worker, its device, load, and the
+            models it has loaded
+        """
+        with self._lock:
+            workers = [
+                {
+                    "index": worker.spec.index,
+                    "device": worker.spec.device,
+                    "cpus": list(worker.spec.cpus),
+                    "pid": worker.process.pid if worker.process is not None else None,
+                    "ready": worker.ready,
+                    "pending": worker.pending,
+                    "completed": worker.completed,
+                    "restarts": worker.restarts,
+                    "models": sorted(worker.models),
+                    "resident_bytes": worker.registry.get("resident_bytes", 0),
+                    "budget_bytes": worker.registry.get("budget_bytes"),
+                }
+                for worker in self._workers
+            ]
+        return {
+            "ready": self.ready,
+            "max_pending": self.max_pending,
+            "routes": {kind: self._routes[kind] for kind in ("hit", "load", "overflow")},
+            "workers": workers,
+        }
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """
+        Stop the workers, failing tasks they have not finished.
+
+        Args:
+            timeout: Seconds to wait for the workers to exit before killing them
+        """
+        self._stopping = True
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+        if self._reader is not None:
+            self._reader.join(2 * _POLL_INTERVAL)
+        for worker in self._workers:
+            if worker.messages is not None:
+                worker.messages.close()
+                worker.messages = None
+        with self._lock:
+            calls = list(self._calls.values())
+            self._calls.clear()
+        for call in calls:
+            if not call.future.done():
+                call.future.set_exception(WorkerCrashedError("Inference workers shut down"))
@@ -60,7 +60,7 @@ export class ControlNetCapability extends BaseCapability {
           image, // base64 encoded
           type: controlType,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -70,7 +70,7 @@ export class ControlNetCapability extends BaseCapability {
       }
 
       const result = await response.json();
-      return result; // { image: base64string, width, height, format }
+      return result; // { image: base64string, width, height, format, handle }
     } catch (error: any) {
       throw new ScriptError(`controlnet.preprocess failed: ${error.message}`);
     }
@@ -110,11 +110,15 @@ export class ControlNetCapability extends BaseCapability {
       throw new ScriptError(`controlnet.apply: model '${modelId}' not allowed`);
     }
 
+    // A handle from preprocess() refers to a control image cached on the server
+    const isHandle = controlImage.startsWith("ctl_");
+
     // Make HTTP request to server
     try {
       const response = await fetch(`${serverUrl}/controlnet/generate`, {
         body: JSON.stringify({
-          control_image: controlImage, // base64 encoded
+          control_handle: isHandle ? controlImage : undefined,
+          control_image: isHandle ? undefined : controlImage, // base64 encoded
           guidance_scale: guidanceScale,
           height,
           model_id: modelId,
@@ -126,7 +130,7 @@ export class ControlNetCapability extends BaseCapability {
           type: controlType,
           width,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
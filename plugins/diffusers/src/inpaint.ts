@@ -21,6 +21,8 @@ export class InpaintCapability extends BaseCapability {
       negative_prompt_2?: string;
       seed?: number;
       max_compute?: number;
+      mode?: "full" | "crop";
+      context_margin?: number;
     } = {},
     ctx?: any,
   ) {
@@ -51,11 +53,13 @@ export class InpaintCapability extends BaseCapability {
     try {
       const response = await fetch(`${serverUrl}/inpaint`, {
         body: JSON.stringify({
+          context_margin: params.context_margin,
           guidance_scale: params.guidance_scale ?? 7.5,
           height: params.height,
           image,
           mask,
           max_compute: params.max_compute,
+          mode: params.mode,
           model_id: params.model_id ?? "runwayml/stable-diffusion-inpainting",
           negative_prompt: params.negative_prompt,
           negative_prompt_2: params.negative_prompt_2,
@@ -66,7 +70,7 @@ export class InpaintCapability extends BaseCapability {
           strength: params.strength ?? 0.8,
           width: params.width,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -98,6 +102,7 @@ export class InpaintCapability extends BaseCapability {
       negative_prompt_2?: string;
       seed?: number;
       max_compute?: number;
+      context?: number;
     } = {},
     ctx?: any,
   ) {
@@ -131,6 +136,7 @@ export class InpaintCapability extends BaseCapability {
     try {
       const response = await fetch(`${serverUrl}/outpaint`, {
         body: JSON.stringify({
+          context: params.context,
           direction,
           guidance_scale: params.guidance_scale ?? 7.5,
           image,
@@ -145,7 +151,7 @@ export class InpaintCapability extends BaseCapability {
           seed: params.seed,
           strength: params.strength ?? 0.8,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -53,7 +53,7 @@ export class DiffusersGenerate extends BaseCapability {
           seed: options?.seed ?? undefined,
           width: options?.width ?? undefined,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -41,7 +41,7 @@ export class UpscaleCapability extends BaseCapability {
           image,
           model,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -85,7 +85,7 @@ export class UpscaleCapability extends BaseCapability {
           image,
           strength,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -147,7 +147,7 @@ export class UpscaleCapability extends BaseCapability {
           image,
           method,
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 
@@ -213,7 +213,7 @@ export class UpscaleCapability extends BaseCapability {
           seed: params.seed,
           upscale_method: params.upscale_method ?? "lanczos",
         }),
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Caller-Id": String(this.ownerId) },
         method: "POST",
       });
 